@@ -0,0 +1,198 @@
+"""
+Cash-flow analytics over both ledgers: running balance, rolling spend,
+period-over-period change and burn rate.
+
+CashFlow buckets the dated expense and income rows by day (one bincount
+each) and keeps the cumulative sums. The amount in any window of days is
+then the difference of two prefix sums, so every query below is O(1)
+after the O(n) build, and series (running balance, rolling spend) are a
+vectorized difference over the window. CashFlowCache keeps a ledger's
+CashFlow until either table changes. Rows without a valid date are left out.
+"""
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+
+ROLLING_WINDOWS = (7, 30, 90)
+
+
+def _day(value):
+    """
+    Days since 1970-01-01 of a YYYY-MM-DD string or date; None (no bound)
+    for an empty, invalid or NaT value
+    """
+    if not value:
+        return None
+    try:
+        day = np.datetime64(value, 'D')
+    except (ValueError, TypeError):
+        return None
+    return None if np.isnat(day) else int(day.astype(np.int64))
+
+
+def _valid(value):
+    """value as YYYY-MM-DD, or None when it isn't a valid date"""
+    day = _day(value)
+    return None if day is None else str(np.datetime64(day, 'D'))
+
+
+def _shift(value, days):
+    """The YYYY-MM-DD date days after value"""
+    return str(np.datetime64(value, 'D') + np.timedelta64(days, 'D'))
+
+
+def _daily_prefix(table, first, days):
+    """Prefix sums (length days + 1) of a table's amounts per day from first"""
+    dates = table.dates
+    dated = ~np.isnat(dates)
+    offsets = dates[dated].astype(np.int64) - first
+    daily = np.bincount(offsets, weights=table.amounts[dated], minlength=days)
+    prefix = np.zeros(days + 1)
+    np.cumsum(daily, out=prefix[1:])
+    return prefix
+
+
+class CashFlow:
+    """Daily prefix sums of spending and income"""
+
+    def __init__(self, expenses, income):
+        with expenses.lock, income.lock:
+            days = [
+                table.dates[~np.isnat(table.dates)].astype(np.int64)
+                for table in (expenses, income)
+            ]
+            days = [d for d in days if len(d)]
+            if days:
+                self.first = int(min(d.min() for d in days))
+                self.size = int(max(d.max() for d in days)) - self.first + 1
+            else:
+                self.first, self.size = 0, 0
+            self._spent = _daily_prefix(expenses, self.first, self.size)
+            self._earned = _daily_prefix(income, self.first, self.size)
+
+    def nbytes(self):
+        """Memory held by the prefix sums"""
+        return self._spent.nbytes + self._earned.nbytes
+
+    def _index(self, day):
+        """Position in the prefix arrays of the sum up to and including day"""
+        return min(max(day - self.first + 1, 0), self.size)
+
+    def _window(self, prefix, start, end):
+        start, end = _day(start), _day(end)
+        lo = self._index(start - 1) if start is not None else 0
+        hi = self._index(end) if end is not None else self.size
+        return float(prefix[hi] - prefix[lo]) if hi > lo else 0.0
+
+    def spent(self, start=None, end=None):
+        """Expenses dated start..end inclusive (either may be None)"""
+        return self._window(self._spent, start, end)
+
+    def earned(self, start=None, end=None):
+        """Income dated start..end inclusive (either may be None)"""
+        return self._window(self._earned, start, end)
+
+    def balance(self, day):
+        """Running balance (all income minus all expenses) at the end of day"""
+        i = self._index(_day(day))
+        return float(self._earned[i] - self._spent[i])
+
+    def rolling_spend(self, days, end):
+        """Expenses in the days-day window ending on end"""
+        return self.spent(_shift(end, 1 - days), end)
+
+    def _series_days(self, start, end, max_points):
+        """
+        Days start..end, or with max_points every step-th of them so there
+        are at most that many (always including end)
+        """
+        first, last = _day(start), _day(end)
+        if first is None or last is None or last < first:
+            return np.zeros(0, dtype=np.int64), []
+        count = last - first + 1
+        step = -(-count // max_points) if max_points and count > max_points else 1
+        days = last - np.arange(0, count, step)[::-1]
+        return days, np.datetime_as_string(days.astype('datetime64[D]')).tolist()
+
+    def balance_series(self, start, end, max_points=None):
+        """(labels, running balance at the end of each day start..end)"""
+        days, labels = self._series_days(start, end, max_points)
+        index = np.clip(days - self.first + 1, 0, self.size)
+        return labels, self._earned[index] - self._spent[index]
+
+    def rolling_series(self, window, start, end, max_points=None):
+        """(labels, expenses in the window days ending on each day start..end)"""
+        days, labels = self._series_days(start, end, max_points)
+        hi = np.clip(days - self.first + 1, 0, self.size)
+        lo = np.clip(days - window - self.first + 1, 0, self.size)
+        return labels, self._spent[hi] - self._spent[lo]
+
+    def summary(self, start_date=None, end_date=None, today=None):
+        """
+        Figures for the period start_date..end_date (default: from the
+        first dated row to today): spending and income, net, change against
+        the same length of time just before, daily burn rate, rolling spend
+        as of the end, and the running balance at the end
+        """
+        today = today or date.today()
+        end = _valid(end_date) or today.isoformat()
+        start = _valid(start_date)
+        if start is None and self.size:
+            # All-time: from the first dated row
+            start = str(np.datetime64(self.first, 'D'))
+        elif start is None:
+            start = (date.fromisoformat(end) - timedelta(days=29)).isoformat()
+        length = max(_day(end) - _day(start) + 1, 1)
+        previous_end = _shift(start, -1)
+        previous_start = _shift(start, -length)
+
+        spent = self.spent(start, end)
+        earned = self.earned(start, end)
+        previous = self.spent(previous_start, previous_end)
+        burn_rate = spent / length
+        balance = self.balance(end)
+        return {
+            'start': start,
+            'end': end,
+            'days': length,
+            'spent': spent,
+            'earned': earned,
+            'net': earned - spent,
+            'previous_spent': previous,
+            'spent_change': spent - previous,
+            'spent_change_pct': (
+                (spent - previous) / previous * 100 if previous else None
+            ),
+            'burn_rate': burn_rate,
+            'balance': balance,
+            # Days the balance would last at this burn rate
+            'runway_days': (
+                balance / burn_rate if burn_rate > 0 and balance > 0 else None
+            ),
+            'rolling': {
+                f'{days}d': self.rolling_spend(days, end) for days in ROLLING_WINDOWS
+            },
+        }
+
+
+class CashFlowCache:
+    """One ledger's CashFlow, rebuilt only after either of its tables changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._key = None
+        self._flow = None
+
+    def get(self, expenses, income):
+        key = (expenses.version_key(), income.version_key())
+        with self._lock:
+            if self._key != key:
+                self._flow = CashFlow(expenses, income)
+                self._key = key
+            return self._flow
+
+    def nbytes(self):
+        """Memory held by the cached CashFlow"""
+        flow = self._flow
+        return flow.nbytes() if flow is not None else 0
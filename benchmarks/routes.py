@@ -0,0 +1,326 @@
+"""
+Route latency and memory benchmark on synthetic ledgers.
+
+For each ledger size, generates a deterministic data set (see
+synthetic.py), starts a fresh interpreter in it, and requests each route
+through the Flask test client, reporting:
+
+- time of the first request (loading the ledger)
+- latency percentiles (p50/p90/p99) over repeated requests; the dashboard
+  cache is dropped before each one unless --cached
+- peak Python/NumPy allocation during one request (tracemalloc) and the
+  process's peak RSS
+- a burst of concurrent POST /add_expense requests from --post-threads
+  threads (after the GET routes): latency percentiles and rows/s, which
+  shows how well the write queue groups adds into shared fsyncs
+
+Usage:
+
+    python benchmarks/routes.py                               # 1k, 100k, 1M rows
+    python benchmarks/routes.py --sizes 1000,100000 --json results.json
+    python benchmarks/routes.py --post-threads 64 --post-requests 10
+    python benchmarks/routes.py --compare baseline.json --max-regression 1.5
+
+--compare fails (exit 1) if any route's p50 got slower than
+--max-regression times its value in an earlier --json file, so results
+from two commits can be checked against each other.
+"""
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import synthetic
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ROUTES = (
+    '/',
+    '/?filter=last_3_months',
+    '/expenses',
+    '/expenses?sort=amount&q=swiggy',
+    '/budgets',
+    '/test_filter',
+    '/api/stats',
+    '/api/series?granularity=day',
+    '/export/expenses',
+    '/export/all',
+)
+
+BURST_ROUTE = 'POST /add_expense (burst)'
+
+# Runs inside the child process, in the data directory: import the app,
+# time each route and report the results as JSON on stdout
+CHILD = '''
+import json, resource, sys, threading, time, tracemalloc
+sys.path.insert(0, {repo!r})
+t0 = time.perf_counter()
+import main
+client = main.app.test_client()
+import_ms = (time.perf_counter() - t0) * 1000
+
+def request(path, cached):
+    if not cached:
+        main.dashboard_cache.invalidate()
+    start = time.perf_counter()
+    response = client.get(path)
+    response.get_data()  # Consume streamed exports
+    return response.status_code, (time.perf_counter() - start) * 1000
+
+results = {{'import_ms': import_ms, 'routes': {{}}}}
+for path in {routes!r}:
+    status, first_ms = request(path, False)
+    times = []
+    deadline = time.perf_counter() + {max_seconds!r}
+    while len(times) < {runs!r} and (len(times) < 3 or time.perf_counter() < deadline):
+        times.append(request(path, {cached!r})[1])
+    tracemalloc.start()
+    request(path, {cached!r})
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results['routes'][path] = {{
+        'status': status, 'first_ms': first_ms, 'times_ms': times,
+        'peak_alloc_bytes': peak,
+    }}
+
+def post_burst(threads, per_thread):
+    times, statuses = [], []
+    lock = threading.Lock()
+
+    def worker(n):
+        own_client = main.app.test_client()
+        for i in range(per_thread):
+            start = time.perf_counter()
+            response = own_client.post('/add_expense', data={{
+                'amount': '12.50', 'description': f'burst {{n}}-{{i}}',
+                'category': 'Food',
+            }})
+            elapsed = (time.perf_counter() - start) * 1000
+            with lock:
+                times.append(elapsed)
+                statuses.append(response.status_code)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return {{
+        'threads': threads, 'status': max(statuses), 'times_ms': times,
+        'wall_ms': (time.perf_counter() - start) * 1000,
+    }}
+
+if {post_threads!r} and {post_requests!r}:
+    results['post_burst'] = post_burst({post_threads!r}, {post_requests!r})
+results['peak_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+print(json.dumps(results))
+'''
+
+
+def percentile(values, q):
+    """q-th percentile (0-100) of values, interpolated linearly"""
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    low = int(position)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def prepare_data(root, rows, args):
+    """Directory with the synthetic ledger for rows (reused when it exists)"""
+    name = (f'rows{rows}-cat{args.categories}-days{args.days}'
+            f'-inc{args.income_ratio}-seed{args.seed}')
+    directory = os.path.join(root, name)
+    if not os.path.exists(os.path.join(directory, 'budgets.csv')):
+        start = time.perf_counter()
+        synthetic.generate(
+            directory, rows, args.categories, args.days, args.income_ratio, args.seed
+        )
+        elapsed = time.perf_counter() - start
+        print(f"generated {rows} rows in {elapsed:.1f}s", file=sys.stderr)
+    return directory
+
+
+def run_size(directory, routes, args):
+    """Benchmark routes in a fresh process working on a copy of directory"""
+    cwd = tempfile.mkdtemp(prefix='routes-bench-')
+    try:
+        for name in os.listdir(directory):
+            shutil.copy(os.path.join(directory, name), cwd)
+        if args.binary:
+            subprocess.run(
+                [sys.executable, os.path.join(REPO, 'binary_ledger.py'),
+                 'expenses.csv', 'income.csv'],
+                cwd=cwd, check=True, capture_output=True,
+            )
+        code = CHILD.format(repo=REPO, routes=list(routes), runs=args.runs,
+                            max_seconds=args.max_seconds, cached=args.cached,
+                            post_threads=args.post_threads,
+                            post_requests=args.post_requests)
+        env = dict(os.environ, LEDGER_BACKEND='csv')
+        result = subprocess.run([sys.executable, '-c', code], cwd=cwd, env=env,
+                                capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr)
+        raw = json.loads(result.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(cwd, ignore_errors=True)
+
+    summary = {
+        'import_ms': raw['import_ms'],
+        'peak_rss_mb': raw['peak_rss_bytes'] / 2**20,
+        'routes': {},
+    }
+    for path, route in raw['routes'].items():
+        times = route['times_ms']
+        summary['routes'][path] = {
+            'status': route['status'],
+            'runs': len(times),
+            'first_ms': route['first_ms'],
+            'p50_ms': percentile(times, 50),
+            'p90_ms': percentile(times, 90),
+            'p99_ms': percentile(times, 99),
+            'max_ms': max(times),
+            'peak_alloc_mb': route['peak_alloc_bytes'] / 2**20,
+        }
+    burst = raw.get('post_burst')
+    if burst:
+        times = burst['times_ms']
+        summary['post_burst'] = {
+            'status': burst['status'],
+            'threads': burst['threads'],
+            'runs': len(times),
+            'rows_per_s': len(times) / burst['wall_ms'] * 1000,
+            'p50_ms': percentile(times, 50),
+            'p90_ms': percentile(times, 90),
+            'p99_ms': percentile(times, 99),
+            'max_ms': max(times),
+        }
+    return summary
+
+
+def regressions(results, baseline, max_ratio):
+    """[(size, route, old p50, new p50)] for routes slower than max_ratio x baseline"""
+    slower = []
+    for size, summary in results['sizes'].items():
+        old_summary = baseline.get('sizes', {}).get(size, {})
+        old_routes = dict(old_summary.get('routes', {}))
+        routes = dict(summary['routes'])
+        if 'post_burst' in old_summary:
+            old_routes[BURST_ROUTE] = old_summary['post_burst']
+        if 'post_burst' in summary:
+            routes[BURST_ROUTE] = summary['post_burst']
+        for path, route in routes.items():
+            old = old_routes.get(path)
+            if not old or old['p50_ms'] <= 0:
+                continue
+            if route['p50_ms'] > old['p50_ms'] * max_ratio:
+                slower.append((size, path, old['p50_ms'], route['p50_ms']))
+    return slower
+
+
+def git_commit():
+    result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO,
+                            capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--sizes', default='1000,100000,1000000',
+                        help='comma-separated expense row counts')
+    parser.add_argument('--routes', default=','.join(ROUTES),
+                        help='comma-separated routes to time')
+    parser.add_argument('--runs', type=int, default=20, help='timed requests per route')
+    parser.add_argument('--max-seconds', type=float, default=10.0,
+                        help='stop timing a route after this long '
+                             '(at least 3 requests)')
+    parser.add_argument('--cached', action='store_true',
+                        help='keep the dashboard cache between requests')
+    parser.add_argument('--post-threads', type=int, default=16,
+                        help='threads posting expenses concurrently after the '
+                             'GET routes (0 to skip)')
+    parser.add_argument('--post-requests', type=int, default=20,
+                        help='POST /add_expense requests per thread')
+    parser.add_argument('--binary', action='store_true',
+                        help='convert the ledgers to .bin snapshots first')
+    parser.add_argument('--categories', type=int, default=8)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--income-ratio', type=float, default=0.1)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir',
+                        help='keep generated ledgers here for reuse '
+                             '(default: temporary)')
+    parser.add_argument('--json', help='also write the results to this file')
+    parser.add_argument('--compare',
+                        help='results file from an earlier run to compare p50s with')
+    parser.add_argument('--max-regression', type=float, default=1.5,
+                        help='with --compare, fail if a p50 is more than this many '
+                             'times slower')
+    args = parser.parse_args()
+
+    routes = [path for path in args.routes.split(',') if path]
+    root = args.data_dir or tempfile.mkdtemp(prefix='routes-data-')
+    results = {
+        'python': sys.version.split()[0],
+        'commit': git_commit(),
+        'config': {
+            'categories': args.categories, 'days': args.days,
+            'income_ratio': args.income_ratio, 'seed': args.seed, 'runs': args.runs,
+            'cached': args.cached, 'binary': args.binary,
+            'post_threads': args.post_threads, 'post_requests': args.post_requests,
+        },
+        'sizes': {},
+    }
+    try:
+        for rows in (int(size) for size in args.sizes.split(',')):
+            directory = prepare_data(root, rows, args)
+            results['sizes'][str(rows)] = summary = run_size(directory, routes, args)
+
+            print(f"{rows} rows: import {summary['import_ms']:.0f} ms, "
+                  f"peak RSS {summary['peak_rss_mb']:.0f} MB")
+            for path, route in summary['routes'].items():
+                print(
+                    f"  {path:32} p50 {route['p50_ms']:8.1f}  "
+                    f"p90 {route['p90_ms']:8.1f}  p99 {route['p99_ms']:8.1f} ms  "
+                    f"first {route['first_ms']:8.1f} ms  "
+                    f"alloc {route['peak_alloc_mb']:7.1f} MB  status {route['status']}"
+                )
+            burst = summary.get('post_burst')
+            if burst:
+                print(
+                    f"  {BURST_ROUTE:32} p50 {burst['p50_ms']:8.1f}  "
+                    f"p90 {burst['p90_ms']:8.1f}  p99 {burst['p99_ms']:8.1f} ms  "
+                    f"{burst['runs']} adds from {burst['threads']} threads, "
+                    f"{burst['rows_per_s']:.0f} rows/s  status {burst['status']}"
+                )
+    finally:
+        if not args.data_dir:
+            shutil.rmtree(root, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+    failed = any(
+        route['status'] >= 400 for summary in results['sizes'].values()
+        for route in [*summary['routes'].values(), summary.get('post_burst')]
+        if route
+    )
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        slower = regressions(results, baseline, args.max_regression)
+        for size, path, old, new in slower:
+            print(f"Regression: {path} at {size} rows, p50 {old:.1f} -> {new:.1f} ms")
+        failed = failed or bool(slower)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
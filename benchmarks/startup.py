@@ -0,0 +1,161 @@
+"""
+Cold-start benchmark for the Flask app.
+
+Measures, in fresh interpreter processes:
+
+- where import time goes (a ``python -X importtime`` report for ``main``)
+- time to first request: process start -> first response from a route
+
+Usage:
+
+    python benchmarks/startup.py                      # human-readable report
+    python benchmarks/startup.py --json results.json  # machine-readable too
+    python benchmarks/startup.py --max-ms 800         # fail if slower
+
+It also fails if any module listed in --forbid (scikit-learn and SciPy by
+default) gets imported while serving the first request, since those used
+to add hundreds of milliseconds to every worker boot.
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_FILES = ('expenses.csv', 'income.csv', 'budgets.csv')
+
+# Runs inside the child process: import the app, serve one request, and
+# report the timings as JSON on stdout
+CHILD = '''
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, {repo!r})
+import main
+t1 = time.perf_counter()
+response = main.app.test_client().get({path!r})
+t2 = time.perf_counter()
+forbidden = [m for m in {forbid!r} if m in sys.modules]
+print(json.dumps({{
+    'status': response.status_code,
+    'import_ms': (t1 - t0) * 1000,
+    'first_request_ms': (t2 - t1) * 1000,
+    'forbidden_imports': forbidden,
+}}))
+'''
+
+
+def data_dir():
+    """Temporary working directory with a copy of the repo's CSV files"""
+    tmp = tempfile.mkdtemp(prefix='startup-bench-')
+    for name in DATA_FILES:
+        src = os.path.join(REPO, name)
+        if os.path.exists(src):
+            shutil.copy(src, tmp)
+    return tmp
+
+
+def import_report(cwd, top=15):
+    """Slowest imports of main (cumulative microseconds), from -X importtime"""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c',
+         f'import sys; sys.path.insert(0, {REPO!r}); import main'],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        # "import time:  self | cumulative | <indent>module"
+        head, cumulative_us, name = line.split('|')
+        name = name[1:]
+        entries.append({
+            'module': name.strip(),
+            'depth': (len(name) - len(name.lstrip())) // 2,
+            'self_us': int(head.split(':')[1]),
+            'cumulative_us': int(cumulative_us),
+        })
+    total = next((e['cumulative_us'] for e in entries if e['module'] == 'main'), None)
+    # Direct imports of main (and main's own top-level packages)
+    direct = [e for e in entries if e['depth'] <= 1]
+    direct.sort(key=lambda e: e['cumulative_us'], reverse=True)
+    return {'total_us': total, 'top': direct[:top]}
+
+
+def time_to_first_request(cwd, path, forbid):
+    """One fresh process: (wall ms from spawn to response, child timings)"""
+    code = CHILD.format(repo=REPO, path=path, forbid=list(forbid))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], cwd=cwd,
+                            capture_output=True, text=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    timings['wall_ms'] = wall_ms
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--paths', default='/expenses,/',
+                        help='comma-separated routes to time')
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per route')
+    parser.add_argument('--forbid', default='sklearn,scipy',
+                        help='modules that must not be imported')
+    parser.add_argument('--max-ms', type=float,
+                        help='fail if a median wall time exceeds this')
+    parser.add_argument('--json', help='also write the results to this file')
+    args = parser.parse_args()
+
+    cwd = data_dir()
+    forbid = [m for m in args.forbid.split(',') if m]
+    results = {
+        'python': sys.version.split()[0], 'imports': import_report(cwd), 'routes': {},
+    }
+
+    failed = False
+    for path in args.paths.split(','):
+        runs = [time_to_first_request(cwd, path, forbid) for _ in range(args.runs)]
+        summary = {
+            key: statistics.median(r[key] for r in runs)
+            for key in ('wall_ms', 'import_ms', 'first_request_ms')
+        }
+        summary['forbidden_imports'] = sorted(
+            {m for r in runs for m in r['forbidden_imports']}
+        )
+        summary['status'] = runs[-1]['status']
+        results['routes'][path] = summary
+        if summary['forbidden_imports']:
+            failed = True
+        if args.max_ms is not None and summary['wall_ms'] > args.max_ms:
+            failed = True
+    shutil.rmtree(cwd, ignore_errors=True)
+
+    print(f"import main: {results['imports']['total_us'] / 1000:.1f} ms")
+    for entry in results['imports']['top']:
+        print(f"  {entry['cumulative_us'] / 1000:8.1f} ms  {entry['module']}")
+    print()
+    for path, summary in results['routes'].items():
+        print(
+            f"{path:12} wall {summary['wall_ms']:7.1f} ms  "
+            f"import {summary['import_ms']:7.1f} ms  "
+            f"first request {summary['first_request_ms']:6.1f} ms  "
+            f"status {summary['status']}"
+        )
+        if summary['forbidden_imports']:
+            modules = ', '.join(summary['forbidden_imports'])
+            print(f"  imported forbidden modules: {modules}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
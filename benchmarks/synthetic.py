@@ -0,0 +1,130 @@
+"""
+Deterministic synthetic ledgers for benchmarks.
+
+Writes expenses.csv, income.csv and budgets.csv (in the compacted snapshot
+format, with ids) to a directory. The same arguments always produce the
+same files, byte for byte, so results from different commits are
+comparable.
+
+Usage:
+
+    python benchmarks/synthetic.py data/ --rows 100000
+    python benchmarks/synthetic.py data/ --rows 1000000 --categories 20 \\
+        --days 1825 --income-ratio 0.05 --end-date 2025-12-31 --seed 7
+
+--rows is the number of expenses; income gets rows * income_ratio.
+Dates are spread uniformly over the --days days ending at --end-date
+(fixed by default, not today) and written in date order.
+"""
+import argparse
+import csv
+import os
+import sys
+
+import numpy as np
+
+CATEGORIES = (
+    'Food', 'Transport', 'Bills', 'Shopping', 'Entertainment', 'Health',
+    'Education', 'Travel', 'Rent', 'Groceries', 'Fuel', 'Insurance',
+)
+INCOME_CATEGORIES = ('Salary', 'Freelance', 'Interest', 'Refund')
+
+MERCHANTS = (
+    'Swiggy', 'Zomato', 'Uber', 'Ola', 'Amazon', 'Flipkart', 'BigBasket',
+    'Airtel', 'Jio', 'Netflix', 'Apollo', 'Croma', 'IRCTC', 'Indigo',
+    'Reliance', 'DMart', 'BookMyShow', 'Myntra', 'Starbucks', 'HP Petrol',
+)
+WORDS = (
+    'order', 'ride', 'bill', 'recharge', 'subscription', 'refill', 'ticket',
+    'groceries', 'dinner', 'lunch', 'pharmacy', 'electricity', 'monthly',
+)
+SOURCES = ('Employer salary', 'Client invoice', 'Savings interest', 'Tax refund')
+
+DEFAULT_END_DATE = '2025-12-31'
+
+
+def category_names(count, names=CATEGORIES):
+    """count category names: the common ones first, then Category N"""
+    return [names[i] if i < len(names) else f'Category {i + 1}' for i in range(count)]
+
+
+def _ledger(rng, rows, categories, days, end_date, texts, amount_scale):
+    """(dates, amounts, categories, texts) columns for rows records"""
+    end = np.datetime64(end_date, 'D')
+    offsets = np.sort(rng.integers(0, days, size=rows))
+    start = end - np.timedelta64(days - 1, 'D')
+    dates = (start + offsets.astype('timedelta64[D]')).astype(str)
+    amounts = np.round(rng.lognormal(np.log(amount_scale), 1.0, size=rows), 2)
+    amounts = np.maximum(amounts, 1.0)
+    # A few categories get most of the rows, as in real spending
+    weights = 1.0 / np.arange(1, len(categories) + 1)
+    codes = rng.choice(len(categories), size=rows, p=weights / weights.sum())
+    text_ids = rng.integers(0, len(texts), size=rows)
+    return dates, amounts, codes, text_ids
+
+
+def write_ledger(filename, text_field, columns, categories, texts):
+    dates, amounts, codes, text_ids = columns
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'date', 'amount', text_field, 'category'])
+        writer.writerows(
+            (i, date, f'{amount:.2f}', texts[t], categories[c])
+            for i, (date, amount, c, t) in enumerate(
+                zip(dates.tolist(), amounts.tolist(), codes.tolist(), text_ids.tolist(),
+                    strict=True), 1
+            )
+        )
+
+
+def generate(directory, rows, categories=8, days=730, income_ratio=0.1, seed=0,
+             end_date=DEFAULT_END_DATE):
+    """Write the three CSV files to directory; returns {file: row count}"""
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    names = category_names(categories)
+    descriptions = [f'{merchant} {word}' for merchant in MERCHANTS for word in WORDS]
+
+    expenses = _ledger(rng, rows, names, days, end_date, descriptions, 400.0)
+    write_ledger(os.path.join(directory, 'expenses.csv'), 'description', expenses,
+                 names, descriptions)
+
+    income_rows = int(round(rows * income_ratio))
+    income = _ledger(rng, income_rows, INCOME_CATEGORIES, days, end_date, SOURCES,
+                     20000.0)
+    write_ledger(os.path.join(directory, 'income.csv'), 'source', income,
+                 INCOME_CATEGORIES, SOURCES)
+
+    # Budgets around each category's average monthly spending
+    months = max(days / 30.4, 1.0)
+    spent = np.bincount(expenses[2], weights=expenses[1], minlength=len(names))
+    with open(os.path.join(directory, 'budgets.csv'), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['category', 'budget'])
+        for name, total in zip(names, spent.tolist(), strict=True):
+            writer.writerow([name, round(total / months, -2) or 100.0])
+
+    return {'expenses.csv': rows, 'income.csv': income_rows, 'budgets.csv': len(names)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('directory')
+    parser.add_argument('--rows', type=int, default=1000, help='expense rows')
+    parser.add_argument('--categories', type=int, default=8)
+    parser.add_argument('--days', type=int, default=730, help='date span in days')
+    parser.add_argument('--income-ratio', type=float, default=0.1,
+                        help='income rows per expense row')
+    parser.add_argument('--end-date', default=DEFAULT_END_DATE)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    counts = generate(args.directory, args.rows, args.categories, args.days,
+                      args.income_ratio, args.seed, args.end_date)
+    for name, n in counts.items():
+        print(f"{os.path.join(args.directory, name)}: {n} rows")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
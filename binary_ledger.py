@@ -0,0 +1,190 @@
+"""
+Binary snapshot of a ledger, opened with mmap instead of parsed.
+
+``expenses.csv.bin`` holds the same records as the ``expenses.csv``
+snapshot, column by column in the dtypes LedgerTable uses (int64 ids,
+datetime64[D] dates, float64 amounts, int32 category codes), followed by
+the descriptions as one UTF-8 string heap with an offsets column. The
+header is JSON: row count, category names, column offsets and the
+(inode, mtime, size) stamp of the CSV file it was converted from, so a
+stale binary file is never used.
+
+The columns are np.memmap views opened copy-on-write: every gunicorn
+worker shares the same page-cache pages, and a worker that edits a row
+only gets a private copy of the page it touched. LedgerStore writes the
+binary file after every compaction; convert existing CSV files with:
+
+    python binary_ledger.py expenses.csv income.csv
+"""
+import json
+import operator
+import os
+import sys
+
+import numpy as np
+
+from ledger import LedgerTable
+
+MAGIC = b'FDLEDGR1'
+ALIGN = 64
+
+COLUMNS = (
+    ('ids', np.int64),
+    ('dates', 'datetime64[D]'),
+    ('amounts', np.float64),
+    ('codes', np.int32),
+)
+
+
+class HeapTexts:
+    """
+    List-like view of the descriptions in the string heap. Rows appended
+    after loading are kept in a plain list after the heap ones.
+    """
+
+    def __init__(self, heap, offsets):
+        self._heap = heap
+        self._offsets = offsets
+        self._count = len(offsets) - 1
+        self._appended = []
+
+    def __len__(self):
+        return self._count + len(self._appended)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        i = operator.index(index)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(index)
+        if i >= self._count:
+            return self._appended[i - self._count]
+        return bytes(self._heap[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, text):
+        self._appended.append(text)
+
+    def extend(self, texts):
+        self._appended.extend(texts)
+
+
+def _aligned(offset):
+    return -(-offset // ALIGN) * ALIGN
+
+
+def write(filename, table, source_stamp, csv_has_ids=True):
+    """
+    Write table to filename (atomically) as converted from a CSV with
+    source_stamp (csv_has_ids False if that file numbers rows implicitly)
+    """
+    encoded = [text.encode('utf-8') for text in table.texts]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(text) for text in encoded], out=offsets[1:])
+    arrays = [
+        np.ascontiguousarray(getattr(table, name), dtype=dtype)
+        for name, dtype in COLUMNS
+    ] + [offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)]
+    names = [name for name, _ in COLUMNS] + ['text_offsets', 'heap']
+
+    header = {
+        'count': len(table),
+        'text_field': table.text_field,
+        'categories': table.categories,
+        'source_stamp': list(source_stamp),
+        'csv_has_ids': csv_has_ids,
+        'columns': {},
+    }
+    # Column offsets depend on the header size and vice versa: lay the
+    # columns out after the header until the header fits in front of them
+    header_size = 0
+    while True:
+        position = _aligned(len(MAGIC) + 8 + header_size)
+        for name, array in zip(names, arrays, strict=True):
+            header['columns'][name] = [position, array.nbytes]
+            position = _aligned(position + array.nbytes)
+        header_bytes = json.dumps(header).encode('utf-8')
+        if len(header_bytes) <= header_size:
+            break
+        header_size = len(header_bytes)
+
+    tmp = f'{filename}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in zip(names, arrays, strict=True):
+            f.seek(header['columns'][name][0])
+            f.write(array.tobytes())
+        f.truncate(max(position, f.tell()))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, filename)
+
+
+def read_header(filename):
+    """The JSON header of a binary ledger, or None if missing or not one"""
+    try:
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                return None
+            size = int.from_bytes(f.read(8), 'little')
+            return json.loads(f.read(size))
+    except (OSError, ValueError):
+        return None
+
+
+def is_current(filename, source_stamp):
+    """True if filename is a binary ledger converted from a CSV with source_stamp"""
+    header = read_header(filename)
+    return header is not None and tuple(header['source_stamp']) == tuple(source_stamp)
+
+
+def load(filename, text_field, source_stamp=None):
+    """
+    (LedgerTable whose columns are mmapped from filename, header), or None
+    if the file is missing, corrupt, or (given source_stamp) converted from
+    another CSV
+    """
+    header = read_header(filename)
+    if header is None or header['text_field'] != text_field:
+        return None
+    stamp = header['source_stamp']
+    if source_stamp is not None and tuple(stamp) != tuple(source_stamp):
+        return None
+    try:
+        data = np.memmap(filename, dtype=np.uint8, mode='c')
+    except (OSError, ValueError):
+        return None
+
+    def column(name, dtype):
+        start, nbytes = header['columns'][name]
+        return data[start:start + nbytes].view(dtype)
+
+    ids, dates, amounts, codes = (column(name, dtype) for name, dtype in COLUMNS)
+    texts = HeapTexts(column('heap', np.uint8), column('text_offsets', np.int64))
+    table = LedgerTable.from_columns(
+        text_field, ids, dates, amounts, codes, texts, header['categories']
+    )
+    return table, header
+
+
+def convert(csv_filename):
+    """Write <csv_filename>.bin for a ledger CSV snapshot; returns the row count"""
+    from storage import LedgerStore
+
+    with open(csv_filename, newline='') as f:
+        header = f.readline().strip().split(',')
+    text_field = 'source' if 'source' in header else 'description'
+    store = LedgerStore(csv_filename, ['date', 'amount', text_field, 'category'])
+    return store.write_binary()
+
+
+if __name__ == '__main__':
+    for name in sys.argv[1:] or ['expenses.csv', 'income.csv']:
+        print(f"Converted {convert(name)} rows from {name} to {name}.bin")
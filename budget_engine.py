@@ -0,0 +1,192 @@
+import csv
+import os
+import threading
+from datetime import date, datetime, timedelta
+
+from forecast import CategoryForecast
+from storage import file_lock
+
+# Percent of a budget at which a category turns yellow and red, and the
+# alert recorded when it first gets there in a month
+ALERT_LEVELS = ((70, 'warning'), (100, 'over budget'))
+
+ALERT_HEADERS = ['date', 'period', 'category', 'level', 'spent', 'budget']
+
+
+def budget_status(budgets, spending, forecasts=None):
+    """
+    Calculate spending vs budget for each category, with the forecast
+    spending for the month when forecasts (see period_forecasts) are given
+    """
+    forecasts = forecasts or {}
+    status = {}
+    for category in budgets:
+        budget_limit = budgets[category]
+        spent = spending.get(category, 0)
+
+        percentage = (spent / budget_limit * 100) if budget_limit > 0 else 0
+        is_over = spent > budget_limit
+
+        if percentage < 70:
+            color = 'green'
+        elif percentage < 100:
+            color = 'yellow'
+        else:
+            color = 'red'
+
+        status[category] = {
+            'budget': budget_limit,
+            'spent': spent,
+            'remaining': budget_limit - spent,
+            'percentage': percentage,
+            'color': color,
+            'is_over': is_over
+        }
+
+        forecast = forecasts.get(category)
+        status[category].update(
+            forecast=forecast['forecast'] if forecast else None,
+            forecast_low=forecast['low'] if forecast else None,
+            forecast_high=forecast['high'] if forecast else None,
+            # Heading over budget by the end of the month
+            forecast_over=(
+                bool(forecast) and max(spent, forecast['forecast']) > budget_limit
+            ),
+        )
+
+    return status
+
+
+def period_bounds(today=None):
+    """(first day, last day, 'YYYY-MM') of the budget period (month) containing today"""
+    today = today or date.today()
+    first = today.replace(day=1)
+    last = (first + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return first.isoformat(), last.isoformat(), first.strftime('%Y-%m')
+
+
+def period_spending(expenses, today=None):
+    """
+    {category: spent} for the current period. The period is whole months,
+    so this is read from the table's monthly rollup: O(categories) no
+    matter how many rows there are.
+    """
+    start, end, _ = period_bounds(today)
+    return expenses.category_dict(*expenses.window_sums(start, end))
+
+
+def period_forecasts(category_forecast, expenses, today=None):
+    """
+    {category: {'forecast', 'low', 'high'}} spending for the current period,
+    all categories fitted at once from the months before it by
+    category_forecast (a CategoryForecast, which caches the result)
+    """
+    _, _, period = period_bounds(today)
+    return category_forecast.forecast(expenses, period)
+
+
+class BudgetEngine:
+    """
+    Monthly budget status and threshold alerts.
+
+    The alert thresholds (70% and 100% of each budget, as amounts) are
+    precomputed whenever the budgets change. check() runs after every
+    expense write: it compares this month's spending per category (from
+    the rollup, which the write already updated) with the thresholds and
+    appends an alert to the alerts CSV the first time a category reaches
+    a level in a month. Alerts are shared by all workers through that
+    file, so each one is recorded once.
+    """
+
+    def __init__(self, alerts_file='budget_alerts.csv'):
+        self.alerts_file = alerts_file
+        self.lock_filename = alerts_file + '.lock'
+        self._budgets = None
+        self._thresholds = {}
+        self._alerted = set()
+        self._lock = threading.Lock()
+        # This ledger's forecasts of the current month
+        self.category_forecast = CategoryForecast()
+
+    def thresholds(self, budgets):
+        """{category: [(amount, level), ...]}, recomputed only when budgets change"""
+        with self._lock:
+            if budgets != self._budgets:
+                self._thresholds = {
+                    category: [
+                        (limit * percent / 100, level)
+                        for percent, level in ALERT_LEVELS
+                    ]
+                    for category, limit in budgets.items() if limit > 0
+                }
+                self._budgets = dict(budgets)
+            return self._thresholds
+
+    def status(self, budgets, expenses, today=None):
+        """budget_status() for the current month, with forecasts"""
+        return budget_status(budgets, period_spending(expenses, today),
+                             period_forecasts(self.category_forecast, expenses, today))
+
+    def nbytes(self):
+        """Approximate memory held by the cached forecasts"""
+        return self.category_forecast.nbytes()
+
+    def check(self, budgets, expenses, today=None):
+        """Record (and return) alerts for thresholds first reached this month"""
+        _, _, period = period_bounds(today)
+        spending = period_spending(expenses, today)
+        reached = [
+            (category, level, spending[category])
+            for category, levels in self.thresholds(budgets).items()
+            if category in spending
+            for amount, level in levels
+            if spending[category] >= amount
+            and (period, category, level) not in self._alerted
+        ]
+        if not reached:
+            return []
+
+        new_alerts = []
+        with file_lock(self.lock_filename), self._lock:
+            # Another worker may have recorded some of them already
+            self._alerted.update(
+                (row['period'], row['category'], row['level']) for row in self._read()
+            )
+            for category, level, spent in reached:
+                if (period, category, level) in self._alerted:
+                    continue
+                self._alerted.add((period, category, level))
+                new_alerts.append({
+                    'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'period': period,
+                    'category': category,
+                    'level': level,
+                    'spent': round(spent, 2),
+                    'budget': budgets[category],
+                })
+            if new_alerts:
+                exists = os.path.exists(self.alerts_file)
+                with open(self.alerts_file, 'a', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=ALERT_HEADERS)
+                    if not exists:
+                        writer.writeheader()
+                    writer.writerows(new_alerts)
+        for alert in new_alerts:
+            print(f"Budget alert: {alert['category']} is {alert['level']} "
+                  f"(${alert['spent']:.2f} of ${alert['budget']:.2f} in {period})")
+        return new_alerts
+
+    def _read(self):
+        try:
+            with open(self.alerts_file, 'r', newline='') as f:
+                return list(csv.DictReader(f))
+        except FileNotFoundError:
+            return []
+        except Exception as e:
+            print(f"Error reading {self.alerts_file}: {e}")
+            return []
+
+    def alerts(self, today=None):
+        """Alerts recorded for the current month, newest first"""
+        _, _, period = period_bounds(today)
+        return [row for row in reversed(self._read()) if row['period'] == period]
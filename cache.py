@@ -0,0 +1,85 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    Rendered pages kept in memory, least recently used evicted first.
+
+    Entries are (body, etag) keyed by whatever identifies the page (the
+    dashboard uses its resolved date filter). Every key is combined with a
+    data version: the write routes call invalidate(), which bumps the
+    generation and drops everything, and callers can pass the versions of
+    the data they read so a change made some other way misses too.
+
+    With a counter (a storage.SharedCounter) the generation lives in a
+    memory-mapped file shared by all gunicorn workers, so a write handled
+    by one worker invalidates the pages cached by every other worker.
+    """
+
+    def __init__(self, max_entries=128, counter=None):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._counter = counter
+        self._generation = 0
+        self._entries_generation = None
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        if self._counter is not None:
+            return self._counter.value
+        return self._generation
+
+    def key(self, *parts):
+        """Cache key for parts at the current generation"""
+        return (self.generation,) + parts
+
+    def get(self, key):
+        """(body, etag) for key, or None"""
+        with self._lock:
+            if self._entries_generation is None or key[0] > self._entries_generation:
+                # Written since (possibly by another process): drop the lot
+                self._entries.clear()
+                self._entries_generation = key[0]
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, body):
+        """Store a rendered body under key and return its (body, etag)"""
+        etag = hashlib.sha1(body.encode('utf-8')).hexdigest()
+        entry = (body, etag)
+        with self._lock:
+            if key[0] != self.generation or key[0] != self._entries_generation:
+                # Rendered from data that was written meanwhile
+                return entry
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+
+    def invalidate(self):
+        """Forget every entry (call after any write)"""
+        with self._lock:
+            if self._counter is not None:
+                self._counter.increment()
+            else:
+                self._generation += 1
+            self._entries.clear()
+
+    def nbytes(self):
+        """Approximate memory held by the cached bodies"""
+        with self._lock:
+            return sum(len(body) for body, _ in self._entries.values())
+
+    def __len__(self):
+        return len(self._entries)
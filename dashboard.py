@@ -0,0 +1,155 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+
+# Most points in the dashboard's running balance chart
+BALANCE_POINTS = 365
+
+# Most buckets time_series builds (about 270 years of days)
+MAX_SERIES_BUCKETS = 100_000
+
+
+@dataclass
+class DashboardSnapshot:
+    """Everything the dashboard shows, computed in one pass over the ledger"""
+    total_expenses: float = 0.0
+    total_income: float = 0.0
+    balance: float = 0.0
+    top_category: str = None
+    top_amount: float = 0.0
+    category_breakdown: dict = field(default_factory=dict)
+    all_time_breakdown: dict = field(default_factory=dict)
+    monthly: dict = field(default_factory=dict)
+    budget_status: dict = field(default_factory=dict)
+    cash_flow: dict = field(default_factory=dict)
+    balance_series: dict = field(default_factory=dict)
+    ml_prediction: float = 0.0
+    simple_prediction: float = 0.0
+    version: tuple = None
+
+    @property
+    def num_months(self):
+        return len(self.monthly)
+
+
+def build_snapshot(expenses, income, budgets, budget_engine, cash_flows,
+                   start_date=None, end_date=None):
+    """
+    Aggregate the expense and income tables for the dashboard; the budget
+    status comes from the ledger's BudgetEngine and the cash-flow figures
+    from its CashFlowCache.
+
+    Category sums (filtered and all-time) and the monthly series come from
+    the tables' monthly rollups, so only the partial months at the edges of
+    the date filter ever touch individual rows. Income is filtered the same
+    way as expenses; the cash-flow figures and the running balance come
+    from the daily prefix sums of both (see analytics.py).
+    """
+    snapshot = DashboardSnapshot(version=expenses.version_key())
+
+    snapshot.all_time_breakdown = expenses.category_totals()
+    if start_date or end_date:
+        counts, sums = expenses.window_sums(start_date, end_date)
+        snapshot.category_breakdown = expenses.category_dict(counts, sums)
+    else:
+        snapshot.category_breakdown = dict(snapshot.all_time_breakdown)
+    snapshot.total_expenses = float(sum(snapshot.category_breakdown.values()))
+
+    if start_date or end_date:
+        snapshot.total_income = float(income.window_sums(start_date, end_date)[1].sum())
+    else:
+        snapshot.total_income = income.total()
+    snapshot.balance = snapshot.total_income - snapshot.total_expenses
+
+    if snapshot.category_breakdown:
+        breakdown = snapshot.category_breakdown
+        snapshot.top_category = max(breakdown, key=breakdown.get)
+        snapshot.top_amount = breakdown[snapshot.top_category]
+
+    flow = cash_flows.get(expenses, income)
+    snapshot.cash_flow = flow.summary(start_date, end_date)
+    start, end = snapshot.cash_flow['start'], snapshot.cash_flow['end']
+    labels, balances = flow.balance_series(start, end, BALANCE_POINTS)
+    rolling = flow.rolling_series(30, start, end, BALANCE_POINTS)[1]
+    snapshot.balance_series = {
+        'labels': labels,
+        'balance': np.round(balances, 2).tolist(),
+        'rolling_30d': np.round(rolling, 2).tolist(),
+    }
+
+    snapshot.monthly = expenses.monthly_totals()
+    snapshot.budget_status = budget_engine.status(budgets, expenses)
+    return snapshot
+
+
+GRANULARITIES = ('day', 'week', 'month')
+
+
+def _buckets(dates, granularity):
+    """
+    Integer bucket number of each date (days, Monday-based weeks or months
+    since 1970)
+    """
+    if granularity == 'month':
+        return dates.astype('datetime64[M]').astype(np.int64)
+    days = dates.astype(np.int64)
+    if granularity == 'week':
+        return (days + 3) // 7  # 1970-01-01 was a Thursday
+    return days
+
+
+def _bucket_labels(first, last, granularity):
+    """ISO label of each bucket first..last (a week is labelled by its Monday)"""
+    buckets = np.arange(first, last + 1)
+    if granularity == 'month':
+        return np.datetime_as_string(buckets.astype('datetime64[M]')).tolist()
+    if granularity == 'week':
+        buckets = buckets * 7 - 3
+    return np.datetime_as_string(buckets.astype('datetime64[D]')).tolist()
+
+
+def time_series(table, granularity='month', start_date=None, end_date=None,
+                category=None):
+    """
+    (labels, totals) per day, week or month for the rows of table dated
+    start_date..end_date in category, with empty buckets as zero.
+
+    The rows come from the date index and are bucketed with one bincount.
+    The buckets run from start_date (or the first matching row) to
+    end_date (or the last matching row); ValueError if that is more than
+    MAX_SERIES_BUCKETS of them.
+    """
+    with table.lock:
+        selector = table.select(start_date, end_date, category)
+        dates = table.dates[selector]
+        amounts = table.amounts[selector]
+    dated = ~np.isnat(dates)
+    buckets = _buckets(dates[dated], granularity)
+    edges = np.array([start_date or 'NaT', end_date or 'NaT'], dtype='datetime64[D]')
+    bounds = [int(b) for b in _buckets(edges, granularity)]
+    first = bounds[0] if start_date else (int(buckets.min()) if len(buckets) else None)
+    last = bounds[1] if end_date else (int(buckets.max()) if len(buckets) else None)
+    if first is None or last is None or last < first:
+        return [], np.zeros(0)
+    if last - first + 1 > MAX_SERIES_BUCKETS:
+        raise ValueError(
+            f"{start_date or 'first row'}..{end_date or 'last row'} is more than "
+            f"{MAX_SERIES_BUCKETS} {granularity} buckets"
+        )
+    totals = np.bincount(
+        buckets - first, weights=amounts[dated], minlength=last - first + 1
+    ).astype(np.float64)
+    return _bucket_labels(first, last, granularity), totals
+
+
+def downsample(labels, totals, max_points):
+    """
+    At most max_points points, merging runs of consecutive buckets (summed,
+    labelled by their first bucket). Returns (labels, totals, buckets per point).
+    """
+    count = len(totals)
+    if count <= max_points:
+        return labels, np.asarray(totals), 1
+    step = -(-count // max_points)
+    starts = np.arange(0, count, step)
+    return [labels[i] for i in starts], np.add.reduceat(totals, starts), step
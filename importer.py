@@ -0,0 +1,227 @@
+"""
+Bulk import of bank-statement CSV files into the expense or income ledger.
+
+Rows are streamed from the file, validated (amounts must be positive
+numbers, like the check in add_expense; dates are normalized to
+YYYY-MM-DD; categories are mapped) and written BATCH_SIZE rows at a time,
+each batch as one locked append to the log (or one SQLite transaction).
+
+    python -m importer statement.csv                  # expenses
+    python -m importer payslips.csv --kind income
+    python -m importer statement.csv --date-column "Txn Date" \\
+        --amount-column Debit --text-column Narration --category-map map.csv
+
+The category map is a CSV of keyword,category rows. A row whose
+category is empty gets the category of the first keyword found in its
+description (or 'Other'); a category equal to a keyword is renamed.
+The same import is available from the app at POST /import.
+"""
+import argparse
+import contextlib
+import csv
+import functools
+import os
+import re
+import sys
+import time
+from datetime import date, datetime
+
+BATCH_SIZE = 10000
+
+# Tried in order after ISO dates; day-first, as on Indian bank statements
+DATE_FORMATS = (
+    '%d/%m/%Y', '%d-%m-%Y', '%d.%m.%Y', '%d/%m/%y', '%d-%m-%y',
+    '%Y/%m/%d', '%d %b %Y', '%d-%b-%Y', '%d %b %y', '%d-%b-%y', '%b %d, %Y',
+)
+
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}$')
+
+# Currency symbols and thousands separators stripped from amounts
+AMOUNT_NOISE = re.compile(r'[₹$,\s]|^(?:INR|Rs\.?)', re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=65536)
+def normalize_date(value, date_format=None):
+    """
+    YYYY-MM-DD for a statement date, or None if it can't be read.
+    Statements repeat the same few dates, so results are memoized.
+    """
+    value = (value or '').strip()
+    if ISO_DATE.match(value):
+        try:
+            return date.fromisoformat(value).isoformat()
+        except ValueError:
+            return None
+    for fmt in ((date_format,) if date_format else DATE_FORMATS):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            continue
+    return None
+
+
+def normalize_amount(value):
+    """The amount as a positive float, or None (like add_expense's check)"""
+    try:
+        amount = float(AMOUNT_NOISE.sub('', value or ''))
+    except ValueError:
+        return None
+    if not amount > 0 or amount == float('inf'):
+        return None
+    return amount
+
+
+def read_category_map(filename):
+    """{keyword (lowercase): category} from a keyword,category CSV file"""
+    mapping = {}
+    with open(filename, 'r', newline='') as f:
+        for row in csv.reader(f):
+            if len(row) >= 2 and row[0].strip():
+                mapping[row[0].strip().lower()] = row[1].strip()
+    return mapping
+
+
+def map_category(category, text, category_map):
+    category = (category or '').strip()
+    if category:
+        return category_map.get(category.lower(), category)
+    text = (text or '').lower()
+    for keyword, mapped in category_map.items():
+        if keyword in text:
+            return mapped
+    return 'Other'
+
+
+class ImportResult:
+    """Counts and timing of one import"""
+
+    def __init__(self):
+        self.imported = 0
+        self.rejected = 0
+        self.batches = 0
+        self.seconds = 0.0
+        self.errors = []
+
+    @property
+    def rows_per_second(self):
+        return self.imported / self.seconds if self.seconds else 0.0
+
+    def summary(self):
+        return (
+            f"Imported {self.imported} rows in {self.seconds:.2f}s "
+            f"({self.rows_per_second:,.0f} rows/s, {self.batches} batches), "
+            f"rejected {self.rejected}"
+        )
+
+
+def import_csv(store, f, date_column='date', amount_column='amount', text_column=None,
+               category_column='category', category_map=None, date_format=None,
+               batch_size=BATCH_SIZE, max_errors=20):
+    """
+    Stream the CSV in the text file f into store in batches.
+
+    Invalid rows are skipped and counted; the first max_errors reasons are
+    kept in result.errors.
+    """
+    text_field = store.headers[2]
+    text_column = text_column or text_field
+    category_map = category_map or {}
+    result = ImportResult()
+    start = time.perf_counter()
+
+    reader = csv.reader(f)
+    header = next(reader, [])
+    columns = {name.strip(): i for i, name in enumerate(header)}
+
+    def column(name):
+        i = columns.get(name)
+        if i is None:
+            return lambda _row: ''
+        return lambda row: row[i] if i < len(row) else ''
+
+    get_date, get_amount = column(date_column), column(amount_column)
+    get_text, get_category = column(text_column), column(category_column)
+
+    batch = []
+    for line, row in enumerate(reader, 2):
+        row_date = normalize_date(get_date(row), date_format)
+        amount = normalize_amount(get_amount(row))
+        if row_date is None or amount is None:
+            result.rejected += 1
+            if len(result.errors) < max_errors:
+                if row_date is None:
+                    bad_column, value = date_column, get_date(row)
+                else:
+                    bad_column, value = amount_column, get_amount(row)
+                result.errors.append(f"line {line}: invalid {bad_column} {value!r}")
+            continue
+        text = get_text(row).strip()
+        batch.append({
+            'date': row_date,
+            'amount': amount,
+            text_field: text,
+            'category': map_category(get_category(row), text, category_map),
+        })
+        if len(batch) >= batch_size:
+            store.add_many(batch)
+            result.imported += len(batch)
+            result.batches += 1
+            batch = []
+    if batch:
+        store.add_many(batch)
+        result.imported += len(batch)
+        result.batches += 1
+
+    result.seconds = time.perf_counter() - start
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n\n')[0])
+    parser.add_argument('csv_file', help="statement CSV ('-' for stdin)")
+    parser.add_argument('--kind', choices=('expenses', 'income'), default='expenses')
+    parser.add_argument('--date-column', default='date')
+    parser.add_argument('--amount-column', default='amount')
+    parser.add_argument('--text-column',
+                        help="description/source column (default: the ledger's own)")
+    parser.add_argument('--category-column', default='category')
+    parser.add_argument('--category-map', help='CSV of keyword,category rows')
+    parser.add_argument('--date-format',
+                        help='strptime format, if not ISO or a common bank format')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    from storage import SharedCounter, open_stores
+
+    expenses, income, budgets = open_stores(
+        os.environ.get('LEDGER_BACKEND', 'csv'),
+        database=os.environ.get('LEDGER_DB', 'finance.db'),
+    )
+    store = expenses if args.kind == 'expenses' else income
+    category_map = read_category_map(args.category_map) if args.category_map else None
+
+    with contextlib.ExitStack() as stack:
+        if args.csv_file == '-':
+            f = sys.stdin
+        else:
+            f = stack.enter_context(
+                open(args.csv_file, 'r', newline='', encoding='utf-8-sig')
+            )
+        result = import_csv(
+            store, f, args.date_column, args.amount_column, args.text_column,
+            args.category_column, category_map, args.date_format, args.batch_size,
+        )
+
+    # Tell running app workers to drop their cached dashboards
+    if result.imported:
+        generation_file = os.environ.get('LEDGER_GENERATION_FILE', 'finance.gen')
+        SharedCounter(generation_file).increment()
+
+    for error in result.errors:
+        print(error)
+    print(result.summary())
+    return 0 if result.imported or not result.rejected else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
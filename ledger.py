@@ -0,0 +1,928 @@
+import functools
+import itertools
+import threading
+
+import numpy as np
+
+from text_index import TextIndex
+
+_table_ids = itertools.count(1)
+
+
+def _locked(method):
+    """Run a LedgerTable method holding the table's lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
+# Steps for datetime64 arithmetic (bare ints are NumPy's deprecated generic unit)
+ONE_DAY = np.timedelta64(1, 'D')
+ONE_MONTH = np.timedelta64(1, 'M')
+
+# Rough size of one entry of the text column (list slot plus str object)
+TEXT_BYTES = 64
+
+
+class LedgerTable:
+    """Expenses or income stored as parallel NumPy columns.
+
+    Amounts are float64, dates are datetime64[D] and categories are
+    dictionary-encoded as small integer codes (``categories[code]`` is the
+    name). The free-text column (description or source) stays a Python list.
+    Every row carries a stable integer id; ids only ever grow, so the id
+    column is sorted and a record is found with ``searchsorted``.
+    Arrays are over-allocated so appends are amortized O(1).
+
+    A sorted date index (a stable argsort of the dates) is built on first
+    use and extended in place when rows are appended in date order; an
+    edit that changes a date moves its entry and a delete removes it (an
+    O(n) shift, not a re-sort). Date-range queries are two
+    ``searchsorted`` calls plus the window.
+    Monthly and per-category totals come from a MonthlyRollup that is also
+    built on first use and then kept up to date by every write, and so is
+    the TextIndex behind search().
+
+    A store writes to its table while request threads read it, so every
+    write, and every read that builds or uses the date index, rollup, sort
+    views or text index, holds ``lock`` (reentrant). Code outside this
+    class that reads several columns or positions together holds it too.
+    """
+
+    def __init__(self, text_field):
+        self.text_field = text_field
+        self.lock = threading.RLock()
+        self.categories = []
+        self._category_codes = {}
+        self._ids = np.empty(0, dtype=np.int64)
+        self._dates = np.empty(0, dtype='datetime64[D]')
+        self._amounts = np.empty(0, dtype=np.float64)
+        self._codes = np.empty(0, dtype=np.int32)
+        self.texts = []
+        self._size = 0
+        self._order = None
+        self._sorted_dates = None
+        self._index_size = 0
+        self._in_order = True
+        self._rollup = None
+        self._text_index = None
+        self.uid = next(_table_ids)
+        self.version = 0
+        self._sort_views = {}
+        self._sort_views_version = None
+        self._sort_views_size = 0
+
+    @classmethod
+    def from_rows(cls, rows, text_field, ids=None):
+        """Build a table from CSV dict rows (strings), numbering them 1..n if no ids"""
+        table = cls(text_field)
+        if ids is None:
+            ids = np.arange(1, len(rows) + 1)
+        table._ids = np.asarray(ids, dtype=np.int64)
+        dates = [row.get('date') or '' for row in rows]
+        amounts = [row.get('amount') or '' for row in rows]
+        table._dates = parse_dates(dates)
+        table._amounts = parse_amounts(amounts)
+        table._codes = np.array(
+            [table.category_code(row.get('category') or '') for row in rows],
+            dtype=np.int32,
+        )
+        table.texts = [row.get(text_field) or '' for row in rows]
+        table._size = len(rows)
+        return table
+
+    @classmethod
+    def from_columns(cls, text_field, ids, dates, amounts, codes, texts, categories,
+                     rollup=None):
+        """
+        Build a table around existing column arrays without copying them
+        (binary_ledger passes mmapped columns and an append-only texts
+        view; they are copied on the first write that needs to). rollup is
+        the MonthlyRollup of these columns, if the caller already has it.
+        """
+        table = cls(text_field)
+        table._ids, table._dates = ids, dates
+        table._amounts, table._codes = amounts, codes
+        table.texts = texts
+        for category in categories:
+            table.category_code(category)
+        table._size = len(ids)
+        table._rollup = rollup
+        return table
+
+    def __len__(self):
+        return self._size
+
+    def version_key(self):
+        """Changes whenever this table changes (or is replaced by a reload)"""
+        return (self.uid, self.version)
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def dates(self):
+        return self._dates[:self._size]
+
+    @property
+    def amounts(self):
+        return self._amounts[:self._size]
+
+    @property
+    def codes(self):
+        return self._codes[:self._size]
+
+    @_locked
+    def nbytes(self):
+        """Approximate memory held by the table: columns, indexes and texts"""
+        arrays = [self._ids, self._dates, self._amounts, self._codes,
+                  self._order, self._sorted_dates]
+        for view in self._sort_views.values():
+            arrays.extend(view)
+        if self._rollup is not None:
+            arrays += [self._rollup.sums, self._rollup.counts]
+        total = sum(a.nbytes for a in arrays if a is not None)
+        total += len(self.texts) * TEXT_BYTES
+        if self._text_index is not None:
+            total += self._text_index.nbytes()
+        return total
+
+    def category_code(self, category):
+        """Return the integer code for a category, adding it if new"""
+        code = self._category_codes.get(category)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(category)
+            self._category_codes[category] = code
+        return code
+
+    def _own_texts(self):
+        """self.texts as a list we can modify in place (it may be a view)"""
+        if not isinstance(self.texts, list):
+            self.texts = list(self.texts)
+        return self.texts
+
+    def _grow(self):
+        for name in ('_ids', '_dates', '_amounts', '_codes'):
+            setattr(self, name, _grown(getattr(self, name), self._size))
+
+    def position(self, record_id):
+        """Row position of a record id, or None if there is no such record"""
+        i = int(np.searchsorted(self.ids, record_id))
+        if i < self._size and self._ids[i] == record_id:
+            return i
+        return None
+
+    def next_id(self):
+        return int(self._ids[self._size - 1]) + 1 if self._size else 1
+
+    @_locked
+    def append(self, date, amount, text, category, record_id=None):
+        if record_id is None:
+            record_id = self.next_id()
+        if self._size == len(self._amounts):
+            self._grow()
+        i = self._size
+        self._ids[i] = record_id
+        self._dates[i] = parse_date(date)
+        self._amounts[i] = parse_amount(amount)
+        self._codes[i] = self.category_code(category or '')
+        self.texts.append(text or '')
+        self._size += 1
+        self.version += 1
+        self._index_append(i)
+        if self._rollup is not None:
+            self._rollup.add(self._dates[i], self._codes[i], self._amounts[i])
+        if self._text_index is not None:
+            self._text_index.add(int(record_id), text)
+
+    @_locked
+    def extend(self, rows, ids):
+        """
+        Append many rows (dicts with date, amount, text and category) at once.
+
+        The columns are parsed and copied in one vectorized step per batch.
+        The date index is extended when the batch continues it in date
+        order and the monthly rollup gets one bincount for the whole batch.
+        """
+        count = len(rows)
+        if not count:
+            return
+        start = self._size
+        while start + count > len(self._amounts):
+            self._grow()
+        end = start + count
+        self._ids[start:end] = ids
+        self._dates[start:end] = parse_dates([row.get('date') or '' for row in rows])
+        self._amounts[start:end] = parse_amounts(
+            [row.get('amount') or '' for row in rows]
+        )
+        self._codes[start:end] = [
+            self.category_code(row.get('category') or '') for row in rows
+        ]
+        self.texts.extend(row.get(self.text_field) or '' for row in rows)
+        self._size = end
+        self.version += 1
+
+        if self._order is not None:
+            dates = self._dates[start:end]
+            n = self._index_size
+            ordered = not np.isnat(dates).any() and bool(
+                (dates[1:] >= dates[:-1]).all()
+            )
+            if ordered and n:
+                newest = self._sorted_dates[n - 1]
+                ordered = bool(not np.isnat(newest) and dates[0] >= newest)
+            if ordered:
+                while n + count > len(self._order):
+                    self._order = _grown(self._order, n)
+                    self._sorted_dates = _grown(self._sorted_dates, n)
+                self._order[n:n + count] = np.arange(start, end)
+                self._sorted_dates[n:n + count] = dates
+                self._index_size = n + count
+                self._in_order = self._in_order and start == n
+            else:
+                self._order = None
+        if self._rollup is not None:
+            self._rollup.add_many(
+                self._dates[start:end], self._codes[start:end], self._amounts[start:end]
+            )
+        if self._text_index is not None:
+            ids = self._ids[start:end].tolist()
+            for record_id, text in zip(ids, self.texts[start:end], strict=True):
+                self._text_index.add(record_id, text)
+
+    @_locked
+    def update(self, index, fields):
+        self.version += 1
+        self._sort_views = {}
+        if self._rollup is not None:
+            self._rollup.remove(
+                self._dates[index], self._codes[index], self._amounts[index]
+            )
+        if 'date' in fields:
+            date = parse_date(fields['date'])
+            old = self._dates[index]
+            # Stores pass the whole row: only a new date moves the index entry
+            if not (date == old or (np.isnat(date) and np.isnat(old))):
+                self._index_remove(index)
+                self._dates[index] = date
+                self._index_insert(index)
+        if 'amount' in fields:
+            self._amounts[index] = parse_amount(fields['amount'])
+        if 'category' in fields:
+            self._codes[index] = self.category_code(fields['category'] or '')
+        if self.text_field in fields:
+            text = fields[self.text_field] or ''
+            if self._text_index is not None:
+                record_id = int(self._ids[index])
+                self._text_index.remove(record_id, self.texts[index])
+                self._text_index.insert(record_id, text)
+            self._own_texts()[index] = text
+        if self._rollup is not None:
+            self._rollup.add(
+                self._dates[index], self._codes[index], self._amounts[index]
+            )
+
+    @_locked
+    def delete(self, index):
+        self.version += 1
+        self._sort_views = {}
+        if self._rollup is not None:
+            self._rollup.remove(
+                self._dates[index], self._codes[index], self._amounts[index]
+            )
+        if self._text_index is not None:
+            self._text_index.remove(int(self._ids[index]), self.texts[index])
+        self._index_remove(index)
+        if self._order is not None:
+            # Later rows move up one position
+            order = self._order[:self._index_size]
+            order[order > index] -= 1
+        self._ids = np.delete(self.ids, index)
+        self._dates = np.delete(self.dates, index)
+        self._amounts = np.delete(self.amounts, index)
+        self._codes = np.delete(self.codes, index)
+        # New list rather than del, so iter_rows() callers keep a stable view
+        self.texts = self.texts[:index] + self.texts[index + 1:]
+        self._size -= 1
+
+    @_locked
+    def take(self, selector):
+        """New table holding the rows picked by a boolean mask or index array"""
+        table = LedgerTable(self.text_field)
+        table.categories = self.categories
+        table._category_codes = self._category_codes
+        table._ids = self.ids[selector]
+        table._dates = self.dates[selector]
+        table._amounts = self.amounts[selector]
+        table._codes = self.codes[selector]
+        if isinstance(selector, slice):
+            table.texts = self.texts[selector]
+        else:
+            picked = np.arange(self._size)[selector]
+            table.texts = [self.texts[i] for i in picked]
+        table._size = len(table._amounts)
+        return table
+
+    @_locked
+    def _date_index(self):
+        if self._order is None:
+            order = np.argsort(self.dates, kind='stable')
+            self._order = order
+            self._sorted_dates = self.dates[order]
+            self._index_size = len(order)
+            self._in_order = bool((order == np.arange(len(order))).all())
+        return self._order[:self._index_size], self._sorted_dates[:self._index_size]
+
+    def _index_append(self, i):
+        """Keep the date index valid when row i was appended"""
+        if self._order is None:
+            return
+        date = self._dates[i]
+        n = self._index_size
+        last = self._sorted_dates[n - 1] if n else None
+        if np.isnat(date) or (n and (np.isnat(last) or date < last)):
+            # Out of order: rebuild lazily on the next range query
+            self._order = None
+            return
+        if n == len(self._order):
+            self._order = _grown(self._order, n)
+            self._sorted_dates = _grown(self._sorted_dates, n)
+        self._order[n] = i
+        self._sorted_dates[n] = date
+        self._index_size = n + 1
+        self._in_order = self._in_order and i == n
+
+    def _index_position(self, i):
+        """Where row i (with its current date) belongs in the date index"""
+        n = self._index_size
+        date = self._dates[i]
+        lo = int(np.searchsorted(self._sorted_dates[:n], date, side='left'))
+        hi = int(np.searchsorted(self._sorted_dates[:n], date, side='right'))
+        # Rows with the same date are in position order (a stable sort)
+        return lo + int(np.searchsorted(self._order[lo:hi], i))
+
+    def _index_remove(self, i):
+        """Take row i out of the date index (positions are left as they are)"""
+        if self._order is None:
+            return
+        n = self._index_size
+        p = self._index_position(i)
+        self._order[p:n - 1] = self._order[p + 1:n]
+        self._sorted_dates[p:n - 1] = self._sorted_dates[p + 1:n]
+        self._index_size = n - 1
+
+    def _index_insert(self, i):
+        """Put row i back into the date index at its date's place"""
+        if self._order is None:
+            return
+        n = self._index_size
+        p = self._index_position(i)
+        self._order[p + 1:n + 1] = self._order[p:n]
+        self._sorted_dates[p + 1:n + 1] = self._sorted_dates[p:n]
+        self._order[p] = i
+        self._sorted_dates[p] = self._dates[i]
+        self._index_size = n + 1
+        self._in_order = bool((self._order[:n + 1] == np.arange(n + 1)).all())
+
+    @_locked
+    def date_window(self, start_date=None, end_date=None):
+        """
+        Positions of the rows dated start_date..end_date inclusive.
+
+        Returns a slice when the rows are stored in date order (the usual
+        case, since new rows are dated today), otherwise a sorted index
+        array. Either way the cost is O(log n) plus the size of the window.
+        """
+        order, sorted_dates = self._date_index()
+        lo = 0
+        hi = int(np.searchsorted(sorted_dates, np.datetime64('NaT', 'D'), side='left'))
+        if start_date:
+            start = parse_date(start_date)
+            lo = int(np.searchsorted(sorted_dates[:hi], start, side='left'))
+        if end_date:
+            end = parse_date(end_date)
+            hi = int(np.searchsorted(sorted_dates[:hi], end, side='right'))
+        if hi < lo:
+            hi = lo
+        if self._in_order:
+            return slice(lo, hi)
+        return np.sort(order[lo:hi])
+
+    def between(self, start_date=None, end_date=None):
+        """Rows dated from start_date to end_date inclusive (either may be empty)"""
+        if not start_date and not end_date:
+            return self
+        return self.take(self.date_window(start_date, end_date))
+
+    def row(self, index):
+        """One row as a dict, in the shape the templates expect"""
+        return {
+            'id': int(self._ids[index]),
+            'date': format_date(self._dates[index]),
+            'amount': float(self._amounts[index]),
+            self.text_field: self.texts[index],
+            'category': self.categories[self._codes[index]],
+        }
+
+    @_locked
+    def rows(self):
+        """All rows as a list of dicts"""
+        return [self.row(i) for i in range(self._size)]
+
+    @_locked
+    def select(self, start_date=None, end_date=None, category=None):
+        """
+        Positions (slice or index array) of rows matching a date range and
+        category
+        """
+        if start_date or end_date:
+            selector = self.date_window(start_date, end_date)
+        else:
+            selector = slice(0, self._size)
+        if category:
+            code = self._category_codes.get(category)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            positions = np.arange(self._size)[selector]
+            selector = positions[self.codes[selector] == code]
+        return selector
+
+    @_locked
+    def text_index(self):
+        """The TextIndex of the text column, built on first use"""
+        if self._text_index is None:
+            self._text_index = TextIndex.build(self.ids, self.texts)
+        return self._text_index
+
+    @_locked
+    def search(self, query, start_date=None, end_date=None, category=None):
+        """
+        Sorted positions of the rows whose text matches query (every word,
+        as a word prefix), optionally within a date range and category.
+        Returns None when query has no words.
+        """
+        ids = self.text_index().lookup(query)
+        if ids is None:
+            return None
+        if self._size and self._ids[self._size - 1] - self._ids[0] == self._size - 1:
+            positions = ids - self._ids[0]  # No gaps in the ids
+        else:
+            positions = np.searchsorted(self.ids, ids)
+        if category:
+            code = self._category_codes.get(category)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            positions = positions[self.codes[positions] == code]
+        if start_date or end_date:
+            dates = self.dates[positions]
+            keep = ~np.isnat(dates)
+            if start_date:
+                keep &= dates >= parse_date(start_date)
+            if end_date:
+                keep &= dates <= parse_date(end_date)
+            positions = positions[keep]
+        return positions
+
+    @_locked
+    def _search_view(self, sort, positions):
+        """(order, values, ids) like _sort_view, for just the given positions"""
+        if sort != 'amount':
+            self._date_index()
+            if self._in_order:
+                # Rows are stored in date order: positions already sorted
+                return positions, self.dates[positions], self.ids[positions]
+        values = self.amounts[positions] if sort == 'amount' else self.dates[positions]
+        ids = self.ids[positions]
+        order = np.lexsort((ids, values))
+        return positions[order], values[order], ids[order]
+
+    @_locked
+    def _sort_view(self, sort, code=None):
+        """
+        (order, values, ids) with rows sorted by (sort value, id), optionally
+        only rows of one category code. Built on first use; rows appended
+        since are merged in (edits and deletes drop the views).
+        """
+        if self._sort_views_version != self.version:
+            start = self._sort_views_size
+            for key, view in self._sort_views.items():
+                self._sort_views[key] = self._merge_appended(view, *key, start)
+            self._sort_views_version = self.version
+            self._sort_views_size = self._size
+        view = self._sort_views.get((sort, code))
+        if view is None:
+            if sort == 'amount':
+                order = np.lexsort((self.ids, self.amounts))
+                values = self.amounts[order]
+            else:
+                # The date index is a stable sort, and positions follow ids
+                order, values = self._date_index()
+            if code is not None:
+                keep = self.codes[order] == code
+                order, values = order[keep], values[keep]
+            view = (order, values, self.ids[order])
+            self._sort_views[(sort, code)] = view
+        return view
+
+    def _merge_appended(self, view, sort, code, start):
+        """view with the rows from position start on merged in"""
+        new = np.arange(start, self._size)
+        if code is not None:
+            new = new[self.codes[new] == code]
+        if not len(new):
+            return view
+        order, values, ids = view
+        new_values = self.amounts[new] if sort == 'amount' else self.dates[new]
+        new_ids = self.ids[new]
+        rank = np.lexsort((new_ids, new_values))
+        new, new_values, new_ids = new[rank], new_values[rank], new_ids[rank]
+        # Appended ids are the largest, so they go after equal values
+        at = np.searchsorted(values, new_values, side='right')
+        return (np.insert(order, at, new), np.insert(values, at, new_values),
+                np.insert(ids, at, new_ids))
+
+    def cursor(self, row, sort='date'):
+        """Keyset cursor ('value~id') pointing at a row dict"""
+        return f"{row[sort]}~{row['id']}"
+
+    def _parse_cursor(self, cursor, sort):
+        value, record_id = cursor.rsplit('~', 1)
+        if sort == 'amount':
+            return float(value), int(record_id)
+        if not value:
+            return np.datetime64('NaT', 'D'), int(record_id)
+        return np.datetime64(value, 'D'), int(record_id)
+
+    @_locked
+    def page(self, sort='date', descending=False, after=None, before=None,
+             limit=50, category=None, search=None):
+        """
+        One page of rows ordered by (sort, id), addressed by keyset cursors.
+
+        after/before are cursors from a previous page's last/first row.
+        Finding the cursor is a binary search in the sort view, so the cost
+        is O(log n + limit) whatever page is requested. Category filters use
+        a per-category view; a search term is looked up in the text index
+        and only its matches are sorted and paged.
+
+        Returns (rows, next_cursor, prev_cursor); a cursor is None when
+        there is nothing further in that direction.
+        """
+        code = None
+        if category:
+            code = self._category_codes.get(category)
+            if code is None:
+                return [], None, None
+        matches = self.search(search, category=category) if search else None
+        if matches is not None:
+            order, values, ids = self._search_view(sort, matches)
+        else:
+            order, values, ids = self._sort_view(sort, code)
+        n = len(order)
+
+        cursor = before or after
+        if cursor:
+            value, record_id = self._parse_cursor(cursor, sort)
+            lo = int(np.searchsorted(values, value, side='left'))
+            hi = int(np.searchsorted(values, value, side='right'))
+            left = (before and not descending) or (after and descending)
+            side = 'left' if left else 'right'
+            split = lo + int(np.searchsorted(ids[lo:hi], record_id, side=side))
+
+        # Take limit + 1 rows forwards or backwards from the cursor
+        forward = descending == bool(before)
+        if forward:
+            start = split if cursor else 0
+            found = order[start:start + limit + 1].tolist()
+        else:
+            stop = split if cursor else n
+            found = order[max(stop - limit - 1, 0):stop][::-1].tolist()
+
+        more = len(found) > limit
+        found = found[:limit]
+        if before:
+            found.reverse()
+            has_next, has_prev = True, more
+        else:
+            has_next, has_prev = more, bool(after)
+        rows = [self.row(i) for i in found]
+        next_cursor = self.cursor(rows[-1], sort) if rows and has_next else None
+        prev_cursor = self.cursor(rows[0], sort) if rows and has_prev else None
+        return rows, next_cursor, prev_cursor
+
+    def iter_rows(self, selector=None):
+        """
+        Yield rows as dicts one at a time (for streaming).
+
+        The columns are captured up front, so rows appended or deleted
+        while iterating don't shift the rows being yielded.
+        """
+        with self.lock:
+            ids, dates, amounts, codes = self.ids, self.dates, self.amounts, self.codes
+            texts, categories = self.texts, self.categories
+        if selector is None:
+            selector = slice(0, len(ids))
+        if isinstance(selector, slice):
+            positions = range(*selector.indices(len(ids)))
+        else:
+            positions = selector
+        for i in positions:
+            yield {
+                'id': int(ids[i]),
+                'date': format_date(dates[i]),
+                'amount': float(amounts[i]),
+                self.text_field: texts[i],
+                'category': categories[codes[i]],
+            }
+
+    @_locked
+    def rollup(self):
+        """The MonthlyRollup for this table, built on first use"""
+        if self._rollup is None:
+            self._rollup = MonthlyRollup.build(
+                self.dates, self.codes, self.amounts, len(self.categories)
+            )
+        return self._rollup
+
+    @_locked
+    def window_sums(self, start_date=None, end_date=None):
+        """
+        (counts, sums) per category code for rows dated start..end inclusive.
+
+        Whole months inside the range are answered from the rollup's prefix
+        sums; only the partial months at either end touch individual rows.
+        """
+        rollup = self.rollup()
+        width = len(self.categories)
+        if not start_date and not end_date:
+            return rollup.category_counts(width), rollup.category_sums(width)
+
+        start = parse_date(start_date) if start_date else None
+        end = parse_date(end_date) if end_date else None
+        if any(bound is not None and np.isnat(bound) for bound in (start, end)):
+            return self.row_sums(self.date_window(start_date, end_date))
+
+        # First and last months that lie completely inside the range
+        first = last = None
+        if start is not None:
+            first = start.astype('datetime64[M]')
+            if first.astype('datetime64[D]') != start:
+                first += ONE_MONTH
+        if end is not None:
+            last = end.astype('datetime64[M]')
+            if (end + ONE_DAY).astype('datetime64[M]') == last:
+                last -= ONE_MONTH
+        if first is not None and last is not None and first > last:
+            return self.row_sums(self.date_window(start_date, end_date))
+
+        counts, sums = rollup.range_sums(first, last, width)
+        if first is not None and start < first.astype('datetime64[D]'):
+            edge = self.date_window(
+                start_date, str(first.astype('datetime64[D]') - ONE_DAY)
+            )
+            edge_counts, edge_sums = self.row_sums(edge)
+            counts += edge_counts
+            sums += edge_sums
+        if last is not None:
+            after_last = (last + ONE_MONTH).astype('datetime64[D]')
+            if end >= after_last:
+                edge = self.date_window(str(after_last), end_date)
+                edge_counts, edge_sums = self.row_sums(edge)
+                counts += edge_counts
+                sums += edge_sums
+        return counts, sums
+
+    @_locked
+    def row_sums(self, selector):
+        """(counts, sums) per category code for the rows picked by selector"""
+        width = len(self.categories)
+        codes = self.codes[selector]
+        counts = np.bincount(codes, minlength=width)
+        sums = np.bincount(codes, weights=self.amounts[selector], minlength=width)
+        return counts, sums
+
+    def category_dict(self, counts, sums):
+        """{category: total} for the codes with a non-zero count"""
+        return {
+            self.categories[code]: float(sums[code])
+            for code in np.flatnonzero(counts)
+        }
+
+    @_locked
+    def total(self):
+        return float(self.rollup().category_sums(len(self.categories)).sum())
+
+    @_locked
+    def category_totals(self):
+        """{category: total} for every category that has at least one row"""
+        return self.category_dict(*self.window_sums())
+
+    @_locked
+    def monthly_totals(self):
+        """{'YYYY-MM': total} for every month that has at least one row"""
+        return self.rollup().monthly_totals()
+
+
+class MonthlyRollup:
+    """
+    Sums and row counts per (month, category code), plus prefix sums.
+
+    Writes adjust a single cell, so keeping the rollup current costs O(1)
+    per add/edit/delete (the grid only grows when a new month or category
+    shows up). The cumulative prefix sums over months are recomputed lazily
+    after a write, which is O(months x categories) and independent of the
+    number of rows. Rows without a valid date only count towards the
+    all-time category totals.
+    """
+
+    def __init__(self, width=0):
+        self.first_month = None
+        self.sums = np.zeros((0, width))
+        self.counts = np.zeros((0, width), dtype=np.int64)
+        self.undated_sums = np.zeros(width)
+        self.undated_counts = np.zeros(width, dtype=np.int64)
+        self._prefix = None
+
+    @classmethod
+    def build(cls, dates, codes, amounts, width):
+        rollup = cls(width)
+        undated = np.isnat(dates)
+        # (bincount returns integers for an empty input, even with weights)
+        rollup.undated_sums = np.bincount(
+            codes[undated], weights=amounts[undated], minlength=width
+        ).astype(np.float64)
+        rollup.undated_counts = np.bincount(codes[undated], minlength=width)
+
+        dated = ~undated
+        months = dates[dated].astype('datetime64[M]').astype(np.int64)
+        if len(months):
+            rollup.first_month = int(months.min())
+            height = int(months.max()) - rollup.first_month + 1
+            cells = (months - rollup.first_month) * width + codes[dated]
+            rollup.sums = np.bincount(
+                cells, weights=amounts[dated], minlength=height * width
+            ).astype(np.float64).reshape(height, width)
+            rollup.counts = np.bincount(
+                cells, minlength=height * width
+            ).reshape(height, width)
+        return rollup
+
+    def _fit(self, month, code):
+        """Grow the grid so it has a row for month and a column for code"""
+        height, width = self.sums.shape
+        if code >= width:
+            extra = code + 1 - width
+            self.sums = np.pad(self.sums, ((0, 0), (0, extra)))
+            self.counts = np.pad(self.counts, ((0, 0), (0, extra)))
+            self.undated_sums = np.pad(self.undated_sums, (0, extra))
+            self.undated_counts = np.pad(self.undated_counts, (0, extra))
+        if month is None:
+            return
+        if self.first_month is None:
+            self.first_month = month
+        if month < self.first_month:
+            before = self.first_month - month
+            self.sums = np.pad(self.sums, ((before, 0), (0, 0)))
+            self.counts = np.pad(self.counts, ((before, 0), (0, 0)))
+            self.first_month = month
+        elif month - self.first_month >= height:
+            after = month - self.first_month - height + 1
+            self.sums = np.pad(self.sums, ((0, after), (0, 0)))
+            self.counts = np.pad(self.counts, ((0, after), (0, 0)))
+
+    def _apply(self, date, code, amount, count):
+        code = int(code)
+        if np.isnat(date):
+            self._fit(None, code)
+            self.undated_sums[code] += amount
+            self.undated_counts[code] += count
+            return
+        month = int(date.astype('datetime64[M]').astype(np.int64))
+        self._fit(month, code)
+        self.sums[month - self.first_month, code] += amount
+        self.counts[month - self.first_month, code] += count
+        self._prefix = None
+
+    def add(self, date, code, amount):
+        self._apply(date, code, amount, 1)
+
+    def remove(self, date, code, amount):
+        self._apply(date, code, -amount, -1)
+
+    def add_many(self, dates, codes, amounts):
+        """Add a batch of rows: one rollup of the batch merged into this one"""
+        if not len(dates):
+            return
+        width = max(self.sums.shape[1], int(codes.max()) + 1)
+        batch = MonthlyRollup.build(dates, codes, amounts, width)
+        self._fit(None, width - 1)
+        self.undated_sums += batch.undated_sums
+        self.undated_counts += batch.undated_counts
+        if batch.first_month is None:
+            return
+        height = batch.sums.shape[0]
+        self._fit(batch.first_month, 0)
+        self._fit(batch.first_month + height - 1, 0)
+        row = batch.first_month - self.first_month
+        self.sums[row:row + height] += batch.sums
+        self.counts[row:row + height] += batch.counts
+        self._prefix = None
+
+    def _prefixes(self):
+        if self._prefix is None:
+            width = self.sums.shape[1]
+            self._prefix = (
+                np.vstack([
+                    np.zeros((1, width), dtype=np.int64), np.cumsum(self.counts, axis=0)
+                ]),
+                np.vstack([np.zeros((1, width)), np.cumsum(self.sums, axis=0)]),
+            )
+        return self._prefix
+
+    def _widen(self, values, width):
+        return np.pad(values, (0, max(0, width - len(values))))
+
+    def category_counts(self, width):
+        return self._widen(self.counts.sum(axis=0) + self.undated_counts, width)
+
+    def category_sums(self, width):
+        return self._widen(self.sums.sum(axis=0) + self.undated_sums, width)
+
+    def range_sums(self, first=None, last=None, width=0):
+        """
+        (counts, sums) per category for the months first..last inclusive
+        (datetime64[M] values, None for unbounded) from prefix differences
+        """
+        prefix_counts, prefix_sums = self._prefixes()
+        height = self.sums.shape[0]
+        lo, hi = 0, height
+        if self.first_month is not None:
+            if first is not None:
+                lo = int(first.astype(np.int64)) - self.first_month
+                lo = min(max(lo, 0), height)
+            if last is not None:
+                hi = int(last.astype(np.int64)) - self.first_month + 1
+                hi = min(max(hi, 0), height)
+        hi = max(hi, lo)
+        counts = self._widen(prefix_counts[hi] - prefix_counts[lo], width)
+        sums = self._widen(prefix_sums[hi] - prefix_sums[lo], width)
+        return counts, sums
+
+    def monthly_totals(self):
+        """{'YYYY-MM': total} for every month that has at least one row"""
+        if self.first_month is None:
+            return {}
+        months = np.flatnonzero(self.counts.sum(axis=1))
+        totals = self.sums.sum(axis=1)
+        return {
+            str(np.datetime64(self.first_month + int(m), 'M')): float(totals[m])
+            for m in months
+        }
+
+
+def _grown(arr, size):
+    """Copy of arr with double the capacity, keeping the first size items"""
+    new = np.empty(max(16, len(arr) * 2), dtype=arr.dtype)
+    new[:size] = arr[:size]
+    return new
+
+
+def parse_date(value):
+    try:
+        return np.datetime64(value, 'D')
+    except (ValueError, TypeError):
+        print(f"Error: Invalid date '{value}'")
+        return np.datetime64('NaT', 'D')
+
+
+def parse_amount(value):
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        print(f"Error: Invalid amount '{value}'")
+        return 0.0
+
+
+def parse_dates(values):
+    """Vectorized date parsing, falling back to row by row on bad input"""
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except (ValueError, TypeError):
+        return np.array([parse_date(v) for v in values], dtype='datetime64[D]')
+
+
+def parse_amounts(values):
+    """Vectorized amount parsing, falling back to row by row on bad input"""
+    try:
+        return np.array(values, dtype=np.float64)
+    except (ValueError, TypeError):
+        return np.array([parse_amount(v) for v in values], dtype=np.float64)
+
+
+def format_date(value):
+    return '' if np.isnat(value) else str(value)
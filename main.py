@@ -1,67 +1,188 @@
 import csv
-import os
-from datetime import datetime
 import io
-from flask import Flask, redirect, render_template, request, send_file
-from sklearn.linear_model import LinearRegression
-import numpy as np
-from datetime import datetime, timedelta  # Add timedelta here!
-from babel.numbers import format_currency
+import json
+import os
+import re
+import zlib
+from dataclasses import asdict
+from datetime import datetime, timedelta
 
+import numpy as np
+from flask import (
+    Flask,
+    Response,
+    abort,
+    g,
+    redirect,
+    render_template,
+    request,
+    stream_with_context,
+)
+from werkzeug.local import LocalProxy
+
+import metrics
+from analytics import CashFlowCache
+from budget_engine import BudgetEngine, period_bounds
+from cache import ResponseCache
+from dashboard import GRANULARITIES, build_snapshot, downsample, time_series
+from forecast import INTERVAL_LEVEL, MAX_HORIZON_MONTHS, CategoryForecast, TrendForecast
+from importer import import_csv
+from storage import SharedCounter, WriteQueue, open_stores
+from tenants import TenantRegistry, valid_tenant_name
+from text_index import tokenize
+
+try:
+    import orjson  # Optional: faster JSON for the API
+except ImportError:
+    orjson = None
 
 
 app = Flask(__name__)
 
+# Server-Timing headers, /metrics and opt-in slow-request profiles
+metrics.init_app(app)
+
 # CSV files
 EXPENSES_FILE = 'expenses.csv'
 INCOME_FILE = 'income.csv'
 BUDGETS_FILE = 'budgets.csv'
-
-
-def init_csv(filename, headers):
-    """Create CSV file if it doesn't exist"""
-    if not os.path.exists(filename):
-        with open(filename, 'w', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow(headers)
-
+ALERTS_FILE = 'budget_alerts.csv'
+
+# Storage backend: 'csv' (the files above) or 'sqlite' (LEDGER_DB)
+LEDGER_BACKEND = os.environ.get('LEDGER_BACKEND', 'csv')
+LEDGER_DB = os.environ.get('LEDGER_DB', 'finance.db')
+
+DASHBOARD_CACHE_ENTRIES = 128
+GENERATION_FILE = os.environ.get('LEDGER_GENERATION_FILE', 'finance.gen')
+
+# Multi-tenant mode: with LEDGER_TENANTS_DIR set, every user has the files
+# above in their own directory under it, picked by the LEDGER_TENANT_HEADER
+# request header, and at most LEDGER_TENANT_MEMORY_MB of ledgers stay
+# loaded (see tenants.py). Otherwise there is one ledger, in the working
+# directory.
+TENANTS_DIR = os.environ.get('LEDGER_TENANTS_DIR')
+TENANT_HEADER = os.environ.get('LEDGER_TENANT_HEADER', 'X-Ledger-User')
+TENANT_MEMORY_MB = float(os.environ.get('LEDGER_TENANT_MEMORY_MB') or 512)
+
+
+class Tenant:
+    """One ledger: its stores and everything the routes keep for them"""
+
+    def __init__(self, directory='.'):
+        def path(name):
+            return os.path.join(directory, name)
+
+        self.expense_store, self.income_store, self.budget_store = open_stores(
+            LEDGER_BACKEND, path(EXPENSES_FILE), path(INCOME_FILE), path(BUDGETS_FILE),
+            path(LEDGER_DB),
+        )
+
+        # Adds from the form routes are group-committed: concurrent requests
+        # share one locked, fsynced append to the log
+        self.expense_writes = WriteQueue(self.expense_store)
+        self.income_writes = WriteQueue(self.income_store)
+
+        # Trend model behind predict_next_month_ml
+        self.spending_trend = TrendForecast()
+
+        # Monthly budget status and the alerts recorded when spending crosses 70%/100%
+        self.budget_engine = BudgetEngine(path(ALERTS_FILE))
+
+        # Daily prefix sums of both ledgers behind the cash-flow figures
+        self.cash_flows = CashFlowCache()
+
+        # Rendered dashboards by date filter, dropped on every write. The
+        # write counter is a memory-mapped file, so a write in any gunicorn
+        # worker invalidates the cache in all of them.
+        self.dashboard_cache = ResponseCache(
+            DASHBOARD_CACHE_ENTRIES, SharedCounter(path(GENERATION_FILE))
+        )
+
+    def resident_bytes(self):
+        """
+        Approximate memory held by the loaded tables, the cash-flow and
+        forecast caches and cached pages
+        """
+        return (self.expense_store.resident_bytes() + self.income_store.resident_bytes()
+                + self.cash_flows.nbytes() + self.budget_engine.nbytes()
+                + self.dashboard_cache.nbytes())
+
+    def close(self):
+        """Close the stores' connections once the registry has dropped this tenant"""
+        for store in (self.expense_store, self.income_store, self.budget_store):
+            store.close()
+
+
+if TENANTS_DIR:
+    tenants = TenantRegistry(TENANTS_DIR, Tenant, int(TENANT_MEMORY_MB * 2**20))
+    default_tenant = None
+else:
+    # Loaded once per process and shared by every route
+    tenants = None
+    default_tenant = Tenant()
+
+
+def current_tenant():
+    """The ledger of this request's user (the only ledger in single-tenant mode)"""
+    if tenants is None:
+        return default_tenant
+    if 'tenant' not in g:
+        name = request.headers.get(TENANT_HEADER, '')
+        if not valid_tenant_name(name):
+            abort(400, f'Missing or invalid {TENANT_HEADER} header')
+        g.tenant_name = name
+        g.tenant = tenants.get(name)
+    return g.tenant
+
+@app.teardown_request
+def account_tenant(_exc=None):
+    """Charge the request's tenant for what it loaded; evicts idle ones past the cap"""
+    if tenants is not None and 'tenant' in g:
+        tenants.account(g.tenant_name, g.tenant)
+
+
+# The current request's ledger: the routes and helpers below use these
+# like plain module globals
+expense_store = LocalProxy(lambda: current_tenant().expense_store)
+income_store = LocalProxy(lambda: current_tenant().income_store)
+budget_store = LocalProxy(lambda: current_tenant().budget_store)
+expense_writes = LocalProxy(lambda: current_tenant().expense_writes)
+income_writes = LocalProxy(lambda: current_tenant().income_writes)
+spending_trend = LocalProxy(lambda: current_tenant().spending_trend)
+budget_engine = LocalProxy(lambda: current_tenant().budget_engine)
+dashboard_cache = LocalProxy(lambda: current_tenant().dashboard_cache)
+cash_flows = LocalProxy(lambda: current_tenant().cash_flows)
+
+
+def get_store(filename):
+    """Return the store for one of the CSV files"""
+    return {
+        EXPENSES_FILE: expense_store,
+        INCOME_FILE: income_store,
+        BUDGETS_FILE: budget_store,
+    }[filename]
+
+
+@metrics.timed()
 def calculate_total(filename):
     """Calculate total amount from CSV file"""
-    total = 0
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    total += float(row['amount'])
-        except:
-            pass
-    return total
+    return get_store(filename).total()
 
+@metrics.timed()
 def get_top_category(filename):
     """Find the category with highest spending"""
-    category_totals = {}
-    if os.path.exists(filename):
-        try:
-            with open(filename, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    category = row['category']
-                    amount = float(row['amount'])
-                    if category in category_totals:
-                        category_totals[category] += amount
-                    else:
-                        category_totals[category] = amount
-        except:
-            pass
+    category_totals = get_store(filename).category_totals()
 
     if category_totals:
         top_category = max(category_totals, key=lambda x: category_totals[x])
         return top_category, category_totals[top_category]
     return None, 0
 
-@app.route("/")
-def home():
+def get_date_filter():
+    """
+    (start_date, end_date) from the filter, start_date and end_date query
+    parameters
+    """
     # Get filter parameters
     filter_type = request.args.get('filter', 'all')
     start_date = request.args.get('start_date')
@@ -84,78 +205,343 @@ def home():
         end_date = today.strftime('%Y-%m-%d')
     # If filter_type == 'all' or custom dates, use start_date/end_date from form
 
-    # Apply date filter to expenses
-    if filter_type == 'all' and not start_date and not end_date:
-        filtered_expenses = get_expenses()
-    else:
-        filtered_expenses = filter_expenses_by_date(start_date, end_date)
-
-    # Calculate stats from filtered expenses
-    total_expenses = sum(float(e['amount']) for e in filtered_expenses)
-    total_income = calculate_total(INCOME_FILE)  # TODO: Add income filtering later
-    balance = total_income - total_expenses
-
-    # Get category breakdown from filtered expenses
-    category_breakdown = {}
-    for expense in filtered_expenses:
-        category = expense['category']
-        amount = float(expense['amount'])
-        if category in category_breakdown:
-            category_breakdown[category] += amount
-        else:
-            category_breakdown[category] = amount
-
-    # Get top category
-    top_category = None
-    top_amount = 0
-    if category_breakdown:
-        top_category = max(category_breakdown, key=category_breakdown.get)
-        top_amount = category_breakdown[top_category]
+    return start_date, end_date
+
+@metrics.timed()
+def get_dashboard_stats(expense_table, income_table, start_date, end_date):
+    """The DashboardSnapshot for a date range, with predictions"""
+    # One pass over the ledger for totals, breakdowns, monthly series and budgets
+    budgets = get_budgets()
+    with metrics.span('build_snapshot'):
+        stats = build_snapshot(
+            expense_table,
+            income_table,
+            budgets,
+            budget_engine,
+            cash_flows,
+            start_date,
+            end_date,
+        )
 
     # ML Predictions (still use all data for predictions)
-    budget_status = get_budget_status()
-    ml_prediction = predict_next_month_ml()
-    simple_prediction = predict_next_month_spending()
-    monthly_data = get_monthly_spending()
+    stats.ml_prediction = predict_next_month_ml(stats.monthly, stats.version)
+    stats.simple_prediction = predict_next_month_spending(stats.monthly)
+    return stats
 
-    stats = {
-        'total_expenses': total_expenses,
-        'total_income': total_income,
-        'balance': balance,
-        'top_category': top_category,
-        'top_amount': top_amount,
-        'category_breakdown': category_breakdown,
-        'budget_status': budget_status,
-        'ml_prediction': ml_prediction,
-        'simple_prediction': simple_prediction,
-        'num_months': len(monthly_data)
-    }
+def cached_response(key, render, mimetype='text/html'):
+    """
+    Response for a dashboard_cache key, calling render() only on a miss.
+    Carries an ETag, and is a 304 when the client already has this version.
+    """
+    cached = dashboard_cache.get(key)
+    if cached is None:
+        cached = dashboard_cache.put(key, render())
+
+    body, etag = cached
+    response = Response(body, mimetype=mimetype)
+    response.set_etag(etag)
+    # Browsers revalidate every time and get a 304 while nothing changed
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+@app.route("/")
+def home():
+    start_date, end_date = get_date_filter()
+    # A malformed date in the URL is ignored rather than failing the page
+    if not valid_date(start_date):
+        print(f"Error: Invalid start_date '{start_date}'")
+        start_date = None
+    if not valid_date(end_date):
+        print(f"Error: Invalid end_date '{end_date}'")
+        end_date = None
+
+    # Same filter, same day and no write since the last render: reuse the
+    # page (the budget period and the cash-flow figures depend on the date)
+    expense_table = expense_store.table()
+    income_table = income_store.table()
+    key = dashboard_cache.key(
+        'home', start_date, end_date, datetime.now().strftime('%Y-%m-%d'),
+        expense_table.version_key(), income_table.version_key(),
+    )
+    return cached_response(key, lambda: render_template(
+        'home.html',
+        stats=get_dashboard_stats(expense_table, income_table, start_date, end_date),
+    ))
+
+API_VERSION = 1
+MAX_SERIES_POINTS = 500
+
+
+def to_json(data):
+    """Compact JSON text (orjson when installed)"""
+    if orjson is not None:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(',', ':'))
+
+def api_error(message, status=400):
+    return Response(to_json({'api_version': API_VERSION, 'error': message}),
+                    status=status, mimetype='application/json')
+
+ISO_MONTH = re.compile(r'\d{4}-\d{2}')
+ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+def valid_date(value):
+    """
+    True for an empty value or a YYYY-MM-DD date. The fields must be
+    zero-padded like NumPy's parser (parse_date) expects; strptime alone
+    would take 2024-1-5.
+    """
+    if not value:
+        return True
+    if not ISO_DATE.fullmatch(value):
+        return False
+    try:
+        datetime.strptime(value, '%Y-%m-%d')
+        return True
+    except ValueError:
+        return False
+
+@app.route('/api/stats')
+def api_stats():
+    """Dashboard stats as JSON (same filter parameters as the dashboard)"""
+    start_date, end_date = get_date_filter()
+    if not valid_date(start_date) or not valid_date(end_date):
+        return api_error('start_date and end_date must be YYYY-MM-DD')
+
+    expense_table = expense_store.table()
+    income_table = income_store.table()
+
+    def render():
+        stats = get_dashboard_stats(expense_table, income_table, start_date, end_date)
+        data = asdict(stats)
+        del data['version']
+        data.update(api_version=API_VERSION, start_date=start_date, end_date=end_date,
+                    num_months=stats.num_months)
+        return to_json(data)
+
+    key = dashboard_cache.key(
+        'api/stats', start_date, end_date, datetime.now().strftime('%Y-%m-%d'),
+        expense_table.version_key(), income_table.version_key(),
+    )
+    return cached_response(key, render, 'application/json')
 
-    return render_template('home.html', stats=stats)
+@app.route('/api/series')
+def api_series():
+    """
+    Spending (or ?kind=income) per day, week or month as JSON for charts:
+    granularity=day|week|month, start, end, category and max_points
+    (longer series are merged into at most that many points)
+    """
+    granularity = request.args.get('granularity', 'month')
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    category = request.args.get('category') or None
+    kind = request.args.get('kind', 'expenses')
+    if granularity not in GRANULARITIES:
+        return api_error(f"granularity must be one of {', '.join(GRANULARITIES)}")
+    if kind not in ('expenses', 'income'):
+        return api_error('kind must be expenses or income')
+    if not valid_date(start) or not valid_date(end):
+        return api_error('start and end must be YYYY-MM-DD')
+    try:
+        max_points = int(request.args.get('max_points', MAX_SERIES_POINTS))
+    except ValueError:
+        return api_error('max_points must be a number')
+    max_points = min(max(max_points, 1), MAX_SERIES_POINTS)
+
+    table = (expense_store if kind == 'expenses' else income_store).table()
+
+    def render():
+        labels, totals = time_series(table, granularity, start, end, category)
+        labels, totals, step = downsample(labels, totals, max_points)
+        return to_json({
+            'api_version': API_VERSION,
+            'kind': kind,
+            'granularity': granularity,
+            'start': start,
+            'end': end,
+            'category': category,
+            'buckets_per_point': step,
+            'labels': labels,
+            'values': [round(total, 2) for total in totals.tolist()],
+        })
+
+    key = dashboard_cache.key(
+        'api/series', kind, granularity, start, end, category, max_points,
+        table.version_key(),
+    )
+    try:
+        return cached_response(key, render, 'application/json')
+    except ValueError as e:
+        # The span is too long for this granularity
+        return api_error(str(e))
+
+@app.route('/api/forecast')
+def api_forecast():
+    """
+    Spending forecast per category for month (YYYY-MM, default this month,
+    at most MAX_HORIZON_MONTHS ahead) from the months before it, with 90%
+    prediction intervals, as JSON; seasonal=0 leaves out the month-of-year
+    terms
+    """
+    this_month = period_bounds()[2]
+    month = request.args.get('month') or this_month
+    seasonal = request.args.get('seasonal') != '0'
+    # strptime alone would take '2024-1', which NumPy doesn't parse
+    if not ISO_MONTH.fullmatch(month):
+        return api_error('month must be YYYY-MM')
+    try:
+        ahead = np.datetime64(month, 'M') - np.datetime64(this_month, 'M')
+    except ValueError:
+        return api_error('month must be YYYY-MM')
+    if ahead > np.timedelta64(MAX_HORIZON_MONTHS, 'M'):
+        return api_error(f'month must be at most {MAX_HORIZON_MONTHS} months ahead')
+
+    table = expense_store.table()
+
+    def render():
+        forecasts = CategoryForecast(seasonal).forecast(table, month)
+        return to_json({
+            'api_version': API_VERSION,
+            'month': month,
+            'seasonal': seasonal,
+            'level': INTERVAL_LEVEL,
+            'total': round(sum(f['forecast'] for f in forecasts.values()), 2),
+            'categories': {
+                category: {name: None if value is None else round(value, 2)
+                           for name, value in forecast.items()}
+                for category, forecast in forecasts.items()
+            },
+        })
+
+    key = dashboard_cache.key('api/forecast', month, seasonal, table.version_key())
+    return cached_response(key, render, 'application/json')
+
+SEARCH_ROWS = 50
+MAX_SEARCH_ROWS = 500
+
+
+@app.route('/api/search')
+def api_search():
+    """
+    Expenses (or ?kind=income) whose description/source matches q (every
+    word, as a word prefix) as JSON, with start, end and category filters:
+    the number of matches, their total and totals per category, and the
+    newest limit matches
+    """
+    q = request.args.get('q', '')
+    start = request.args.get('start') or None
+    end = request.args.get('end') or None
+    category = request.args.get('category') or None
+    kind = request.args.get('kind', 'expenses')
+    if not tokenize(q):
+        return api_error('q must contain at least one word')
+    if kind not in ('expenses', 'income'):
+        return api_error('kind must be expenses or income')
+    if not valid_date(start) or not valid_date(end):
+        return api_error('start and end must be YYYY-MM-DD')
+    try:
+        limit = int(request.args.get('limit', SEARCH_ROWS))
+        limit = min(max(limit, 0), MAX_SEARCH_ROWS)
+    except ValueError:
+        return api_error('limit must be a number')
+
+    table = (expense_store if kind == 'expenses' else income_store).table()
+
+    def render():
+        with table.lock:
+            positions = table.search(q, start, end, category)
+            counts, sums = table.row_sums(positions)
+            # Newest first, like the listing pages
+            order = np.lexsort((table.ids[positions], table.dates[positions]))
+            newest = positions[order[::-1][:limit]]
+            rows = [table.row(i) for i in newest.tolist()]
+        return to_json({
+            'api_version': API_VERSION,
+            'q': q,
+            'kind': kind,
+            'start': start,
+            'end': end,
+            'category': category,
+            'count': len(positions),
+            'total': round(float(sums.sum()), 2),
+            'category_totals': {
+                name: round(total, 2)
+                for name, total in table.category_dict(counts, sums).items()
+            },
+            'rows': rows,
+        })
+
+    key = dashboard_cache.key(
+        'api/search', kind, q, start, end, category, limit, table.version_key()
+    )
+    return cached_response(key, render, 'application/json')
+
+PAGE_SIZE = 50
+
+
+def list_page(store):
+    """
+    One page of an expense/income listing, from the query parameters:
+    sort (date|amount), order (desc|asc), category, q (search words,
+    matched as word prefixes) and the after/before keyset cursors of the
+    previous page
+    """
+    sort = request.args.get('sort', 'date')
+    if sort not in ('date', 'amount'):
+        sort = 'date'
+    order = 'asc' if request.args.get('order') == 'asc' else 'desc'
+    category = request.args.get('category') or None
+    search = request.args.get('q') or None
+    after = request.args.get('after') or None
+    before = request.args.get('before') or None
+
+    table = store.table()
+    try:
+        rows, next_cursor, prev_cursor = table.page(
+            sort, order == 'desc', after, before, PAGE_SIZE, category, search
+        )
+    except ValueError:
+        print(f"Error: Invalid page cursor '{after or before}'")
+        rows, next_cursor, prev_cursor = table.page(
+            sort, order == 'desc', None, None, PAGE_SIZE, category, search
+        )
+
+    # Count and total of everything the search matches, not just this page
+    matches = None
+    with table.lock:
+        positions = table.search(search, category=category) if search else None
+        if positions is not None:
+            matches = {
+                'count': len(positions),
+                'total': float(table.amounts[positions].sum()),
+            }
+
+    return {
+        'rows': rows,
+        'matches': matches,
+        'next': next_cursor,
+        'prev': prev_cursor,
+        'sort': sort,
+        'order': order,
+        'category': category,
+        'q': search,
+        'categories': sorted(table.category_totals()),
+    }
 
 @app.template_filter('inr')
 def format_inr(value):
+    # Imported on first use to keep worker start-up fast
+    from babel.numbers import format_currency
     return format_currency(value, 'INR', locale='en_IN')
     
 @app.route('/expenses')
 def expenses():
-    init_csv(EXPENSES_FILE, ['date', 'amount', 'description', 'category'])
-
-    # Read expenses from CSV
-    expense_list = []
-    try:
-        with open(EXPENSES_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            expense_list = list(reader)
-    except Exception as e:
-        print(f"Error reading expenses: {e}")
-
-    return render_template('expenses.html', expenses=expense_list)
+    page = list_page(expense_store)
+    return render_template('expenses.html', expenses=page['rows'], page=page)
 
 @app.route('/add_expense', methods=['POST'])
 def add_expense():
-    init_csv(EXPENSES_FILE, ['date', 'amount', 'description', 'category'])
-
     try:
         amount_str = request.form.get('amount')
         description = request.form.get('description')
@@ -173,9 +559,14 @@ def add_expense():
 
         date = datetime.now().strftime('%Y-%m-%d')
 
-        with open(EXPENSES_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([date, amount, description, category])
+        expense_writes.add({
+            'date': date,
+            'amount': amount,
+            'description': description,
+            'category': category,
+        })
+        dashboard_cache.invalidate()
+        check_budget_alerts()
 
         print(f"Added expense: {description} - ${amount}")
     except Exception as e:
@@ -183,23 +574,13 @@ def add_expense():
 
     return redirect('/expenses')
 
-@app.route('/delete_expense/<int:index>')
-def delete_expense(index):
-    """Delete an expense at the given index"""
+@app.route('/delete_expense/<int:expense_id>')
+def delete_expense(expense_id):
+    """Delete the expense with the given id"""
 
-    expenses = []
     try:
-        with open(EXPENSES_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            expenses = list(reader)
-
-        if 0 <= index < len(expenses):
-            del expenses[index]
-
-        with open(EXPENSES_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['date', 'amount', 'description', 'category'])
-            writer.writeheader()
-            writer.writerows(expenses)
+        expense_store.delete(expense_id)
+        dashboard_cache.invalidate()
     except Exception as e:
         print(f"Error deleting expense: {e}")
 
@@ -207,32 +588,34 @@ def delete_expense(index):
 
 @app.route('/income')
 def income():
-    init_csv(INCOME_FILE, ['date', 'amount', 'source', 'category'])
-
-    # Read income from CSV
-    income_list = []
-    try:
-        with open(INCOME_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            income_list = list(reader)
-    except Exception as e:
-        print(f"Error reading income: {e}")
-
-    return render_template('income.html', incomes=income_list)
+    page = list_page(income_store)
+    return render_template('income.html', incomes=page['rows'], page=page)
 
 @app.route('/add_income', methods=['POST'])
 def add_income():
-    init_csv(INCOME_FILE, ['date', 'amount', 'source', 'category'])
-
     try:
-        amount = request.form.get('amount')
+        amount_str = request.form.get('amount')
         source = request.form.get('source')
         category = request.form.get('category')
+
+        try:
+            amount = float(amount_str)
+            if amount <= 0:
+                print("Error: Amount must be positive")
+                return redirect('/income')
+        except (ValueError, TypeError):
+            print(f"Error: Invalid amount '{amount_str}'")
+            return redirect('/income')
+
         date = datetime.now().strftime('%Y-%m-%d')
 
-        with open(INCOME_FILE, 'a', newline='') as f:
-            writer = csv.writer(f)
-            writer.writerow([date, amount, source, category])
+        income_writes.add({
+            'date': date,
+            'amount': amount,
+            'source': source,
+            'category': category,
+        })
+        dashboard_cache.invalidate()
 
         print(f"Added income: {source} - ${amount}")
     except Exception as e:
@@ -240,63 +623,60 @@ def add_income():
 
     return redirect('/income')
 
-@app.route("/delete_income/<int:index>")
-def delete_income(index):
-    incomes = []
-
+@app.route("/delete_income/<int:income_id>")
+def delete_income(income_id):
     try:
-        with open(INCOME_FILE, "r") as f:
-            reader = csv.DictReader(f)
-            incomes = list(reader)
-
-        if 0 <= index < len(incomes):
-            del incomes[index]
-
-        with open(INCOME_FILE, "w", newline="") as f:
-            writer = csv.DictWriter(f, fieldnames=['date', 'amount', 'source', 'category'])
-            writer.writeheader()
-            writer.writerows(incomes)
+        income_store.delete(income_id)
+        dashboard_cache.invalidate()
     except Exception as e:
         print(f"Error deleting income: {e}")
 
     return redirect('/income')
 
-def get_category_breakdown():
-    """Get spending breakdown by category"""
-    category_totals = {}
+@app.route('/import', methods=['POST'])
+def import_statement():
+    """Bulk-import an uploaded statement CSV into expenses or income"""
+    kind = request.form.get('kind')
+    if kind == 'income':
+        store, target = income_store, '/income'
+    else:
+        store, target = expense_store, '/expenses'
 
-    if os.path.exists(EXPENSES_FILE):
-        try:
-            with open(EXPENSES_FILE, 'r') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    category = row['category']
-                    amount = float(row['amount'])
+    upload = request.files.get('file')
+    if not upload or not upload.filename:
+        print("Error: No file uploaded")
+        return redirect(target)
 
-                    if category in category_totals:
-                        category_totals[category] += amount
-                    else:
-                        category_totals[category] = amount
-        except:
-            pass
+    try:
+        # Streamed from the upload in batches, never read whole into memory
+        text = io.TextIOWrapper(upload.stream, encoding='utf-8-sig', newline='')
+        result = import_csv(store, text)
+        for error in result.errors:
+            print(f"Error importing {upload.filename}, {error}")
+        print(f"{upload.filename}: {result.summary()}")
+    except Exception as e:
+        print(f"Error importing {upload.filename}: {e}")
+    dashboard_cache.invalidate()
+    if kind != 'income':
+        check_budget_alerts()
 
-    return category_totals
+    return redirect(target)
 
-@app.route('/edit_expense/<int:index>', methods=['GET', 'POST'])
-def edit_expense(index):
-    expenses = []
+@metrics.timed()
+def get_category_breakdown():
+    """Get spending breakdown by category"""
+    return expense_store.category_totals()
 
+@app.route('/edit_expense/<int:expense_id>', methods=['GET', 'POST'])
+def edit_expense(expense_id):
     try:
-        with open(EXPENSES_FILE, 'r') as f:
-            reader = csv.DictReader(f)
-            expenses = list(reader)
+        expense = expense_store.get(expense_id)
 
-        if index < 0 or index >= len(expenses):
+        if expense is None:
             return redirect('/expenses')
 
         if request.method == 'GET':
-            expense = expenses[index]
-            return render_template('edit_expense.html', expense=expense, index=index)
+            return render_template('edit_expense.html', expense=expense)
 
         else:  # POST
             new_amount = request.form.get('amount')
@@ -304,14 +684,13 @@ def edit_expense(index):
             new_category = request.form.get('category')
 
             # Update specific fields only
-            expenses[index]['amount'] = new_amount
-            expenses[index]['description'] = new_description
-            expenses[index]['category'] = new_category
-
-            with open(EXPENSES_FILE, 'w', newline='') as f:
-                writer = csv.DictWriter(f, fieldnames=['date', 'amount', 'description', 'category'])
-                writer.writeheader()
-                writer.writerows(expenses)
+            expense_store.update(expense_id, {
+                'amount': new_amount,
+                'description': new_description,
+                'category': new_category,
+            })
+            dashboard_cache.invalidate()
+            check_budget_alerts()
 
             return redirect('/expenses')
     except Exception as e:
@@ -319,106 +698,55 @@ def edit_expense(index):
         return redirect('/expenses')
 
 
+@metrics.timed()
 def get_budgets():
     """Read budget limits from CSV"""
     budgets = {}
 
-    if os.path.exists(BUDGETS_FILE):
-        try:
-            with open(BUDGETS_FILE, "r") as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    category = row['category']
-                    budget = float(row['budget'])
-                    budgets[category] = budget
-        except Exception as e:
-            print(f"Error reading budgets: {e}")
+    try:
+        for row in budget_store.rows():
+            category = row['category']
+            budget = float(row['budget'])
+            budgets[category] = budget
+    except Exception as e:
+        print(f"Error reading budgets: {e}")
 
     return budgets
 
+@metrics.timed()
 def get_expenses():
     """Get all expenses as list of dictionaries"""
-    expenses = []
-    if os.path.exists(EXPENSES_FILE):
-        try:
-            with open(EXPENSES_FILE, 'r') as f:
-                reader = csv.DictReader(f)
-                expenses = list(reader)
-        except Exception as e:
-            print(f"Error reading expenses: {e}")
-    return expenses
+    return expense_store.rows()
 
 
+@metrics.timed()
 def get_income():
     """Get all income as list of dictionaries"""
-    incomes = []
-    if os.path.exists(INCOME_FILE):
-        try:
-            with open(INCOME_FILE, 'r') as f:
-                reader = csv.DictReader(f)
-                incomes = list(reader)
-        except Exception as e:
-            print(f"Error reading income: {e}")
-    return incomes
+    return income_store.rows()
 
+@metrics.timed()
 def get_monthly_spending():
     """
     Calculate total spending per month
     Returns: dictionary like {'2024-12': 500.0, '2024-11': 450.0}
     """
-    monthly_totals = {}
-
-    if os.path.exists(EXPENSES_FILE):
-        with open(EXPENSES_FILE, "r") as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                date = row['date']
-                month = date[:7]
-                amount = float(row['amount'])
-
-                if month in monthly_totals:
-                    monthly_totals[month] += amount
-                else:
-                    monthly_totals[month] = amount
-
-    return monthly_totals
+    return expense_store.monthly_totals()
 
+@metrics.timed()
 def filter_expenses_by_date(start_date=None, end_date=None):
     """
     Filter expenses by date range
     """
-    expenses = get_expenses()
-
-    if not start_date and not end_date:
-        return expenses
+    return expense_store.table().between(start_date, end_date).rows()
 
-    filtered = []
-    for expense in expenses:
-        expense_date = expense['date']
-
-        # Case 1: Both dates provided
-        if start_date and end_date:
-            if expense_date >= start_date and expense_date <= end_date:
-                filtered.append(expense)  # Fix this
-
-        # Case 2: Only start_date provided (show all AFTER this date)
-        elif start_date:
-            if expense_date >= start_date:
-                filtered.append(expense)  # Add this
-
-        # Case 3: Only end_date provided (show all BEFORE this date)
-        elif end_date:
-            if expense_date <= end_date:
-                filtered.append(expense)  # Add this
-
-    return filtered
-
-def predict_next_month_spending():
+@metrics.timed()
+def predict_next_month_spending(monthly_data=None):
     """
     Predict next month's spending based on historical average
     Returns: predicted amount (float)
     """
-    monthly_data = get_monthly_spending()
+    if monthly_data is None:
+        monthly_data = get_monthly_spending()
 
     if not monthly_data:
         return 0
@@ -429,40 +757,22 @@ def predict_next_month_spending():
 
     return average
 
-def predict_next_month_ml():
+@metrics.timed()
+def predict_next_month_ml(monthly_data=None, version=None):
     """
-    Use Linear Regression to predict next month's spending
+    Use a least-squares trend line to predict next month's spending
     Returns: predicted amount (float)
     """
-    monthly_data = get_monthly_spending()
+    if monthly_data is None:
+        monthly_data = get_monthly_spending()
 
     # Need at least 2 months for ML
     if len(monthly_data) < 2:
         # Fallback to simple average
-        return predict_next_month_spending()
-
-    # Prepare data for ML
-    months = sorted(monthly_data.keys())
+        return predict_next_month_spending(monthly_data)
 
-    # X = month numbers (0, 1, 2, ...)
-    X = []
-    for i in range(len(months)):
-        X.append([i])
-
-    # y = spending amounts
-    y = []
-    for month in months:
-        y.append(monthly_data[month])
-
-    # Create and train the model
-    model = LinearRegression()
-    model.fit(X, y)
-
-    # Predict next month
-    next_month_number = [[len(months)]]
-    prediction = model.predict(next_month_number)
-
-    return prediction[0]
+    # Fitted incrementally and cached until the ledger version changes
+    return spending_trend.predict(monthly_data, version)
 
 
 @app.route('/test_prediction')
@@ -478,51 +788,33 @@ def test_monthly():
 def save_budgets(budgets):
     """Save budget limits to CSV"""
     try:
-        with open(BUDGETS_FILE, 'w', newline='') as f:
-            writer = csv.DictWriter(f, fieldnames=['category', 'budget'])
-            writer.writeheader()
-
-            for category, budget in budgets.items():
-                writer.writerow({'category': category, 'budget': budget})
+        budget_store.replace([
+            {'category': category, 'budget': budget}
+            for category, budget in budgets.items()
+        ])
+        dashboard_cache.invalidate()
     except Exception as e:
         print(f"Error saving budgets: {e}")
 
 
+@metrics.timed()
 def get_budget_status():
-    """Calculate spending vs budget for each category"""
-    budgets = get_budgets()
-    spending = get_category_breakdown()
-
-    status = {}
-    for category in budgets:
-        budget_limit = budgets[category]
-        spent = spending.get(category, 0)
-
-        percentage = (spent / budget_limit * 100) if budget_limit > 0 else 0
-        is_over = spent > budget_limit
-
-        if percentage < 70:
-            color = 'green'
-        elif percentage < 100:
-            color = 'yellow'
-        else:
-            color = 'red'
-
-        status[category] = {
-            'budget': budget_limit,
-            'spent': spent,
-            'remaining': budget_limit - spent,
-            'percentage': percentage,
-            'color': color,
-            'is_over': is_over
-        }
-
-    return status
+    """Calculate this month's spending vs budget for each category"""
+    return budget_engine.status(get_budgets(), expense_store.table())
+
+@metrics.timed()
+def check_budget_alerts():
+    """Record an alert for each budget first reaching 70% or 100% this month"""
+    try:
+        budget_engine.check(get_budgets(), expense_store.table())
+    except Exception as e:
+        print(f"Error checking budgets: {e}")
 
 @app.route('/budgets')
 def budgets():
     budget_status = get_budget_status()
-    return render_template('budgets.html', budget_status=budget_status)
+    return render_template('budgets.html', budget_status=budget_status,
+                           alerts=budget_engine.alerts())
 
 
 @app.route('/set_budget', methods=['POST'])
@@ -535,6 +827,7 @@ def set_budget():
 
         budgets[category] = budget
         save_budgets(budgets)
+        check_budget_alerts()
 
         print(f"Set budget: {category} = ${budget}")
     except Exception as e:
@@ -555,82 +848,86 @@ def delete_budget(category):
 
     return redirect('/budgets')
 
+EXPORT_CHUNK_ROWS = 1000
+
+
+def export_sections(sections, start_date=None, end_date=None, category=None):
+    """
+    Yield CSV text for each (title, store) section, EXPORT_CHUNK_ROWS rows
+    at a time, so memory use doesn't depend on the size of the ledger.
+    start_date, end_date and category limit which rows are written.
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator='\n')
+    for i, (title, store) in enumerate(sections):
+        if title:
+            buffer.write(('\n' if i else '') + f'=== {title} ===\n')
+        table = store.table()
+        writer.writerow(store.headers)
+        rows = table.iter_rows(table.select(start_date, end_date, category))
+        for n, row in enumerate(rows, 1):
+            writer.writerow([row[h] for h in store.headers])
+            if n % EXPORT_CHUNK_ROWS == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+    yield buffer.getvalue()
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of text chunks"""
+    compressor = zlib.compressobj(wbits=31)  # 31 = gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode())
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_response(sections, filename):
+    """
+    Stream sections as a CSV download (?gzip=1 for a .csv.gz file),
+    filtered by the optional start_date, end_date and category parameters
+    """
+    start_date = request.args.get('start_date')
+    end_date = request.args.get('end_date')
+    # Checked before streaming starts: a bad date would otherwise export
+    # just the headers with a 200
+    if not valid_date(start_date) or not valid_date(end_date):
+        abort(400, 'start_date and end_date must be YYYY-MM-DD')
+    chunks = export_sections(
+        sections, start_date, end_date, request.args.get('category')
+    )
+    mimetype = 'text/csv'
+    if request.args.get('gzip') == '1':
+        chunks = gzip_chunks(chunks)
+        mimetype = 'application/gzip'
+        filename += '.gz'
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'},
+    )
+
+
 @app.route('/export/expenses')
 def export_expenses():
     """Export expenses as CSV"""
-    expenses = get_expenses()
-
-    output = io.StringIO()
-    if expenses:
-        headers = expenses[0].keys()
-        output.write(','.join(headers) + '\n')
-
-        for expense in expenses:
-            row = ','.join(str(expense[h]) for h in headers)
-            output.write(row + '\n')
-
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='expenses.csv'
-    )
+    return export_response([(None, expense_store)], 'expenses.csv')
 
 
 @app.route('/export/income')
 def export_income():
     """Export income as CSV"""
-    incomes = get_income()
-
-    output = io.StringIO()
-    if incomes:
-        headers = incomes[0].keys()
-        output.write(','.join(headers) + '\n')
-
-        for income in incomes:
-            row = ','.join(str(income[h]) for h in headers)
-            output.write(row + '\n')
-
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='income.csv'
-    )
+    return export_response([(None, income_store)], 'income.csv')
 
 
 @app.route('/export/all')
 def export_all():
     """Export combined financial summary"""
-    expenses = get_expenses()
-    incomes = get_income()
-
-    output = io.StringIO()
-
-    output.write('=== EXPENSES ===\n')
-    if expenses:
-        headers = expenses[0].keys()
-        output.write(','.join(headers) + '\n')
-        for expense in expenses:
-            row = ','.join(str(expense[h]) for h in headers)
-            output.write(row + '\n')
-
-    output.write('\n=== INCOME ===\n')
-    if incomes:
-        headers = incomes[0].keys()
-        output.write(','.join(headers) + '\n')
-        for income in incomes:
-            row = ','.join(str(income[h]) for h in headers)
-            output.write(row + '\n')
-
-    output.seek(0)
-    return send_file(
-        io.BytesIO(output.getvalue().encode()),
-        mimetype='text/csv',
-        as_attachment=True,
-        download_name='financial_report.csv'
+    return export_response(
+        [('EXPENSES', expense_store), ('INCOME', income_store)],
+        'financial_report.csv'
     )
 
 @app.route('/test_ml')
@@ -648,7 +945,8 @@ def test_ml():
     <p><strong>ML Prediction (Linear Regression):</strong> ${prediction:.2f}</p>
     <p><strong>Difference:</strong> ${abs(prediction - simple):.2f}</p>
     <hr>
-    <p><em>The ML model detects trends - if spending is increasing, it predicts higher than average!</em></p>
+    <p><em>The ML model detects trends - if spending is increasing,
+    it predicts higher than average!</em></p>
     """
 
 @app.route('/test_filter')
@@ -661,6 +959,9 @@ def test_filter():
 
     # Test 3: From November onwards
     from_nov = filter_expenses_by_date('2025-11-01', None)
+    december_items = ''.join(
+        f"<li>{e['date']} - {e['description']} - ${e['amount']}</li>" for e in december
+    )
 
     return f"""
     <h2>Date Filter Test:</h2>
@@ -670,7 +971,7 @@ def test_filter():
     <hr>
     <h3>December Expenses:</h3>
     <ul>
-    {''.join(f"<li>{e['date']} - {e['description']} - ${e['amount']}</li>" for e in december)}
+    {december_items}
     </ul>
     """
 
@@ -0,0 +1,248 @@
+"""
+Per-request timing spans, counters, Server-Timing and Prometheus metrics.
+
+Work worth measuring is wrapped in a span, either as a block or by
+decorating the function:
+
+    with metrics.span('csv_parse'):
+        ...
+
+    @metrics.timed('budget_status')
+    def get_budget_status(): ...
+
+and storage counts what it reads with count('file_reads') and
+count('rows_parsed', n). During a request the span durations and counts
+are collected for that request and returned in a Server-Timing header
+(shown in the browser's network panel); outside a request (the importer,
+background compaction) only the process-wide totals are updated.
+
+init_app(app) installs the request hooks and GET /metrics, which serves
+the process-wide totals in the Prometheus text format: a latency histogram
+and a request counter per route, method and status, the time spent in
+each span and the counters. Every gunicorn worker keeps its own totals.
+
+Profiling is opt-in: with PROFILE_SLOW_MS set, requests run under cProfile
+(a PROFILE_SAMPLE_RATE fraction of them, default all) and every one that
+took longer than PROFILE_SLOW_MS is written to PROFILE_DIR (default
+profiles/) as a .prof file for python -m pstats or snakeviz.
+"""
+import contextvars
+import functools
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Upper bounds (seconds) of the request latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS') or 0)
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE') or 1.0)
+PROFILE_DIR = os.environ.get('PROFILE_DIR', 'profiles')
+
+_current = contextvars.ContextVar('request_metrics', default=None)
+
+_lock = threading.Lock()
+_latency = {}    # (route, method) -> [bucket counts..., +Inf count, sum]
+_requests = {}   # (route, method, status) -> count
+_spans = {}      # name -> [seconds, count]
+_counters = {}   # name -> value
+
+
+class RequestMetrics:
+    """Spans and counters of one request"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.counters = {}
+        self.profiler = None
+        self._render_started = []
+
+    def server_timing(self, total):
+        """Server-Timing header value: durations in ms, counters as descriptions"""
+        parts = [
+            f'{name};dur={seconds * 1000:.1f}' for name, seconds in self.spans.items()
+        ]
+        parts += [f'{name};desc="{value}"' for name, value in self.counters.items()]
+        parts.append(f'total;dur={total * 1000:.1f}')
+        return ', '.join(parts)
+
+
+def _record_span(name, seconds):
+    state = _current.get()
+    if state is not None:
+        state.spans[name] = state.spans.get(name, 0.0) + seconds
+    with _lock:
+        totals = _spans.setdefault(name, [0.0, 0])
+        totals[0] += seconds
+        totals[1] += 1
+
+
+@contextmanager
+def span(name):
+    """Time the block as span name"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record_span(name, time.perf_counter() - start)
+
+
+def timed(name=None):
+    """Decorator: time every call of the function as a span (default: its name)"""
+    def decorator(func):
+        span_name = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Add n to counter name (for this request and the process)"""
+    state = _current.get()
+    if state is not None:
+        state.counters[name] = state.counters.get(name, 0) + n
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def observe_request(route, method, status, seconds):
+    """Record one request's latency in its route's histogram"""
+    with _lock:
+        buckets = _latency.get((route, method))
+        if buckets is None:
+            # A count per bound, the +Inf count, and the sum
+            buckets = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+            _latency[(route, method)] = buckets
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                buckets[i] += 1
+        buckets[len(LATENCY_BUCKETS)] += 1
+        buckets[-1] += seconds
+        key = (route, method, status)
+        _requests[key] = _requests.get(key, 0) + 1
+
+
+def _labels(**labels):
+    text = ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return '{' + text + '}'
+
+
+def prometheus_text():
+    """The process-wide totals in the Prometheus text exposition format"""
+    with _lock:
+        latency = {key: list(value) for key, value in _latency.items()}
+        requests = dict(_requests)
+        spans = {key: list(value) for key, value in _spans.items()}
+        counters = dict(_counters)
+
+    lines = [
+        '# HELP finance_request_duration_seconds Request latency by route.',
+        '# TYPE finance_request_duration_seconds histogram',
+    ]
+    for (route, method), buckets in sorted(latency.items()):
+        for bound, n in zip(LATENCY_BUCKETS + ('+Inf',), buckets[:-1], strict=True):
+            labels = _labels(route=route, method=method, le=bound)
+            lines.append(f'finance_request_duration_seconds_bucket{labels} {n}')
+        labels = _labels(route=route, method=method)
+        lines.append(f'finance_request_duration_seconds_sum{labels} {buckets[-1]:.6f}')
+        lines.append(f'finance_request_duration_seconds_count{labels} {buckets[-2]}')
+
+    lines += [
+        '# HELP finance_requests_total Requests by route and status.',
+        '# TYPE finance_requests_total counter',
+    ]
+    for (route, method, status), n in sorted(requests.items()):
+        labels = _labels(route=route, method=method, status=status)
+        lines.append(f'finance_requests_total{labels} {n}')
+
+    lines += [
+        '# HELP finance_span_seconds Time spent in instrumented code.',
+        '# TYPE finance_span_seconds summary',
+    ]
+    for name, (seconds, n) in sorted(spans.items()):
+        lines.append(f'finance_span_seconds_sum{_labels(span=name)} {seconds:.6f}')
+        lines.append(f'finance_span_seconds_count{_labels(span=name)} {n}')
+
+    for name, value in sorted(counters.items()):
+        lines.append(f'# TYPE finance_{name}_total counter')
+        lines.append(f'finance_{name}_total {value}')
+    return '\n'.join(lines) + '\n'
+
+
+def _dump_profile(profiler, endpoint, elapsed):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    milliseconds = elapsed * 1000
+    started = time.strftime('%Y%m%d-%H%M%S')
+    filename = os.path.join(
+        PROFILE_DIR, f"{started}-{endpoint or 'unmatched'}-{milliseconds:.0f}ms.prof"
+    )
+    profiler.dump_stats(filename)
+    print(f"Slow request: {endpoint} took {milliseconds:.0f}ms, profile in {filename}")
+
+
+def init_app(app):
+    """Collect metrics for every request of app and serve them at /metrics"""
+    from flask import Response, before_render_template, request, template_rendered
+
+    @app.before_request
+    def start_request_metrics():
+        state = RequestMetrics()
+        _current.set(state)
+        if PROFILE_SLOW_MS and random.random() < PROFILE_SAMPLE_RATE:
+            import cProfile
+            state.profiler = cProfile.Profile()
+            state.profiler.enable()
+
+    @app.after_request
+    def finish_request_metrics(response):
+        state = _current.get()
+        if state is None:
+            return response
+        elapsed = time.perf_counter() - state.started
+        if state.profiler is not None:
+            state.profiler.disable()
+            if elapsed * 1000 >= PROFILE_SLOW_MS:
+                try:
+                    _dump_profile(state.profiler, request.endpoint, elapsed)
+                except Exception as e:
+                    print(f"Error writing profile: {e}")
+            state.profiler = None
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+        observe_request(route, request.method, response.status_code, elapsed)
+        response.headers['Server-Timing'] = state.server_timing(elapsed)
+        return response
+
+    @app.teardown_request
+    def clear_request_metrics(_exc=None):
+        state = _current.get()
+        if state is not None and state.profiler is not None:
+            state.profiler.disable()
+        _current.set(None)
+
+    # Jinja rendering as the 'render' span (template and context arrive as keywords)
+    def template_started(_sender, **_extra):
+        state = _current.get()
+        if state is not None:
+            state._render_started.append(time.perf_counter())
+
+    def template_finished(_sender, **_extra):
+        state = _current.get()
+        if state is not None and state._render_started:
+            _record_span('render', time.perf_counter() - state._render_started.pop())
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(prometheus_text(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,302 @@
+"""
+Parallel parsing and aggregation of a large ledger CSV file.
+
+The file is split into byte ranges that end on line boundaries and each
+range is parsed in a ProcessPoolExecutor worker. load() returns the whole
+LedgerTable: the columns are concatenated in file order and the workers'
+monthly rollups (sums and counts per month and category) are merged, so
+the table starts out with its rollup built. LedgerStore loads snapshots
+of PARALLEL_MIN_BYTES or more this way. aggregate() returns only the
+merged rollup, so descriptions never leave the workers.
+
+A quoted field may contain newlines, so a range boundary can fall inside
+a record. Before any parsing the quote characters in each range are
+counted: a range starts on a record boundary exactly when an even number
+of quotes comes before it (quotes inside a quoted field are doubled).
+When one doesn't, the file is parsed serially in one piece instead.
+
+    python parallel.py expenses.csv [--workers 8]
+"""
+import argparse
+import csv
+import io
+import itertools
+import multiprocessing
+import os
+import time
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from ledger import LedgerTable, MonthlyRollup, parse_amounts, parse_dates
+
+MIN_CHUNK_BYTES = 1024 * 1024
+
+# One range's rows: columns with codes into categories, and their rollup
+Chunk = namedtuple('Chunk', 'ids dates amounts codes categories texts rollup bad_ids')
+
+
+def chunk_ranges(filename, chunks):
+    """
+    (header, [(start, end), ...]) byte ranges covering the rows of filename,
+    each ending just after a newline (which may be inside a quoted field,
+    see aligned())
+    """
+    size = os.path.getsize(filename)
+    with open(filename, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        step = max(MIN_CHUNK_BYTES, (size - start) // max(chunks, 1) + 1)
+        ranges = []
+        while start < size:
+            f.seek(min(start + step, size))
+            f.readline()  # Move to the end of the line we landed in
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return header.decode('utf-8-sig'), ranges
+
+
+def quote_counts(filename, ranges):
+    """The number of quote characters in each byte range of filename"""
+    counts = []
+    with open(filename, 'rb') as f:
+        for start, end in ranges:
+            f.seek(start)
+            count, left = 0, end - start
+            while left > 0:
+                block = f.read(min(left, MIN_CHUNK_BYTES))
+                if not block:
+                    break
+                count += block.count(b'"')
+                left -= len(block)
+            counts.append(count)
+    return counts
+
+
+def aligned(quote_counts):
+    """True if every range after the first starts outside a quoted field"""
+    seen = 0
+    for count in quote_counts[:-1]:
+        seen += count
+        if seen % 2:
+            return False
+    return True
+
+
+def _read_range(filename, start, end):
+    with open(filename, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def _parse_range(filename, start, end, columns):
+    """Worker: the Chunk for one byte range, None if it doesn't parse"""
+    data = _read_range(filename, start, end)
+    id_col, date_col, amount_col, text_col, category_col = columns
+    ids, dates, amounts, codes, texts = [], [], [], [], []
+    category_codes = {}
+    bad_ids = 0
+    try:
+        for row in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+            if not row:
+                continue
+            n = len(row)
+            if id_col is not None:
+                try:
+                    ids.append(int(row[id_col]))
+                except (IndexError, ValueError):
+                    bad_ids += 1
+                    continue
+            dates.append(row[date_col] if date_col < n else '')
+            amounts.append(row[amount_col] if amount_col < n else '')
+            texts.append(row[text_col] if text_col < n else '')
+            category = row[category_col] if category_col < n else ''
+            codes.append(category_codes.setdefault(category, len(category_codes)))
+    except (csv.Error, UnicodeDecodeError):
+        return None
+    dates, amounts = parse_dates(dates), parse_amounts(amounts)
+    codes = np.array(codes, dtype=np.int32)
+    rollup = MonthlyRollup.build(dates, codes, amounts, len(category_codes))
+    chunk = Chunk(
+        np.array(ids, dtype=np.int64) if id_col is not None else None,
+        dates, amounts, codes, list(category_codes), texts, rollup, bad_ids,
+    )
+    return chunk
+
+
+def _aggregate_range(filename, start, end, columns):
+    """
+    Worker: (category names, MonthlyRollup) for one byte range, None if it
+    doesn't parse
+    """
+    data = _read_range(filename, start, end)
+    date_col, amount_col, category_col = columns
+    dates, amounts, codes = [], [], []
+    category_codes = {}
+    try:
+        for row in csv.reader(io.StringIO(data.decode('utf-8'), newline='')):
+            if not row:
+                continue
+            n = len(row)
+            dates.append(row[date_col] if date_col < n else '')
+            amounts.append(row[amount_col] if amount_col < n else '')
+            category = row[category_col] if category_col < n else ''
+            codes.append(category_codes.setdefault(category, len(category_codes)))
+    except (csv.Error, UnicodeDecodeError):
+        return None
+    rollup = MonthlyRollup.build(
+        parse_dates(dates), np.array(codes, dtype=np.int32), parse_amounts(amounts),
+        len(category_codes),
+    )
+    return list(category_codes), rollup
+
+
+def _run(function, filename, ranges, columns, workers):
+    """
+    [result] of function over the ranges, in a process pool when there is
+    more than one; over the whole file in one piece when a range doesn't
+    start on a record boundary
+    """
+    if len(ranges) > 1 and not aligned(quote_counts(filename, ranges)):
+        ranges = [(ranges[0][0], ranges[-1][1])]
+    if len(ranges) <= 1 or workers == 1:
+        return [function(filename, start, end, columns) for start, end in ranges]
+    # forkserver: forking a threaded gunicorn worker could deadlock
+    context = multiprocessing.get_context('forkserver')
+    with ProcessPoolExecutor(min(workers, len(ranges)), mp_context=context) as pool:
+        futures = [
+            pool.submit(function, filename, start, end, columns)
+            for start, end in ranges
+        ]
+        return [future.result() for future in futures]
+
+
+def merge_rollups(parts):
+    """One (categories, MonthlyRollup) from per-chunk (categories, rollup) parts"""
+    categories, codes = [], {}
+    for names, _ in parts:
+        for name in names:
+            if name not in codes:
+                codes[name] = len(categories)
+                categories.append(name)
+    width = len(categories)
+    merged = MonthlyRollup(width)
+
+    spans = [
+        (rollup.first_month, rollup.first_month + rollup.sums.shape[0])
+        for _, rollup in parts if rollup.first_month is not None
+    ]
+    if spans:
+        merged.first_month = min(first for first, _ in spans)
+        height = max(last for _, last in spans) - merged.first_month
+        merged.sums = np.zeros((height, width))
+        merged.counts = np.zeros((height, width), dtype=np.int64)
+
+    for names, rollup in parts:
+        columns = np.array([codes[name] for name in names], dtype=np.int64)
+        if not len(columns):
+            continue
+        merged.undated_sums[columns] += rollup.undated_sums
+        merged.undated_counts[columns] += rollup.undated_counts
+        if rollup.first_month is not None:
+            row = rollup.first_month - merged.first_month
+            rows = slice(row, row + rollup.sums.shape[0])
+            merged.sums[rows, columns] += rollup.sums
+            merged.counts[rows, columns] += rollup.counts
+    return categories, merged
+
+
+def load(filename, text_field, workers=None):
+    """
+    (LedgerTable, has_ids) for a ledger CSV file parsed by up to workers
+    processes (default: one per core), like LedgerStore's serial parse;
+    None if the file has no usable header or doesn't parse
+    """
+    workers = workers or os.cpu_count() or 1
+    header, ranges = chunk_ranges(filename, workers)
+    names = next(csv.reader([header]), [])
+    try:
+        columns = (names.index('id') if 'id' in names else None,) + tuple(
+            names.index(name) for name in ('date', 'amount', text_field, 'category')
+        )
+    except ValueError:
+        return None
+    chunks = _run(_parse_range, filename, ranges, columns, workers)
+    if None in chunks:
+        return None
+
+    bad_ids = sum(chunk.bad_ids for chunk in chunks)
+    if bad_ids:
+        print(f"Skipped {bad_ids} rows of {filename} with a bad id")
+    categories, rollup = merge_rollups(
+        [(chunk.categories, chunk.rollup) for chunk in chunks]
+    )
+    index = {name: code for code, name in enumerate(categories)}
+    # Each chunk's own category codes, mapped to the merged ones
+    codes = []
+    for chunk in chunks:
+        mapping = np.array([index[name] for name in chunk.categories], dtype=np.int32)
+        codes.append(mapping[chunk.codes])
+    dates = [chunk.dates for chunk in chunks]
+    amounts = [chunk.amounts for chunk in chunks]
+    count = sum(len(chunk.dates) for chunk in chunks)
+    has_ids = columns[0] is not None
+    if has_ids:
+        ids = np.concatenate(
+            [chunk.ids for chunk in chunks] or [np.empty(0, dtype=np.int64)]
+        )
+    else:
+        ids = np.arange(1, count + 1, dtype=np.int64)
+    table = LedgerTable.from_columns(
+        text_field,
+        ids,
+        np.concatenate(dates or [np.empty(0, dtype='datetime64[D]')]),
+        np.concatenate(amounts or [np.empty(0)]),
+        np.concatenate(codes or [np.empty(0, dtype=np.int32)]),
+        list(itertools.chain.from_iterable(chunk.texts for chunk in chunks)),
+        categories,
+        rollup,
+    )
+    return table, has_ids or not count
+
+
+def aggregate(filename, workers=None):
+    """
+    (categories, MonthlyRollup) for every row of a ledger CSV file, parsed
+    in parallel by up to workers processes (default: one per core)
+    """
+    workers = workers or os.cpu_count() or 1
+    header, ranges = chunk_ranges(filename, workers)
+    names = next(csv.reader([header]))
+    columns = tuple(names.index(name) for name in ('date', 'amount', 'category'))
+    parts = _run(_aggregate_range, filename, ranges, columns, workers)
+    if None in parts:
+        raise ValueError(f"Can't parse {filename}")
+    return merge_rollups(parts)
+
+
+def category_totals(categories, rollup):
+    """{category: total} for every category that has at least one row"""
+    width = len(categories)
+    counts, sums = rollup.category_counts(width), rollup.category_sums(width)
+    return {categories[code]: float(sums[code]) for code in np.flatnonzero(counts)}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Aggregate a ledger CSV file in parallel'
+    )
+    parser.add_argument('filename')
+    parser.add_argument('--workers', type=int, help='processes (default: one per core)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    categories, rollup = aggregate(args.filename, args.workers)
+    elapsed = time.perf_counter() - started
+    totals = category_totals(categories, rollup)
+    for category, total in sorted(totals.items(), key=lambda item: -item[1]):
+        print(f"{category or '(none)':20} {total:16,.2f}")
+    print(f"{'Total':20} {sum(totals.values()):16,.2f}")
+    print(f"{len(rollup.monthly_totals())} months, {elapsed:.2f}s")
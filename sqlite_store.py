@@ -0,0 +1,402 @@
+"""
+SQLite backend for the ledger stores.
+
+Enable it with LEDGER_BACKEND=sqlite (and optionally LEDGER_DB=path). The
+database runs in WAL mode so readers in every gunicorn worker proceed
+while one worker writes, and expenses/income are indexed on (date) and
+(category, date). Each worker thread keeps its own pooled connection.
+
+Import the existing CSV files once with:
+
+    python sqlite_store.py finance.db
+"""
+import os
+import sqlite3
+import sys
+import threading
+
+import metrics
+from ledger import LedgerTable, parse_amount
+from storage import BaseLedgerStore
+
+_local = threading.local()
+
+# database -> times close_connections() was called for it. Each pooled
+# connection remembers the count it was opened at, and a thread closes
+# its outdated ones itself (sqlite3 connections belong to one thread).
+_closes = {}
+_closes_lock = threading.Lock()
+
+
+def _pool():
+    pool = getattr(_local, 'connections', None)
+    if pool is None or getattr(_local, 'pid', None) != os.getpid():
+        # Connections must not be shared with a forked child
+        pool = _local.connections = {}
+        _local.pid = os.getpid()
+    return pool
+
+
+def _prune(pool):
+    for database, (conn, closes) in list(pool.items()):
+        # Never in the middle of this thread's own transaction
+        if closes != _closes.get(database, 0) and not conn.in_transaction:
+            conn.close()
+            del pool[database]
+
+
+def connect(database):
+    """Pooled connection for this thread (and process) to database"""
+    pool = _pool()
+    _prune(pool)
+    entry = pool.get(database)
+    if entry is None:
+        conn = sqlite3.connect(database, timeout=30, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        init_schema(conn)
+        entry = pool[database] = (conn, _closes.get(database, 0))
+    return entry[0]
+
+
+def close_connections(database):
+    """
+    Close the pooled connections to database: this thread's now, every
+    other thread's on its next connect()
+    """
+    with _closes_lock:
+        _closes[database] = _closes.get(database, 0) + 1
+    _prune(_pool())
+
+
+def init_schema(conn):
+    conn.executescript('''
+        CREATE TABLE IF NOT EXISTS expenses (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            description TEXT,
+            category TEXT
+        );
+        CREATE INDEX IF NOT EXISTS expenses_date ON expenses (date);
+        CREATE INDEX IF NOT EXISTS expenses_category_date ON expenses (category, date);
+
+        CREATE TABLE IF NOT EXISTS income (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            date TEXT NOT NULL,
+            amount REAL NOT NULL,
+            source TEXT,
+            category TEXT
+        );
+        CREATE INDEX IF NOT EXISTS income_date ON income (date);
+        CREATE INDEX IF NOT EXISTS income_category_date ON income (category, date);
+
+        CREATE TABLE IF NOT EXISTS budgets (
+            category TEXT PRIMARY KEY,
+            budget REAL NOT NULL
+        );
+
+        -- Bumped in the same transaction as every write, so a worker can
+        -- tell with one indexed lookup whether its in-memory copy is stale
+        CREATE TABLE IF NOT EXISTS versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL
+        );
+    ''')
+
+
+def _bump_version(conn, name):
+    conn.execute(
+        'INSERT INTO versions (name, version) VALUES (?, 1) '
+        'ON CONFLICT (name) DO UPDATE SET version = version + 1',
+        (name,),
+    )
+    return _read_version(conn, name)
+
+
+def _read_version(conn, name):
+    row = conn.execute(
+        'SELECT version FROM versions WHERE name = ?', (name,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def _where_dates(start_date, end_date):
+    clauses, params = [], []
+    if start_date:
+        clauses.append('date >= ?')
+        params.append(start_date)
+    if end_date:
+        clauses.append('date <= ?')
+        params.append(end_date)
+    return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+
+class SqliteLedgerStore(BaseLedgerStore):
+    """
+    Expenses or income in a SQLite table, cached in memory as a LedgerTable.
+
+    Writes run in their own transaction and are applied to the cached
+    table in place; a write from another worker bumps the table's version
+    and the cache is reloaded on the next read. Totals, category and
+    monthly breakdowns are pushed down to SQL so they never need the
+    cached table.
+    """
+
+    def __init__(self, database, name, headers):
+        # headers are [date, amount, <description|source>, category]
+        self.database = database
+        self.name = name
+        self.headers = headers
+        self.text_field = headers[2]
+        self._table = None
+        self._version = None
+        self._lock = threading.RLock()
+
+    def _conn(self):
+        return connect(self.database)
+
+    def close(self):
+        close_connections(self.database)
+
+    def table(self):
+        with self._lock:
+            version = _read_version(self._conn(), self.name)
+            if self._table is None or version != self._version:
+                self._load(version)
+            return self._table
+
+    @metrics.timed('db_load')
+    def _load(self, version):
+        cursor = self._conn().execute(
+            f'SELECT id, date, amount, {self.text_field}, category '
+            f'FROM {self.name} ORDER BY id'
+        )
+        ids, rows = [], []
+        for record_id, date, amount, text, category in cursor:
+            ids.append(record_id)
+            rows.append({
+                'date': date,
+                'amount': amount,
+                self.text_field: text,
+                'category': category,
+            })
+        self._table = LedgerTable.from_rows(rows, self.text_field, ids)
+        self._version = version
+        metrics.count('rows_parsed', len(rows))
+
+    def _write(self, sql, params):
+        """Run one write in a transaction; returns (cursor, cache_is_current)"""
+        conn = self._conn()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            before = _read_version(conn, self.name)
+            cursor = conn.execute(sql, params)
+            after = _bump_version(conn, self.name)
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        current = self._table is not None and before == self._version
+        if current:
+            self._version = after
+        return cursor, current
+
+    def add(self, row):
+        values = [row.get(h, '') for h in self.headers]
+        values[1] = parse_amount(values[1])
+        with self._lock:
+            cursor, current = self._write(
+                f'INSERT INTO {self.name} (date, amount, {self.text_field}, category) '
+                f'VALUES (?, ?, ?, ?)',
+                values,
+            )
+            record_id = cursor.lastrowid
+            if current:
+                self._table.append(*values, record_id=record_id)
+            return record_id
+
+    def add_many(self, rows):
+        """Insert a batch in one transaction"""
+        if not rows:
+            return []
+        values = [[row.get(h, '') for h in self.headers] for row in rows]
+        for row_values in values:
+            row_values[1] = parse_amount(row_values[1])
+        with self._lock:
+            conn = self._conn()
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                before = _read_version(conn, self.name)
+                # Number the rows explicitly (AUTOINCREMENT never reuses
+                # ids, so continue from sqlite_sequence) to know their ids
+                row = conn.execute(
+                    'SELECT seq FROM sqlite_sequence WHERE name = ?', (self.name,)
+                ).fetchone()
+                first_id = (row[0] if row else 0) + 1
+                ids = list(range(first_id, first_id + len(values)))
+                conn.executemany(
+                    f'INSERT INTO {self.name} '
+                    f'(id, date, amount, {self.text_field}, category) '
+                    f'VALUES (?, ?, ?, ?, ?)',
+                    [[record_id] + row_values
+                     for record_id, row_values in zip(ids, values, strict=True)],
+                )
+                after = _bump_version(conn, self.name)
+                conn.execute('COMMIT')
+            except Exception:
+                conn.execute('ROLLBACK')
+                raise
+            if self._table is not None and before == self._version:
+                self._version = after
+                self._table.extend(
+                    [dict(zip(self.headers, v, strict=True)) for v in values], ids
+                )
+            return ids
+
+    def update(self, record_id, fields):
+        fields = {k: v for k, v in fields.items() if k in self.headers}
+        if 'amount' in fields:
+            fields['amount'] = parse_amount(fields['amount'])
+        assignments = ', '.join(f'{k} = ?' for k in fields)
+        with self._lock:
+            cursor, current = self._write(
+                f'UPDATE {self.name} SET {assignments} WHERE id = ?',
+                list(fields.values()) + [record_id],
+            )
+            if cursor.rowcount == 0:
+                return False
+            if current:
+                i = self._table.position(record_id)
+                if i is not None:
+                    self._table.update(i, fields)
+            return True
+
+    def delete(self, record_id):
+        with self._lock:
+            cursor, current = self._write(
+                f'DELETE FROM {self.name} WHERE id = ?', (record_id,)
+            )
+            if cursor.rowcount == 0:
+                return False
+            if current:
+                i = self._table.position(record_id)
+                if i is not None:
+                    self._table.delete(i)
+            return True
+
+    def get(self, record_id):
+        row = self._conn().execute(
+            f'SELECT id, date, amount, {self.text_field}, category '
+            f'FROM {self.name} WHERE id = ?',
+            (record_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        return dict(zip(['id'] + self.headers, row, strict=True))
+
+    def __len__(self):
+        return self._conn().execute(f'SELECT COUNT(*) FROM {self.name}').fetchone()[0]
+
+    def total(self, start_date=None, end_date=None):
+        where, params = _where_dates(start_date, end_date)
+        row = self._conn().execute(
+            f'SELECT COALESCE(SUM(amount), 0) FROM {self.name}{where}', params
+        ).fetchone()
+        return float(row[0])
+
+    def category_totals(self, start_date=None, end_date=None):
+        where, params = _where_dates(start_date, end_date)
+        cursor = self._conn().execute(
+            f'SELECT category, SUM(amount) FROM {self.name}{where} GROUP BY category',
+            params,
+        )
+        return {category: float(total) for category, total in cursor}
+
+    def monthly_totals(self):
+        cursor = self._conn().execute(
+            f"SELECT substr(date, 1, 7) AS month, SUM(amount) FROM {self.name} "
+            f"WHERE date != '' GROUP BY month ORDER BY month"
+        )
+        return {month: float(total) for month, total in cursor}
+
+
+class SqliteBudgetStore:
+    """Budget limits in the budgets table (same interface as CsvStore)"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def close(self):
+        """Close the pooled connections to the database"""
+        close_connections(self.database)
+
+    def rows(self):
+        cursor = connect(self.database).execute(
+            'SELECT category, budget FROM budgets ORDER BY rowid'
+        )
+        return [{'category': category, 'budget': budget} for category, budget in cursor]
+
+    def replace(self, rows):
+        conn = connect(self.database)
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute('DELETE FROM budgets')
+            conn.executemany(
+                'INSERT INTO budgets (category, budget) VALUES (?, ?)',
+                [(r['category'], float(r['budget'])) for r in rows],
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+
+def import_csv(database, expenses_file='expenses.csv', income_file='income.csv',
+               budgets_file='budgets.csv'):
+    """
+    One-shot import of the CSV ledgers into an empty database.
+
+    Record ids are kept, so existing edit/delete links stay valid.
+    """
+    from storage import open_stores
+
+    expenses, income, budgets = open_stores(
+        'csv', expenses_file, income_file, budgets_file
+    )
+    conn = connect(database)
+    for name in ('expenses', 'income', 'budgets'):
+        if conn.execute(f'SELECT COUNT(*) FROM {name}').fetchone()[0]:
+            raise ValueError(f"Table '{name}' in {database} is not empty")
+
+    counts = {}
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        for name, store in (('expenses', expenses), ('income', income)):
+            rows = store.rows()
+            conn.executemany(
+                f'INSERT INTO {name} (id, date, amount, {store.text_field}, category) '
+                f'VALUES (?, ?, ?, ?, ?)',
+                [(r['id'], r['date'], r['amount'], r[store.text_field], r['category'])
+                 for r in rows],
+            )
+            _bump_version(conn, name)
+            counts[name] = len(rows)
+        budget_rows = budgets.rows()
+        conn.executemany(
+            'INSERT INTO budgets (category, budget) VALUES (?, ?)',
+            [(r['category'], float(r['budget'])) for r in budget_rows],
+        )
+        counts['budgets'] = len(budget_rows)
+        conn.execute('COMMIT')
+    except Exception:
+        conn.execute('ROLLBACK')
+        raise
+    return counts
+
+
+if __name__ == '__main__':
+    database = sys.argv[1] if len(sys.argv) > 1 else 'finance.db'
+    counts = import_csv(database)
+    for name, count in counts.items():
+        print(f"Imported {count} {name} rows into {database}")
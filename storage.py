@@ -0,0 +1,661 @@
+import csv
+import fcntl
+import io
+import mmap
+import os
+import queue
+import struct
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+import binary_ledger
+import metrics
+from ledger import LedgerTable
+
+
+def _file_stamp(filename):
+    """(inode, mtime, size) of a file, or None if it doesn't exist"""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+@contextmanager
+def file_lock(lock_filename, exclusive=True):
+    """Hold an flock on lock_filename (shared between gunicorn workers)"""
+    with open(lock_filename, 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class SharedCounter:
+    """
+    A 64-bit counter in a small memory-mapped file.
+
+    Every process that opens the same file maps the same page, so an
+    increment in one gunicorn worker is visible to all the others on their
+    next read, which is a plain memory load with no system call.
+    Increments are serialized with an flock on the file itself.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._map = None
+
+    def _mapping(self):
+        if self._map is None:
+            fd = os.open(self.filename, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < 8:
+                    os.ftruncate(fd, 8)
+                self._map = mmap.mmap(fd, 8)
+            finally:
+                os.close(fd)
+        return self._map
+
+    @property
+    def value(self):
+        return struct.unpack_from('<Q', self._mapping())[0]
+
+    def increment(self):
+        """Add one and return the new value"""
+        with file_lock(self.filename):
+            mapping = self._mapping()
+            value = struct.unpack_from('<Q', mapping)[0] + 1
+            struct.pack_into('<Q', mapping, 0, value)
+            return value
+
+
+class CsvStore:
+    """Rows of a small CSV file (budgets), parsed once and kept in memory.
+
+    The file is re-read only when it changes on disk, and replaced
+    atomically on save.
+    """
+
+    def __init__(self, filename, headers):
+        self.filename = filename
+        self.headers = headers
+        self._rows = []
+        self._stamp = None
+        self._lock = threading.RLock()
+
+    def _refresh(self):
+        stamp = _file_stamp(self.filename)
+        if stamp == self._stamp:
+            return
+        rows = []
+        if stamp is not None:
+            try:
+                with metrics.span('csv_parse'), \
+                        open(self.filename, 'r', newline='') as f:
+                    rows = list(csv.DictReader(f))
+                metrics.count('file_reads')
+                metrics.count('rows_parsed', len(rows))
+            except Exception as e:
+                print(f"Error reading {self.filename}: {e}")
+        self._rows = rows
+        self._stamp = stamp
+
+    def rows(self):
+        """All rows as a list of dicts (shared, treat as read-only)"""
+        with self._lock:
+            self._refresh()
+            return self._rows
+
+    def replace(self, rows):
+        """Replace every row"""
+        rows = [{h: str(r.get(h, '')) for h in self.headers} for r in rows]
+        with file_lock(self.filename + '.lock'), self._lock:
+            # One temporary file per process, so workers never share one
+            tmp = f'{self.filename}.{os.getpid()}.tmp'
+            with open(tmp, 'w', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=self.headers)
+                writer.writeheader()
+                writer.writerows(rows)
+            os.replace(tmp, self.filename)
+            self._rows = rows
+            self._stamp = _file_stamp(self.filename)
+
+    def close(self):
+        """Nothing to release: the file is only open while it's read"""
+
+
+class BaseLedgerStore:
+    """
+    Interface shared by the ledger backends (CSV files or SQLite).
+
+    A store keeps the ledger in memory as a LedgerTable for the dashboard
+    and exposes the record-level writes the routes need. The aggregate
+    helpers default to the in-memory table; backends that can answer them
+    more cheaply (SQLite's indexed SUM ... GROUP BY) override them.
+    """
+
+    def table(self):
+        """The current LedgerTable (shared, treat as read-only)"""
+        raise NotImplementedError
+
+    def resident_bytes(self):
+        """Approximate memory held by the loaded table (0 before the first load)"""
+        table = getattr(self, '_table', None)
+        return table.nbytes() if table is not None else 0
+
+    def add(self, row):
+        """Append a new record and return its id"""
+        raise NotImplementedError
+
+    def add_many(self, rows):
+        """Append a batch of records and return their ids"""
+        return [self.add(row) for row in rows]
+
+    def update(self, record_id, fields):
+        """Update fields of a record; returns False if it doesn't exist"""
+        raise NotImplementedError
+
+    def delete(self, record_id):
+        """Delete a record; returns False if it doesn't exist"""
+        raise NotImplementedError
+
+    def rows(self):
+        """All rows as a list of dicts, each with its stable id"""
+        return self.table().rows()
+
+    def get(self, record_id):
+        """One row as a dict, or None if the id doesn't exist"""
+        table = self.table()
+        with table.lock:
+            i = table.position(record_id)
+            return None if i is None else table.row(i)
+
+    def __len__(self):
+        return len(self.table())
+
+    def total(self, start_date=None, end_date=None):
+        counts, sums = self.table().window_sums(start_date, end_date)
+        return float(sums.sum())
+
+    def category_totals(self, start_date=None, end_date=None):
+        """{category: total} for the rows dated start..end inclusive"""
+        table = self.table()
+        return table.category_dict(*table.window_sums(start_date, end_date))
+
+    def monthly_totals(self):
+        """{'YYYY-MM': total} for every month that has at least one row"""
+        return self.table().monthly_totals()
+
+    def close(self):
+        """Release open connections once the store is dropped (nothing for CSV files)"""
+
+
+class LedgerStore(BaseLedgerStore):
+    """
+    Expenses or income held in memory as a LedgerTable, stored append-only.
+
+    On disk a ledger is two files:
+
+    - ``expenses.csv``: the compacted snapshot, one row per record with its
+      stable ``id`` (files without an id column are numbered 1..n and
+      rewritten with ids on the first write)
+    - ``expenses.csv.log``: every add/set/del since the last compaction
+    - ``expenses.csv.bin``: the snapshot in binary form, written by each
+      compaction (and in the background after a CSV parse) and mmapped on
+      load instead of parsing the CSV (see binary_ledger.py); ignored
+      whenever it doesn't match the CSV
+
+    Adds, edits and deletes append one line to the log, so a write costs
+    the same I/O whatever the size of the ledger. Writers hold an exclusive
+    flock on ``expenses.csv.lock`` and first replay whatever other workers
+    appended, so ids stay unique and no write is lost. Once the log grows
+    past COMPACT_MIN_OPS (and half the ledger), a background thread folds
+    it into a new snapshot. Replaying the log is idempotent, so a crash
+    between replacing the snapshot and truncating the log loses nothing.
+
+    Lock order is always flock first, then the in-process lock.
+    """
+
+    COMPACT_MIN_OPS = 1000
+    # Snapshots at least this big (without a current binary copy) are
+    # parsed by a process pool, see parallel.py; None disables it
+    PARALLEL_MIN_BYTES = 32 * 1024 * 1024
+    # Keep a binary copy of the snapshot to mmap on load
+    BINARY_SNAPSHOT = True
+    # fsync the log before a write returns
+    FSYNC_LOG = True
+
+    def __init__(self, filename, headers):
+        # headers are [date, amount, <description|source>, category]
+        self.filename = filename
+        self.log_filename = filename + '.log'
+        self.lock_filename = filename + '.lock'
+        self.binary_filename = filename + '.bin'
+        self.binary_lock_filename = filename + '.bin.lock'
+        self.headers = headers
+        self.text_field = headers[2]
+        self._table = LedgerTable(self.text_field)
+        self._base_stamp = None
+        self._log_offset = 0
+        self._log_ops = 0
+        self._next_id = 1
+        self._base_has_ids = True
+        self._lock = threading.RLock()
+        self._compacting = False
+        self._binary_writer = None
+
+    # Reading
+
+    def _is_stale(self):
+        if _file_stamp(self.filename) != self._base_stamp:
+            return True
+        try:
+            log_size = os.path.getsize(self.log_filename)
+        except OSError:
+            log_size = 0
+        return log_size != self._log_offset
+
+    def _refresh_locked(self):
+        """Catch up with the files on disk; the caller holds the flock"""
+        base_stamp = _file_stamp(self.filename)
+        try:
+            log_size = os.path.getsize(self.log_filename)
+        except OSError:
+            log_size = 0
+        if base_stamp != self._base_stamp or log_size < self._log_offset:
+            self._load_base(base_stamp)
+        if log_size > self._log_offset:
+            self._replay_log()
+
+    def _read_csv(self, stamp):
+        """(LedgerTable, has_ids) parsed from the snapshot CSV"""
+        if stamp is not None and self.PARALLEL_MIN_BYTES is not None \
+                and stamp[2] >= self.PARALLEL_MIN_BYTES:
+            import parallel  # Only large ledgers need the process pool
+            try:
+                with metrics.span('parallel_parse'):
+                    loaded = parallel.load(self.filename, self.text_field)
+            except Exception as e:
+                print(f"Error reading {self.filename} in parallel: {e}")
+                loaded = None
+            if loaded is not None:
+                metrics.count('file_reads')
+                metrics.count('rows_parsed', len(loaded[0]))
+                return loaded
+        rows = []
+        if stamp is not None:
+            try:
+                with open(self.filename, 'r', newline='') as f:
+                    rows = list(csv.DictReader(f))
+                metrics.count('file_reads')
+                metrics.count('rows_parsed', len(rows))
+            except Exception as e:
+                print(f"Error reading {self.filename}: {e}")
+        ids = None
+        if rows and 'id' in rows[0]:
+            valid, ids = [], []
+            for line, row in enumerate(rows, 2):
+                try:
+                    record_id = int(row['id'])
+                except (TypeError, ValueError):
+                    print(f"Skipping row {line} of {self.filename}: "
+                          f"bad id {row['id']!r}")
+                    continue
+                valid.append(row)
+                ids.append(record_id)
+            rows = valid
+        has_ids = not rows or ids is not None
+        return LedgerTable.from_rows(rows, self.text_field, ids), has_ids
+
+    def _load_base(self, stamp):
+        loaded = None
+        if self.BINARY_SNAPSHOT and stamp is not None:
+            with metrics.span('binary_load'):
+                loaded = binary_ledger.load(
+                    self.binary_filename, self.text_field, stamp
+                )
+        if loaded is not None:
+            self._table, header = loaded
+            self._base_has_ids = header['csv_has_ids']
+            metrics.count('file_reads')
+        else:
+            with metrics.span('csv_parse'):
+                self._table, self._base_has_ids = self._read_csv(stamp)
+            if self.BINARY_SNAPSHOT and stamp is not None and len(self._table):
+                self._write_binary_later(stamp)
+        self._base_stamp = stamp
+        self._log_offset = 0
+        self._log_ops = 0
+        self._next_id = self._table.next_id()
+
+    def _write_binary_later(self, stamp):
+        # Copy the parsed snapshot before the log replays into it, and write
+        # it out in the background so the next cold load can mmap it.
+        # Writers don't wait on the ledger flock for this, only on
+        # expenses.csv.bin.lock, which makes other workers skip the copy.
+        table = self._table
+        snapshot = LedgerTable.from_columns(
+            table.text_field, table.ids.copy(), table.dates.copy(),
+            table.amounts.copy(), table.codes.copy(), list(table.texts),
+            list(table.categories)
+        )
+        self._binary_writer = threading.Thread(
+            target=self._write_binary_copy,
+            args=(snapshot, stamp, self._base_has_ids), daemon=True
+        )
+        self._binary_writer.start()
+
+    def _write_binary_copy(self, table, stamp, has_ids):
+        try:
+            with file_lock(self.binary_lock_filename):
+                if (_file_stamp(self.filename) != stamp
+                        or binary_ledger.is_current(self.binary_filename, stamp)):
+                    return
+                binary_ledger.write(self.binary_filename, table, stamp, has_ids)
+        except Exception as e:
+            print(f"Error writing {self.binary_filename}: {e}")
+
+    def _replay_log(self):
+        try:
+            with open(self.log_filename, 'rb') as f:
+                f.seek(self._log_offset)
+                data = f.read()
+        except OSError as e:
+            print(f"Error reading {self.log_filename}: {e}")
+            return
+        metrics.count('file_reads')
+        # Only replay complete lines
+        end = data.rfind(b'\n') + 1
+        ops = 0
+        with metrics.span('log_replay'):
+            # Not splitlines(): descriptions may contain \x0c, \x85, U+2028...
+            text = data[:end].decode('utf-8', errors='replace')
+            for op in csv.reader(io.StringIO(text, newline='')):
+                self._apply(op)
+                ops += 1
+        self._log_ops += ops
+        self._log_offset += end
+        metrics.count('rows_parsed', ops)
+
+    def _apply(self, op):
+        """
+        Apply one log line: [op, id, date, amount, text, category]. A
+        malformed line is skipped (and reported) rather than failing the load.
+        """
+        if not op:
+            return
+        kind = op[0]
+        width = 2 if kind == 'del' else 2 + len(self.headers)
+        try:
+            if kind not in ('add', 'set', 'del') or len(op) < width:
+                raise ValueError(f"expected {width} fields")
+            record_id = int(op[1])
+        except ValueError as e:
+            print(f"Skipping bad entry in {self.log_filename} ({e}): {op!r}")
+            return
+        table = self._table
+        i = table.position(record_id)
+        if kind == 'add' and i is None and record_id >= self._next_id:
+            table.append(op[2], op[3], op[4], op[5], record_id)
+        elif kind == 'set' and i is not None:
+            table.update(i, dict(zip(self.headers, op[2:width], strict=True)))
+        elif kind == 'del' and i is not None:
+            table.delete(i)
+        # Ids are never reused, even when the newest record was deleted
+        self._next_id = max(self._next_id, record_id + 1)
+
+    def table(self):
+        if self._is_stale():
+            with file_lock(self.lock_filename, exclusive=False), self._lock:
+                self._refresh_locked()
+        return self._table
+
+    # Writing
+
+    def _init_base(self):
+        if not os.path.exists(self.filename):
+            with open(self.filename, 'w', newline='') as f:
+                csv.writer(f).writerow(['id'] + self.headers)
+            self._base_stamp = _file_stamp(self.filename)
+
+    def _append_log(self, data, ops):
+        """Append encoded log lines, durably; the caller holds the flock"""
+        with open(self.log_filename, 'ab') as f:
+            f.write(data)
+            if self.FSYNC_LOG:
+                f.flush()
+                os.fsync(f.fileno())
+        self._log_offset += len(data)
+        self._log_ops += ops
+
+    def _write_log(self, kind, record_id, values=()):
+        self._append_log(_csv_line([kind, record_id] + list(values)).encode('utf-8'), 1)
+
+    def _values(self, row):
+        return [row.get(h, '') for h in self.headers]
+
+    def add(self, row):
+        with file_lock(self.lock_filename), self._lock:
+            self._init_base()
+            self._refresh_locked()
+            record_id = self._next_id
+            values = self._values(row)
+            self._write_log('add', record_id, values)
+            self._table.append(*values, record_id=record_id)
+            self._next_id = record_id + 1
+        self._maybe_compact()
+        return record_id
+
+    def add_many(self, rows):
+        """Append a batch with a single locked write to the log"""
+        if not rows:
+            return []
+        with file_lock(self.lock_filename), self._lock:
+            self._init_base()
+            self._refresh_locked()
+            first_id = self._next_id
+            ids = list(range(first_id, first_id + len(rows)))
+            out = io.StringIO()
+            csv.writer(out, lineterminator='\n').writerows(
+                ['add', record_id] + self._values(row)
+                for record_id, row in zip(ids, rows, strict=True)
+            )
+            self._append_log(out.getvalue().encode('utf-8'), len(rows))
+            self._table.extend(rows, ids)
+            self._next_id = first_id + len(rows)
+        self._maybe_compact()
+        return ids
+
+    def update(self, record_id, fields):
+        with file_lock(self.lock_filename), self._lock:
+            self._refresh_locked()
+            table = self._table
+            i = table.position(record_id)
+            if i is None:
+                return False
+            row = table.row(i)
+            row.update(fields)
+            values = self._values(row)
+            self._write_log('set', record_id, values)
+            table.update(i, dict(zip(self.headers, values, strict=True)))
+        self._maybe_compact()
+        return True
+
+    def delete(self, record_id):
+        with file_lock(self.lock_filename), self._lock:
+            self._refresh_locked()
+            i = self._table.position(record_id)
+            if i is None:
+                return False
+            self._write_log('del', record_id)
+            self._table.delete(i)
+        self._maybe_compact()
+        return True
+
+    # Compaction
+
+    def _maybe_compact(self):
+        if self._compacting:
+            return
+        threshold = max(self.COMPACT_MIN_OPS, len(self._table) // 2)
+        if self._base_has_ids and self._log_ops < threshold:
+            return
+        self._compacting = True
+        threading.Thread(target=self.compact, daemon=True).start()
+
+    def compact(self):
+        """Fold the log into a fresh snapshot file and truncate the log"""
+        try:
+            with file_lock(self.lock_filename):
+                with self._lock:
+                    self._refresh_locked()
+                    table = self._table
+                # Writers need the flock we hold, so the table can't change
+                # while the snapshot is written.
+                tmp = self.filename + '.tmp'
+                with open(tmp, 'w', newline='') as f:
+                    writer = csv.writer(f)
+                    writer.writerow(['id'] + self.headers)
+                    for row in table.rows():
+                        writer.writerow([row['id']] + self._values(row))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp, self.filename)
+                # Remember the highest id used if that record was deleted
+                last_id = self._next_id - 1
+                with open(self.log_filename, 'w') as f:
+                    if last_id > 0 and table.position(last_id) is None:
+                        f.write(_csv_line(['del', last_id]))
+                with self._lock:
+                    self._base_stamp = _file_stamp(self.filename)
+                    self._base_has_ids = True
+                    self._log_offset = os.path.getsize(self.log_filename)
+                    self._log_ops = 0
+                if self.BINARY_SNAPSHOT:
+                    with file_lock(self.binary_lock_filename):
+                        binary_ledger.write(
+                            self.binary_filename, table, self._base_stamp, True
+                        )
+        except Exception as e:
+            print(f"Error compacting {self.filename}: {e}")
+        finally:
+            self._compacting = False
+
+    def write_binary(self):
+        """
+        Write the binary copy of the snapshot CSV (see binary_ledger.py) if
+        it is missing or stale; returns the number of rows
+        """
+        with file_lock(self.lock_filename, exclusive=False):
+            stamp = _file_stamp(self.filename)
+            if stamp is None:
+                raise FileNotFoundError(self.filename)
+            header = binary_ledger.read_header(self.binary_filename)
+            if header is not None and tuple(header['source_stamp']) == stamp:
+                return header['count']
+            table, has_ids = self._read_csv(stamp)
+            binary_ledger.write(self.binary_filename, table, stamp, has_ids)
+            return len(table)
+
+
+class WriteQueue:
+    """
+    Group commit for the add routes.
+
+    add() hands a validated row to one background writer thread and
+    blocks until the row is on disk. The writer takes everything queued
+    since its last commit (up to max_batch rows) and writes it with one
+    store.add_many(): one flock, one append and one fsync for the whole
+    batch. Concurrent adds therefore share a disk flush instead of paying
+    one each, and none returns before its batch is durable. The thread
+    exits after IDLE_SECONDS without writes and is restarted by the next
+    add, so idle ledgers don't keep one each.
+    """
+
+    MAX_BATCH = 1000
+    IDLE_SECONDS = 30.0
+
+    def __init__(self, store, max_batch=MAX_BATCH):
+        self.store = store
+        self.max_batch = max_batch
+        self._queue = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def add(self, row):
+        """Write row with the next batch; returns its id once it is durable"""
+        future = Future()
+        with self._lock:
+            # A forked gunicorn worker doesn't inherit the thread
+            if self._queue is None or self._pid != os.getpid():
+                self._queue = queue.SimpleQueue()
+                self._pid = os.getpid()
+                threading.Thread(
+                    target=self._run, args=(self._queue,), daemon=True
+                ).start()
+            self._queue.put((row, future))
+        return future.result()
+
+    def _run(self, pending):
+        while True:
+            try:
+                batch = [pending.get(timeout=self.IDLE_SECONDS)]
+            except queue.Empty:
+                with self._lock:
+                    # add() puts under the lock, so nothing can arrive now
+                    if pending.empty():
+                        if self._queue is pending:
+                            self._queue = None
+                        return
+                continue
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(pending.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                ids = self.store.add_many([row for row, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            metrics.count('write_batches')
+            metrics.count('rows_written', len(batch))
+            for (_, future), record_id in zip(batch, ids, strict=True):
+                future.set_result(record_id)
+
+
+def open_stores(backend='csv', expenses_file='expenses.csv', income_file='income.csv',
+                budgets_file='budgets.csv', database='finance.db'):
+    """
+    Create the (expenses, income, budgets) stores for a backend.
+
+    backend is 'csv' (the default, files in the working directory) or
+    'sqlite' (one database file, see sqlite_store.py).
+    """
+    expense_headers = ['date', 'amount', 'description', 'category']
+    income_headers = ['date', 'amount', 'source', 'category']
+    budget_headers = ['category', 'budget']
+    if backend == 'sqlite':
+        from sqlite_store import SqliteBudgetStore, SqliteLedgerStore
+        return (
+            SqliteLedgerStore(database, 'expenses', expense_headers),
+            SqliteLedgerStore(database, 'income', income_headers),
+            SqliteBudgetStore(database),
+        )
+    if backend != 'csv':
+        raise ValueError(f"Unknown storage backend '{backend}'")
+    return (
+        LedgerStore(expenses_file, expense_headers),
+        LedgerStore(income_file, income_headers),
+        CsvStore(budgets_file, budget_headers),
+    )
+
+
+def _csv_line(values):
+    out = io.StringIO()
+    csv.writer(out, lineterminator='\n').writerow(values)
+    return out.getvalue()
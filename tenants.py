@@ -0,0 +1,101 @@
+"""
+Per-user ledger shards, loaded on demand and evicted least recently used.
+
+In multi-tenant mode every user has a directory of their own under the
+tenants root (``tenants/alice/expenses.csv``, ``income.csv``, ...; or
+``tenants/alice/finance.db`` with the SQLite backend), so users never
+share a file, a lock, a write queue or a cache entry. The user comes from
+a request header set by the authenticating proxy in front of the app.
+
+TenantRegistry opens a user's ledger on their first request; the stores
+load the files lazily, on the first read. After each request the
+registry re-measures that user's resident memory (tables, indexes and
+cached pages) and, while the total is over max_bytes, drops the least
+recently used users. Dropping one only releases memory and the tenant's
+database connections (``close()``): everything is on disk, and the next
+request reloads it. A request that is still using a
+dropped ledger keeps its own reference until it finishes.
+"""
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import metrics
+
+# Letters, digits, '_', '-' and '.', not starting with '.' (so never a path)
+TENANT_NAME = re.compile(r'[A-Za-z0-9_-][A-Za-z0-9_.-]{0,63}')
+
+# Charged per open tenant on top of its tables: stores, queues, engine,
+# cache and the mapped generation counter
+TENANT_OVERHEAD_BYTES = 64 * 1024
+
+
+def valid_tenant_name(name):
+    """True for a name usable as a tenant directory"""
+    return bool(name) and TENANT_NAME.fullmatch(name) is not None
+
+
+class TenantRegistry:
+    """Open tenants by name, least recently used first"""
+
+    def __init__(self, root, opener, max_bytes):
+        # opener(directory) creates the tenant's stores in directory; the
+        # tenant's close() is called when it is evicted
+        self.root = root
+        self.opener = opener
+        self.max_bytes = max_bytes
+        self._tenants = OrderedDict()  # name -> [tenant, resident bytes]
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """The tenant called name, opening it if it isn't loaded"""
+        if not valid_tenant_name(name):
+            raise ValueError(f"Invalid tenant name '{name}'")
+        with self._lock:
+            entry = self._tenants.get(name)
+            if entry is not None:
+                self._tenants.move_to_end(name)
+                return entry[0]
+            directory = os.path.join(self.root, name)
+            os.makedirs(directory, exist_ok=True)
+            tenant = self.opener(directory)
+            self._tenants[name] = [tenant, TENANT_OVERHEAD_BYTES]
+            self._bytes += TENANT_OVERHEAD_BYTES
+            metrics.count('tenants_opened')
+            self._evict(name)
+            return tenant
+
+    def account(self, name, tenant):
+        """Re-measure a tenant after a request and evict down to max_bytes"""
+        size = TENANT_OVERHEAD_BYTES + tenant.resident_bytes()
+        with self._lock:
+            entry = self._tenants.get(name)
+            # Not if it was evicted (and maybe reopened) meanwhile
+            if entry is not None and entry[0] is tenant:
+                self._bytes += size - entry[1]
+                entry[1] = size
+            self._evict(name)
+
+    def _evict(self, keep):
+        """Drop the least recently used tenants, never keep, until under max_bytes"""
+        while self._bytes > self.max_bytes and len(self._tenants) > 1:
+            name = next(iter(self._tenants))
+            if name == keep:
+                self._tenants.move_to_end(name)
+                name = next(iter(self._tenants))
+            tenant, size = self._tenants.pop(name)
+            self._bytes -= size
+            tenant.close()
+            metrics.count('tenants_evicted')
+
+    def resident_bytes(self):
+        """Memory charged to the open tenants, as last measured"""
+        return self._bytes
+
+    def __contains__(self, name):
+        return name in self._tenants
+
+    def __len__(self):
+        return len(self._tenants)
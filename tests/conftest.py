@@ -0,0 +1,11 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """Test client for the app, working on an empty ledger in tmp_path"""
+    monkeypatch.chdir(tmp_path)
+    main = importlib.import_module('main')
+    return main.app.test_client()
@@ -0,0 +1,64 @@
+"""CashFlow window sums, date bounds and caching"""
+from datetime import date
+
+import pytest
+
+from analytics import CashFlow, CashFlowCache
+from ledger import LedgerTable
+
+
+def table(rows, text_field):
+    return LedgerTable.from_rows(
+        [{'date': d, 'amount': a, text_field: 'x', 'category': 'Food'}
+         for d, a in rows],
+        text_field,
+    )
+
+
+@pytest.fixture
+def flow():
+    expenses = table([('2025-01-01', '10'), ('2025-01-15', '20'), ('2025-02-01', '40')],
+                     'description')
+    income = table([('2025-01-01', '100'), ('2025-02-10', '100')], 'source')
+    return CashFlow(expenses, income)
+
+
+def test_windows(flow):
+    assert flow.spent('2025-01-01', '2025-01-31') == 30
+    assert flow.spent('2025-01-02', None) == 60
+    assert flow.earned(None, '2025-02-09') == 100
+    assert flow.balance('2025-02-01') == 30
+    assert flow.rolling_spend(7, '2025-02-03') == 40
+
+
+@pytest.mark.parametrize('bound', ['garbage', '2025-02-30', 'NaT', ''])
+def test_invalid_dates_are_no_bound(flow, bound):
+    assert flow.spent(bound, bound) == 70
+    summary = flow.summary(bound, bound, today=date(2025, 3, 1))
+    assert (summary['start'], summary['end']) == ('2025-01-01', '2025-03-01')
+    assert summary['spent'] == 70
+
+
+def test_series_are_sampled_back_from_the_end(flow):
+    labels, balances = flow.balance_series('2025-01-01', '2025-02-10', max_points=5)
+    assert len(labels) <= 5
+    assert labels[-1] == '2025-02-10'
+    assert balances[-1] == 130
+    labels, balances = flow.balance_series('2025-02-10', '2025-01-01')
+    assert labels == [] and len(balances) == 0
+
+
+def test_cache_is_per_ledger_and_follows_writes():
+    alice = (table([('2025-01-01', '10')], 'description'), table([], 'source'))
+    bob = (table([('2025-01-01', '99')], 'description'), table([], 'source'))
+    alice_flows, bob_flows = CashFlowCache(), CashFlowCache()
+    assert alice_flows.nbytes() == 0
+
+    flow = alice_flows.get(*alice)
+    assert alice_flows.get(*alice) is flow
+    assert bob_flows.get(*bob).spent() == 99
+    assert flow.spent() == 10
+    assert alice_flows.nbytes() > 0
+
+    alice[0].append('2025-01-02', 5.0, 'x', 'Food')
+    assert alice_flows.get(*alice).spent() == 15
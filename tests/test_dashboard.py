@@ -0,0 +1,67 @@
+"""Bucketed time series for the charts and the API"""
+import pytest
+
+import dashboard
+from ledger import LedgerTable
+
+
+@pytest.fixture
+def table():
+    rows = [('2025-01-01', '10'), ('2025-01-15', '20'), ('2025-03-01', '40')]
+    return LedgerTable.from_rows(
+        [{'date': d, 'amount': a, 'description': 'x', 'category': 'Food'}
+         for d, a in rows],
+        'description',
+    )
+
+
+def test_series_fills_empty_buckets(table):
+    labels, totals = dashboard.time_series(table, 'month')
+    assert labels == ['2025-01', '2025-02', '2025-03']
+    assert totals.tolist() == [30, 0, 40]
+
+
+@pytest.mark.parametrize('granularity', dashboard.GRANULARITIES)
+def test_series_rejects_spans_over_the_bucket_limit(table, granularity):
+    with pytest.raises(ValueError):
+        dashboard.time_series(table, granularity, '0001-01-01', '9999-12-31')
+
+
+def test_series_from_data_extremes_is_bounded(table, monkeypatch):
+    monkeypatch.setattr(dashboard, 'MAX_SERIES_BUCKETS', 59)
+    with pytest.raises(ValueError):
+        dashboard.time_series(table, 'day')
+    assert len(dashboard.time_series(table, 'day', '2025-01-01', '2025-02-28')[0]) == 59
+
+
+@pytest.mark.parametrize('value', ['2024-1-5', '2024-01-5', '2024-02-30', 'garbage'])
+def test_api_rejects_dates_that_are_not_iso(client, value):
+    for url in (f'/api/stats?start_date={value}', f'/api/series?start={value}',
+                f'/api/search?q=x&end={value}'):
+        response = client.get(url)
+        assert response.status_code == 400, url
+        assert 'YYYY-MM-DD' in response.get_json()['error']
+
+
+@pytest.mark.parametrize('value', ['2024-1-5', 'garbage'])
+def test_exports_reject_dates_that_are_not_iso(client, value):
+    for url in (f'/export/expenses?start_date={value}',
+                f'/export/all?end_date={value}&gzip=1'):
+        response = client.get(url)
+        assert response.status_code == 400, url
+        assert b'YYYY-MM-DD' in response.data
+
+
+def test_export_filters_by_date(client):
+    client.post('/add_expense', data={'amount': '12.50', 'description': 'lunch',
+                                      'category': 'Food'})
+    lines = client.get('/export/expenses?start_date=2000-01-01').text.splitlines()
+    assert lines[0] == 'date,amount,description,category'
+    assert lines[1].endswith(',12.5,lunch,Food')
+    assert client.get('/export/expenses?end_date=2000-01-01').text.splitlines() == [
+        'date,amount,description,category'
+    ]
+
+
+def test_dashboard_ignores_unpadded_dates(client):
+    assert client.get('/?start_date=2024-1-5&end_date=2024-12-31').status_code == 200
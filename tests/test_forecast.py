@@ -0,0 +1,46 @@
+"""Student t critical values and the forecast horizon"""
+from statistics import NormalDist
+
+import numpy as np
+import pytest
+
+from forecast import MAX_HORIZON_MONTHS, CategoryForecast, t_quantile
+from ledger import LedgerTable
+
+
+@pytest.mark.parametrize('df', [np.int32(2000), np.int32(100_000), 10**6])
+def test_t_quantile_tends_to_normal_for_large_df(df):
+    z = NormalDist().inv_cdf(0.95)
+    assert t_quantile(0.9, df) == pytest.approx(z, rel=1e-3)
+
+
+def test_t_quantile_small_df():
+    assert t_quantile(0.9, np.int32(10)) == pytest.approx(1.812, rel=1e-2)
+
+
+def test_forecast_horizon():
+    rows = [
+        {'date': f'2025-{m:02}-10', 'amount': '100', 'description': 'x',
+         'category': 'Food'}
+        for m in range(1, 13)
+    ]
+    table = LedgerTable.from_rows(rows, 'description')
+    forecasts = CategoryForecast()
+
+    horizon = np.datetime64('2025-12', 'M') + np.timedelta64(MAX_HORIZON_MONTHS, 'M')
+    assert 'Food' in forecasts.forecast(table, str(horizon))
+    assert forecasts.forecast(table, str(horizon + np.timedelta64(1, 'M'))) == {}
+    assert forecasts.forecast(table, '9999-12') == {}
+
+
+@pytest.mark.parametrize(
+    'month', ['2024-1', '2024-13', '24-01', '2024-01-05', 'garbage']
+)
+def test_api_rejects_malformed_months(client, month):
+    response = client.get(f'/api/forecast?month={month}')
+    assert response.status_code == 400
+    assert response.get_json()['error'] == 'month must be YYYY-MM'
+
+
+def test_api_forecasts_padded_months(client):
+    assert client.get('/api/forecast?month=2024-01').status_code == 200
@@ -0,0 +1,100 @@
+"""Date, amount and category normalization of importer.py; import_csv"""
+import io
+
+import pytest
+
+from importer import import_csv, map_category, normalize_amount, normalize_date
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-03-05', '2024-03-05'),
+    (' 2024-03-05 ', '2024-03-05'),
+    ('05/03/2024', '2024-03-05'),  # Day first
+    ('05-03-24', '2024-03-05'),
+    ('05.03.2024', '2024-03-05'),
+    ('2024/03/05', '2024-03-05'),
+    ('5 Mar 2024', '2024-03-05'),
+    ('05-Mar-24', '2024-03-05'),
+    ('Mar 05, 2024', '2024-03-05'),
+    ('2024-02-30', None),
+    ('31/02/2024', None),
+    ('yesterday', None),
+    ('', None),
+    (None, None),
+])
+def test_normalize_date(value, expected):
+    assert normalize_date(value) == expected
+
+
+def test_normalize_date_with_an_explicit_format():
+    assert normalize_date('03/05/2024', '%m/%d/%Y') == '2024-03-05'
+    assert normalize_date('05/03/2024') == '2024-03-05'
+    assert normalize_date('2024-03-05', '%m/%d/%Y') == '2024-03-05'
+    assert normalize_date('5 Mar 2024', '%m/%d/%Y') is None
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('12.50', 12.5),
+    ('₹1,234.50', 1234.5),
+    ('$ 99', 99.0),
+    ('INR 2,000', 2000.0),
+    ('Rs. 45', 45.0),
+    ('rs450', 450.0),
+    ('0', None),
+    ('-5', None),
+    ('nan', None),
+    ('inf', None),
+    ('twelve', None),
+    ('', None),
+    (None, None),
+])
+def test_normalize_amount(value, expected):
+    assert normalize_amount(value) == expected
+
+
+CATEGORY_MAP = {'swiggy': 'Food', 'uber': 'Transport', 'misc': 'Other'}
+
+
+@pytest.mark.parametrize('category, text, expected', [
+    ('Groceries', 'SWIGGY order', 'Groceries'),  # A category wins over the text
+    (' Groceries ', '', 'Groceries'),
+    ('MISC', '', 'Other'),  # A category equal to a keyword is renamed
+    ('', 'UPI/SWIGGY/order 123', 'Food'),
+    (None, 'Uber trip', 'Transport'),
+    ('', 'Rent', 'Other'),
+    ('', None, 'Other'),
+])
+def test_map_category(category, text, expected):
+    assert map_category(category, text, CATEGORY_MAP) == expected
+
+
+class ListStore:
+    headers = ['date', 'amount', 'description', 'category']
+
+    def __init__(self):
+        self.batches = []
+
+    def add_many(self, rows):
+        self.batches.append(rows)
+
+
+def test_import_csv_batches_rows_and_reports_rejects():
+    statement = io.StringIO(
+        'Txn Date,Debit,Narration\n'
+        '05/03/2024,"1,200.00",Swiggy order\n'
+        '06/03/2024,abc,Uber\n'
+        'soon,10,Rent\n'
+        '07/03/2024,300,Rent\n'
+    )
+    store = ListStore()
+    result = import_csv(store, statement, 'Txn Date', 'Debit', 'Narration',
+                        category_map=CATEGORY_MAP, batch_size=1)
+    assert (result.imported, result.rejected, result.batches) == (2, 2, 2)
+    assert result.errors == ["line 3: invalid Debit 'abc'",
+                             "line 4: invalid Txn Date 'soon'"]
+    assert store.batches == [
+        [{'date': '2024-03-05', 'amount': 1200.0, 'description': 'Swiggy order',
+          'category': 'Food'}],
+        [{'date': '2024-03-07', 'amount': 300.0, 'description': 'Rent',
+          'category': 'Other'}],
+    ]
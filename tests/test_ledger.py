@@ -0,0 +1,136 @@
+"""LedgerTable derived state (rollup, date index, sort views, text index) on writes"""
+import threading
+
+import numpy as np
+import pytest
+
+from ledger import LedgerTable
+
+
+def make_table(rows):
+    dates = np.datetime64('2024-01-01') + np.arange(rows) % 700
+    dates.sort()
+    return LedgerTable.from_rows(
+        [{'date': str(d), 'amount': '1', 'description': f'shop {i % 50}',
+          'category': 'Food'} for i, d in enumerate(dates)],
+        'description',
+    )
+
+
+def race(table, build, writes=300):
+    """Append writes rows in one thread while build() reads the table in this one"""
+    start = threading.Barrier(2)
+
+    def writer():
+        start.wait()
+        for i in range(writes):
+            table.append('2026-01-01', '1', f'shop new{i}', 'Food')
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    start.wait()
+    build()
+    thread.join()
+
+
+@pytest.mark.parametrize('attempt', range(5))
+def test_rollup_built_during_writes_stays_current(attempt):
+    table = make_table(50000 + attempt)
+    race(table, table.rollup)
+    assert table.total() == pytest.approx(len(table))
+    assert sum(table.monthly_totals().values()) == pytest.approx(len(table))
+
+
+@pytest.mark.parametrize('attempt', range(5))
+def test_date_index_built_during_writes_stays_current(attempt):
+    table = make_table(50000 + attempt)
+    race(table, table.date_window)
+    window = table.date_window('2026-01-01', '2026-01-01')
+    assert len(np.arange(len(table))[window]) == 300
+
+
+@pytest.mark.parametrize('attempt', range(5))
+def test_text_index_built_during_writes_stays_current(attempt):
+    table = make_table(50000 + attempt)
+
+    def lookups():
+        table.text_index()
+        for _ in range(50):
+            table.search('shop new')
+
+    race(table, lookups)
+    assert len(table.search('new')) == 300
+    assert len(table.search('shop')) == len(table)
+
+
+@pytest.mark.parametrize('start, end', [
+    ('2024-01-01', '2024-12-31'), ('2024-01-15', '2024-03-10'), ('2024-02-29', None),
+    (None, '2024-06-30'), ('2024-03-05', '2024-03-20'), ('2025-01-31', '2025-02-01'),
+])
+def test_window_sums_match_the_rows(start, end):
+    table = make_table(2000)
+    counts, sums = table.window_sums(start, end)
+    dates = table.dates
+    inside = np.ones(len(table), dtype=bool)
+    if start:
+        inside &= dates >= np.datetime64(start)
+    if end:
+        inside &= dates <= np.datetime64(end)
+    assert counts.sum() == inside.sum()
+    assert sums.sum() == pytest.approx(table.amounts[inside].sum())
+
+
+def test_date_index_survives_edits_and_deletes():
+    rng = np.random.default_rng(0)
+    table = make_table(500)
+    table.date_window('2024-01-01', None)  # Build the index
+    days = ['2023-12-31', '2024-03-01', '2024-06-15', '2025-12-01', '']
+    for step in range(400):
+        i = int(rng.integers(len(table)))
+        if step % 3 == 0:
+            table.delete(i)
+        else:
+            row = table.row(i)
+            if step % 2:
+                row['date'] = days[int(rng.integers(len(days)))]
+            table.update(i, row)
+        assert table._order is not None
+        rebuilt = LedgerTable.from_columns(
+            'description', table.ids, table.dates, table.amounts, table.codes,
+            table.texts, table.categories,
+        )
+        for start, end in [('2024-03-01', '2024-06-15'), (None, '2024-01-31'),
+                           ('2025-01-01', None)]:
+            window = np.arange(len(table))[table.date_window(start, end)]
+            expected = np.arange(len(table))[rebuilt.date_window(start, end)]
+            assert window.tolist() == expected.tolist()
+
+
+def test_sort_views_merge_appended_rows():
+    rng = np.random.default_rng(1)
+    table = make_table(300)
+    categories = ['Food', 'Travel']
+    keys = [(sort, code) for sort in ('date', 'amount') for code in (None, 0)]
+    days = ['2023-12-31', '2024-06-15', '2024-06-15', '2026-01-01', '']
+    for step in range(60):
+        for key in keys:
+            table._sort_view(*key)  # Build or merge every view
+        if step % 4 == 0:
+            rows = [{'date': days[int(rng.integers(len(days)))],
+                     'amount': str(int(rng.integers(1, 5))),
+                     'description': 'batch',
+                     'category': categories[int(rng.integers(2))]}
+                    for _ in range(5)]
+            table.extend(rows, np.arange(table.next_id(), table.next_id() + 5))
+        else:
+            table.append(days[int(rng.integers(len(days)))],
+                         str(int(rng.integers(1, 5))), 'one',
+                         categories[int(rng.integers(2))])
+        rebuilt = LedgerTable.from_columns(
+            'description', table.ids, table.dates, table.amounts, table.codes,
+            table.texts, table.categories,
+        )
+        for key in keys:
+            merged, expected = table._sort_view(*key), rebuilt._sort_view(*key)
+            for got, want in zip(merged, expected, strict=True):
+                np.testing.assert_array_equal(got, want)
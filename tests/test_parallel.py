@@ -0,0 +1,77 @@
+"""Parallel parsing of ledger CSV files in parallel.py"""
+import csv
+
+import numpy as np
+import pytest
+
+import parallel
+from storage import LedgerStore
+
+HEADERS = ['date', 'amount', 'description', 'category']
+
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    monkeypatch.setattr(parallel, 'MIN_CHUNK_BYTES', 1000)
+
+
+def write_ledger(path, descriptions):
+    filename = str(path / 'expenses.csv')
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id'] + HEADERS)
+        for i, description in enumerate(descriptions, 1):
+            category = 'Food' if i % 3 else 'Rent'
+            date = f'2025-{i % 12 + 1:02}-15'
+            writer.writerow([i, date, '40.00', description, category])
+    return filename
+
+
+def test_quoted_newlines_across_chunk_boundaries(tmp_path):
+    texts = ['line one\nline two\n"quoted", and more\n' * 3] * 3000
+    filename = write_ledger(tmp_path, texts)
+    assert len(parallel.chunk_ranges(filename, 4)[1]) > 1
+
+    totals = {'Food': 80000.0, 'Rent': 40000.0}
+    table, has_ids = parallel.load(filename, 'description', workers=4)
+    assert has_ids
+    assert table.texts == texts
+    assert table.category_totals() == totals
+
+    categories, rollup = parallel.aggregate(filename, workers=4)
+    assert parallel.category_totals(categories, rollup) == totals
+
+
+def test_aligned_chunks_parse_in_parallel(tmp_path):
+    texts = [f'row {i}, "quoted"' for i in range(5000)]
+    filename = write_ledger(tmp_path, texts)
+    header, ranges = parallel.chunk_ranges(filename, 4)
+    assert len(ranges) > 1 and parallel.aligned(parallel.quote_counts(filename, ranges))
+
+    table, _ = parallel.load(filename, 'description', workers=4)
+    assert table.texts == texts
+    assert list(table.ids) == list(range(1, 5001))
+    assert sum(table.category_totals().values()) == pytest.approx(200000.0)
+
+
+def test_store_load_matches_serial_parse(tmp_path, monkeypatch):
+    texts = [f'row {i}\nsecond line' if i % 7 == 0 else f'row {i}' for i in range(4000)]
+    filename = write_ledger(tmp_path, texts)
+    serial = LedgerStore(filename, HEADERS)
+    monkeypatch.setattr(LedgerStore, 'PARALLEL_MIN_BYTES', 0)
+    loads = []
+    load = parallel.load
+
+    def pooled_load(*args):
+        loads.append(args)
+        return load(*args, workers=4)
+
+    monkeypatch.setattr(parallel, 'load', pooled_load)
+    pooled = LedgerStore(filename, HEADERS)
+
+    assert list(pooled.rows()) == list(serial.rows())
+    assert loads
+    assert pooled.category_totals() == pytest.approx(serial.category_totals())
+    monthly = pooled.monthly_totals()
+    assert list(monthly) == list(serial.monthly_totals())
+    assert np.allclose(list(monthly.values()), list(serial.monthly_totals().values()))
@@ -0,0 +1,230 @@
+"""Log replay, id allocation and compaction of storage.LedgerStore; WriteQueue"""
+import multiprocessing
+import threading
+import time
+
+import pytest
+
+import binary_ledger
+from storage import LedgerStore, WriteQueue, _file_stamp
+
+HEADERS = ['date', 'amount', 'description', 'category']
+
+
+def open_store(path):
+    return LedgerStore(str(path / 'expenses.csv'), HEADERS)
+
+
+def expense(description, amount='10.00', date='2025-01-15', category='Food'):
+    return {'date': date, 'amount': amount, 'description': description,
+            'category': category}
+
+
+@pytest.fixture
+def path(tmp_path, monkeypatch):
+    # Compact only when a test asks for it
+    monkeypatch.setattr(LedgerStore, 'COMPACT_MIN_OPS', 10**9)
+    monkeypatch.setattr(LedgerStore, 'FSYNC_LOG', False)
+    return tmp_path
+
+
+def descriptions(store):
+    return [row['description'] for row in store.rows()]
+
+
+def test_replay_keeps_line_separators_in_descriptions(path):
+    texts = [
+        'form\x0cfeed', 'next\x85line', 'line\u2028separator',
+        'paragraph\u2029separator', 'file\x1cseparator', 'group\x1dseparator',
+        'vertical\x0btab', 'multi\nline', 'carriage\rreturn', 'quote " and, comma',
+    ]
+    writer = open_store(path)
+    for text in texts:
+        writer.add(expense(text))
+    writer.add_many([expense(text + ' batch') for text in texts])
+
+    reader = open_store(path)
+    assert descriptions(reader) == texts + [text + ' batch' for text in texts]
+    assert reader.total() == pytest.approx(200.0)
+
+
+def test_replay_applies_edits_and_deletes_from_other_workers(path):
+    writer = open_store(path)
+    reader = open_store(path)
+    ids = [writer.add(expense(f'row {i}')) for i in range(3)]
+    assert len(reader.rows()) == 3
+
+    writer.update(ids[0], {'amount': '25.50', 'description': 'edited\u2028row'})
+    writer.delete(ids[1])
+    rows = reader.rows()
+    assert [row['id'] for row in rows] == [ids[0], ids[2]]
+    assert rows[0]['description'] == 'edited\u2028row'
+    assert reader.total() == pytest.approx(35.5)
+
+
+def test_malformed_log_entries_are_skipped(path, capsys):
+    writer = open_store(path)
+    writer.add(expense('first'))
+    with open(writer.log_filename, 'a') as f:
+        f.write('add,notanumber,2025-01-01,1,x,Food\n')
+        f.write('add,7,2025-01-01\n')
+        f.write('set,1\n')
+        f.write('del\n')
+        f.write('bogus,3\n')
+        f.write('\n')
+    writer.add(expense('second'))
+
+    reader = open_store(path)
+    assert descriptions(reader) == ['first', 'second']
+    assert 'Skipping bad entry' in capsys.readouterr().out
+    # The routes that read the table still work
+    assert reader.total() == pytest.approx(20.0)
+    assert reader.category_totals() == {'Food': pytest.approx(20.0)}
+
+
+def test_snapshot_rows_with_bad_ids_are_skipped(path, capsys):
+    with open(path / 'expenses.csv', 'w') as f:
+        f.write('id,date,amount,description,category\n')
+        f.write('1,2025-01-01,5,ok,Food\n')
+        f.write('x,2025-01-02,6,bad id,Food\n')
+        f.write('3,2025-01-03,7,also ok,Food\n')
+    store = open_store(path)
+    assert descriptions(store) == ['ok', 'also ok']
+    assert 'bad id' in capsys.readouterr().out
+    assert store.add(expense('new')) == 4
+
+
+def test_ids_of_deleted_records_are_not_reused(path):
+    store = open_store(path)
+    ids = [store.add(expense(f'row {i}')) for i in range(3)]
+    store.delete(ids[-1])
+    assert store.add(expense('after delete')) == ids[-1] + 1
+
+    # Across a compaction, which keeps a del marker for the highest id
+    newest = store.add(expense('newest'))
+    store.delete(newest)
+    store.compact()
+    with open(store.log_filename) as f:
+        assert f.read() == f'del,{newest}\n'
+    assert open_store(path).add(expense('after compaction')) == newest + 1
+    assert store.add(expense('same worker')) == newest + 2
+
+
+def _add_rows(filename, prefix, count):
+    store = LedgerStore(filename, HEADERS)
+    store.FSYNC_LOG = False
+    for i in range(count):
+        store.add(expense(f'{prefix} {i}', amount='1'))
+
+
+def test_compaction_racing_another_process(path):
+    store = open_store(path)
+    store.add(expense('seed', amount='1'))
+    count = 300
+    context = multiprocessing.get_context('fork')
+    writer = context.Process(target=_add_rows, args=(store.filename, 'child', count))
+    writer.start()
+    # Compact repeatedly and write from this process while the child writes
+    for i in range(count):
+        store.add(expense(f'parent {i}', amount='1'))
+        if i % 25 == 0:
+            store.compact()
+    writer.join(60)
+    assert writer.exitcode == 0
+    store.compact()
+
+    for reader in (store, open_store(path)):
+        rows = reader.rows()
+        ids = [row['id'] for row in rows]
+        assert len(rows) == 1 + 2 * count
+        assert len(set(ids)) == len(ids)
+        assert ids == sorted(ids)
+        assert reader.total() == pytest.approx(1 + 2 * count)
+        texts = set(descriptions(reader))
+        assert {f'child {i}' for i in range(count)} <= texts
+        assert {f'parent {i}' for i in range(count)} <= texts
+
+
+def test_cold_csv_parse_writes_the_binary_copy(path, monkeypatch):
+    (path / 'expenses.csv').write_text(
+        'id,date,amount,description,category\n'
+        '1,2025-01-15,10.00,lunch,Food\n'
+        '2,2025-01-16,25.50,train,Transport\n'
+    )
+    store = open_store(path)
+    store.add(expense('after the parse'))
+    store._binary_writer.join(10)
+    assert binary_ledger.is_current(store.binary_filename,
+                                    _file_stamp(store.filename))
+
+    def no_csv(*_args):
+        raise AssertionError('parsed the CSV despite a current binary copy')
+
+    monkeypatch.setattr(LedgerStore, '_read_csv', no_csv)
+    reader = open_store(path)
+    assert descriptions(reader) == ['lunch', 'train', 'after the parse']
+    assert reader._binary_writer is None
+
+
+class GatedStore:
+    """add_many() holds its first batch until released, so adds pile up behind it"""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.batches = []
+        self.release = threading.Event()
+
+    def add_many(self, rows):
+        self.batches.append(rows)
+        if len(self.batches) == 1:
+            self.release.wait(10)
+        if self.error is not None:
+            raise self.error
+        first = sum(len(batch) for batch in self.batches[:-1]) + 1
+        return list(range(first, first + len(rows)))
+
+
+def add_concurrently(writes, store, count):
+    """Add row 0, then rows 1..count while row 0's batch is being written"""
+    results = {}
+
+    def add(i):
+        try:
+            results[i] = writes.add(i)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=add, args=(0,))]
+    threads[0].start()
+    while not store.batches:
+        time.sleep(0.001)
+    threads += [threading.Thread(target=add, args=(i,)) for i in range(1, count + 1)]
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 10
+    while writes._queue.qsize() < count and time.monotonic() < deadline:
+        time.sleep(0.001)
+    store.release.set()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+def test_concurrent_adds_share_one_batch():
+    store = GatedStore()
+    results = add_concurrently(WriteQueue(store), store, 20)
+    assert store.batches[0] == [0]
+    assert len(store.batches) == 2
+    assert sorted(store.batches[1]) == list(range(1, 21))
+    # Every add gets the id its row was written with
+    ids = dict(zip(store.batches[1], range(2, 22), strict=True))
+    assert results == {0: 1, **ids}
+
+
+def test_failing_store_raises_in_every_waiting_add():
+    error = OSError('disk full')
+    store = GatedStore(error)
+    results = add_concurrently(WriteQueue(store), store, 20)
+    assert len(store.batches) == 2
+    assert set(results) == set(range(21))
+    assert all(result is error for result in results.values())
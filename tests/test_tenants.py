@@ -0,0 +1,66 @@
+"""Eviction in tenants.TenantRegistry and the SQLite connection pool"""
+import os
+import sqlite3
+
+import pytest
+
+import sqlite_store
+from sqlite_store import SqliteLedgerStore
+from tenants import TENANT_OVERHEAD_BYTES, TenantRegistry
+
+HEADERS = ['date', 'amount', 'description', 'category']
+
+
+class SqliteTenant:
+    def __init__(self, directory):
+        self.store = SqliteLedgerStore(
+            os.path.join(directory, 'finance.db'), 'expenses', HEADERS
+        )
+        self.closed = False
+
+    def resident_bytes(self):
+        return self.store.resident_bytes()
+
+    def close(self):
+        self.closed = True
+        self.store.close()
+
+
+def pooled_databases():
+    return set(sqlite_store._pool())
+
+
+def test_eviction_closes_the_tenant_and_its_connections(tmp_path):
+    # Room for one tenant
+    registry = TenantRegistry(str(tmp_path), SqliteTenant, TENANT_OVERHEAD_BYTES)
+    alice = registry.get('alice')
+    alice.store.add({'date': '2025-01-15', 'amount': '10', 'description': 'lunch',
+                     'category': 'Food'})
+    conn = sqlite_store.connect(alice.store.database)
+    assert alice.store.database in pooled_databases()
+
+    bob = registry.get('bob')
+    assert 'alice' not in registry and 'bob' in registry
+    assert alice.closed and not bob.closed
+    assert alice.store.database not in pooled_databases()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+
+    # A request still holding the dropped tenant reconnects
+    assert len(alice.store) == 1
+
+
+def test_other_threads_drop_closed_connections_on_their_next_connect(tmp_path):
+    first, second = str(tmp_path / 'first.db'), str(tmp_path / 'second.db')
+    conn = sqlite_store.connect(first)
+    sqlite_store.connect(second)
+    # As if another thread closed it: bump the count without pruning here
+    with sqlite_store._closes_lock:
+        sqlite_store._closes[first] = sqlite_store._closes.get(first, 0) + 1
+    assert first in pooled_databases()
+
+    sqlite_store.connect(second)
+    assert first not in pooled_databases()
+    with pytest.raises(sqlite3.ProgrammingError):
+        conn.execute('SELECT 1')
+    assert sqlite_store.connect(first) is not conn
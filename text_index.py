@@ -0,0 +1,143 @@
+"""
+Inverted index over a ledger's description (or source) column.
+
+Each text is split into lowercase word tokens, and every token maps to a
+posting list: the sorted ids of the records containing it. A query
+matches records containing every query word as a token or a token prefix
+("swig" finds "Swiggy order"), so a lookup is a binary search in the
+sorted vocabulary plus unions and intersections of posting lists (done
+with a boolean mask over the id range, so O(postings) rather than a
+sort); it never looks at the texts themselves.
+
+Ids only grow, so a new record's id goes at the end of its postings; the
+appended ids are kept in a list per token and merged into the array on
+the next lookup. LedgerTable builds the index on the first search and
+keeps it up to date on every add, edit and delete.
+"""
+import bisect
+import re
+
+import numpy as np
+
+TOKEN = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Distinct lowercase word tokens of text"""
+    return set(TOKEN.findall((text or '').lower()))
+
+
+class TextIndex:
+    """Posting lists of record ids by token"""
+
+    def __init__(self):
+        self._postings = {}   # token -> sorted int64 array of ids
+        self._pending = {}    # token -> ids appended since the last lookup
+        self._vocabulary = []
+        self._vocabulary_stale = False
+        self._max_id = 0
+
+    @classmethod
+    def build(cls, ids, texts):
+        """Index texts[i] under ids[i] (ids sorted ascending)"""
+        index = cls()
+        # Ledgers repeat the same descriptions a lot: tokenize each one once
+        positions = {}
+        for i, text in enumerate(texts):
+            positions.setdefault(text, []).append(i)
+        by_token = {}
+        for text, rows in positions.items():
+            for token in tokenize(text):
+                by_token.setdefault(token, []).append(rows)
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids):
+            index._max_id = int(ids[-1])
+        for token, groups in by_token.items():
+            rows = np.concatenate([np.asarray(g, dtype=np.int64) for g in groups])
+            rows.sort()
+            index._postings[token] = ids[rows]
+        index._vocabulary = sorted(index._postings)
+        return index
+
+    def _posting(self, token):
+        pending = self._pending.pop(token, None)
+        if pending:
+            posting = self._postings.get(token)
+            added = np.array(pending, dtype=np.int64)
+            posting = added if posting is None else np.concatenate([posting, added])
+            self._postings[token] = posting
+        return self._postings.get(token)
+
+    def _new_token(self, token):
+        if token not in self._postings and token not in self._pending:
+            self._vocabulary_stale = True
+
+    def add(self, record_id, text):
+        """Index a record whose id is larger than every indexed id"""
+        self._max_id = max(self._max_id, record_id)
+        for token in tokenize(text):
+            self._new_token(token)
+            self._pending.setdefault(token, []).append(record_id)
+
+    def insert(self, record_id, text):
+        """Index a record with any id (an edited one)"""
+        self._max_id = max(self._max_id, record_id)
+        for token in tokenize(text):
+            posting = self._posting(token)
+            if posting is None:
+                self._vocabulary_stale = True
+                self._postings[token] = np.array([record_id], dtype=np.int64)
+                continue
+            i = int(np.searchsorted(posting, record_id))
+            if i == len(posting) or posting[i] != record_id:
+                self._postings[token] = np.insert(posting, i, record_id)
+
+    def remove(self, record_id, text):
+        """Drop a record indexed with text"""
+        for token in tokenize(text):
+            posting = self._posting(token)
+            if posting is None:
+                continue
+            i = int(np.searchsorted(posting, record_id))
+            if i < len(posting) and posting[i] == record_id:
+                self._postings[token] = np.delete(posting, i)
+
+    def nbytes(self):
+        """Approximate memory held by the posting lists"""
+        pending = sum(len(ids) for ids in self._pending.values())
+        return sum(p.nbytes for p in self._postings.values()) + 8 * pending
+
+    def _prefix_tokens(self, prefix):
+        if self._vocabulary_stale:
+            self._vocabulary = sorted(set(self._postings) | set(self._pending))
+            self._vocabulary_stale = False
+        vocabulary = self._vocabulary
+        lo = bisect.bisect_left(vocabulary, prefix)
+        hi = bisect.bisect_left(vocabulary, prefix + '\uffff', lo)
+        return vocabulary[lo:hi]
+
+    def lookup(self, query):
+        """
+        Sorted ids of the records matching every word of query (each as a
+        token prefix); None for a query without words
+        """
+        words = sorted(tokenize(query))
+        if not words:
+            return None
+        result = None
+        for word in words:
+            postings = [self._posting(token) for token in self._prefix_tokens(word)]
+            postings = [p for p in postings if p is not None and len(p)]
+            if not postings:
+                return np.empty(0, dtype=np.int64)
+            if len(postings) == 1 and result is None:
+                result = postings[0]
+                continue
+            # Ids matching this word (any of its tokens), as a mask
+            mask = np.zeros(self._max_id + 1, dtype=bool)
+            for posting in postings:
+                mask[posting] = True
+            result = np.flatnonzero(mask) if result is None else result[mask[result]]
+            if not len(result):
+                break
+        return result